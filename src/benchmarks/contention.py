@@ -0,0 +1,129 @@
+"""
+Chat latency under background load, through the LLM governor.
+
+Bulk question generation for several "users" saturates a deliberately small
+governor while a chat user keeps answering questions. The same run is done
+with the chat calls in their own interactive class and with everything
+queued as bulk, against the fake OpenAI server (no MongoDB needed). Besides
+end-to-end latency it reports how long the chat calls waited in the governor
+queue, which is the part admission control is responsible for:
+
+    python -m benchmarks.contention --bulk-users 3 --bulk-calls 40 --chat-calls 20
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import llm.governor as governor_module
+from benchmarks.fake_openai import FakeOpenAIServer, FakeServerProfile
+from benchmarks.hedging import ANSWER, QUESTION, SECTION, _percentile
+from config import LLMPriority as Priority
+from config import settings
+from llm.governor import LLMGovernor, Permit, in_llm_context, llm_context
+
+
+class _RecordingGovernor(LLMGovernor):
+    """Keeps the governor queue wait of the chat user's calls."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_queue_waits: list[float] = []
+
+    def acquire(
+        self, priority: Priority, estimated_tokens: int, user: str | None = None
+    ) -> Permit:
+        permit = super().acquire(priority, estimated_tokens, user)
+        if user == "chat-user":
+            self.chat_queue_waits.append(permit.queue_wait)
+        return permit
+
+
+def _bulk_worker(user: str, calls: int, stop: threading.Event) -> None:
+    from llm.llm import generate_questions
+
+    with llm_context(user_id=user, priority="bulk"):
+        for _ in range(calls):
+            if stop.is_set():
+                return
+            generate_questions(SECTION, 5)
+
+
+def _chat_latencies(calls: int, priority: str | None) -> list[float]:
+    from llm.llm import evaluate_answer
+
+    latencies = []
+    with llm_context(user_id="chat-user", priority=priority):
+        for _ in range(calls):
+            started_at = time.perf_counter()
+            evaluate_answer(ANSWER, QUESTION, SECTION)
+            latencies.append(time.perf_counter() - started_at)
+    return latencies
+
+
+def run_scenario(args: argparse.Namespace, chat_priority: str | None) -> dict:
+    governor = _RecordingGovernor(
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        max_concurrency=args.max_concurrency,
+        reserved_interactive_slots=args.reserved_slots,
+    )
+    governor_module._governor = governor
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=args.bulk_users * 2) as pool:
+        for user in range(args.bulk_users):
+            for _ in range(2):
+                pool.submit(
+                    in_llm_context(_bulk_worker), f"bulk-{user}", args.bulk_calls, stop
+                )
+        time.sleep(args.warmup)
+        queued = governor_module.get_governor().snapshot()["queued"]
+        latencies = _chat_latencies(args.chat_calls, chat_priority)
+        stop.set()
+    return {
+        "queued_at_start": queued,
+        "p50": statistics.median(latencies),
+        "p90": _percentile(latencies, 0.9),
+        "max": max(latencies),
+        "queue_p90": _percentile(governor.chat_queue_waits, 0.9),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bulk-users", type=int, default=3)
+    parser.add_argument("--bulk-calls", type=int, default=40)
+    parser.add_argument("--chat-calls", type=int, default=20)
+    parser.add_argument("--rpm", type=float, default=600)
+    parser.add_argument("--tpm", type=float, default=400_000)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--reserved-slots", type=int, default=1)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    args = parser.parse_args()
+
+    profile = FakeServerProfile(
+        ttft_ms=args.ttft_ms, tokens_per_second=args.tokens_per_second, seed=0
+    )
+    with FakeOpenAIServer(profile) as server:
+        settings.OPENAI_BASE_URL = server.base_url
+        _chat_latencies(1, None)  # warm up clients
+        latencies = _chat_latencies(args.chat_calls, None)
+        print(
+            f"{'no load':<12} chat p50 {statistics.median(latencies):.3f}s "
+            f"p90 {_percentile(latencies, 0.9):.3f}s max {max(latencies):.3f}s"
+        )
+        for label, priority in (("interactive", None), ("fifo", "bulk")):
+            result = run_scenario(args, priority)
+            print(
+                f"{label:<12} chat p50 {result['p50']:.3f}s p90 {result['p90']:.3f}s "
+                f"max {result['max']:.3f}s queue wait p90 {result['queue_p90']:.3f}s "
+                f"(queued {result['queued_at_start']})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+End-to-end latency benchmarks for the service layer against the fake OpenAI server.
+
+Run from `src/` with MongoDB available (a throwaway database is used and
+dropped afterwards):
+
+    python -m benchmarks.e2e --repeat 5 --ttft-ms 400 --tokens-per-second 60
+
+Scenarios:
+  - create_sections: `SectionService.create_sections_magically` on a synthetic PDF
+  - generate_questions: `SectionService.generate_questions_magically` for one section
+  - chat_quiz: a full `ChatService` quiz run (answer, help and "next" turns)
+
+For each scenario the wall-clock time and the CPU time spent in this process
+are reported; the CPU/wall ratio is the client-side overhead on top of the
+(simulated) model latency.
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+
+import pymupdf
+
+from benchmarks.fake_openai import FakeOpenAIServer, FakeServerProfile
+from config import settings
+
+PARAGRAPH = (
+    "Small habits compound over time. The author argues that systems matter more "
+    "than goals, and that identity-based habits start from beliefs about who you "
+    "want to become. Feedback loops between cue, craving, response and reward "
+    "explain why behaviours persist. "
+)
+
+
+class LocalFileStorage:
+    """Drop-in replacement for S3StorageService backed by a temp directory."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def upload_file(self, file_data: bytes, unique_key: str) -> str:
+        path = self.root / unique_key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(file_data)
+        return unique_key
+
+    def delete_file(self, file_name: str) -> None:
+        (self.root / file_name).unlink(missing_ok=True)
+
+    def get_file(self, file_name: str) -> bytes:
+        return (self.root / file_name).read_bytes()
+
+
+def make_book_pdf(num_chapters: int, pages_per_chapter: int) -> bytes:
+    """A PDF with a table of contents on page 1 followed by the chapters."""
+    doc = pymupdf.open()
+    toc = doc.new_page()
+    toc_lines = [
+        f"Chapter {i + 1} Topic {i + 1} ..... {1 + i * pages_per_chapter}"
+        for i in range(num_chapters)
+    ]
+    toc.insert_textbox(pymupdf.Rect(50, 50, 550, 800), "\n".join(toc_lines))
+    for chapter in range(num_chapters):
+        for page_number in range(pages_per_chapter):
+            page = doc.new_page()
+            text = f"Chapter {chapter + 1}, page {page_number + 1}\n" + PARAGRAPH * 8
+            page.insert_textbox(pymupdf.Rect(50, 50, 550, 800), text)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def measure(fn: Callable[[], None], repeat: int) -> dict:
+    from llm.telemetry import telemetry
+
+    telemetry.reset()
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        fn()
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+    walls_sorted = sorted(walls)
+    return {
+        "runs": repeat,
+        "wall_mean": statistics.mean(walls),
+        "wall_p50": statistics.median(walls),
+        "wall_p95": walls_sorted[min(len(walls) - 1, int(0.95 * len(walls)))],
+        "cpu_mean": statistics.mean(cpus),
+        "cpu_overhead": sum(cpus) / sum(walls) if sum(walls) else 0.0,
+        "llm": telemetry.summary(group_by="task"),
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    settings.MONGO_DATABASE_NAME = args.mongo_db
+
+    from db.mongo_connection import get_mongo_database
+    from repositories.book_repo import BookRepository
+    from repositories.chat_session_repo import ChatSessionRepository
+    from repositories.section_repo import SectionRepository
+    from repositories.session_store import InMemorySessionStore
+    from services.book_service import BookService
+    from services.chat_service import ChatService
+    from services.progress_service import get_progress_service
+    from services.section_service import SectionService
+    from services.spaced_repetition import get_spaced_repetition_service
+
+    results = {}
+    with tempfile.TemporaryDirectory() as storage_dir:
+        book_service = BookService(
+            book_repo=BookRepository(),
+            s3_storage=LocalFileStorage(storage_dir),
+            section_repo=SectionRepository(),
+        )
+        section_service = SectionService(book_service, SectionRepository())
+        session_store = InMemorySessionStore()
+        chat_service_factory = lambda: ChatService(  # noqa: E731
+            chat_session_repo=ChatSessionRepository(),
+            section_service=section_service,
+            book_service=book_service,
+            session_store=session_store,
+            spaced_repetition=get_spaced_repetition_service(),
+            progress_service=get_progress_service(),
+        )
+
+        book = book_service.upload_book(
+            file_data=make_book_pdf(args.chapters, args.pages_per_chapter),
+            title=f"bench-{uuid.uuid4()}",
+            type="pdf",
+            user_id=uuid.uuid4(),
+        )
+        content_end_page = args.chapters * args.pages_per_chapter
+
+        def create_sections():
+            section_service.delete_all_sections(book.id)
+            section_service.create_sections_magically(
+                book_id=book.id,
+                example_titles=["Topic 1"],
+                start_page=2,
+                content_end_page=content_end_page,
+                preface_start_page=0,
+                preface_end_page=0,
+            )
+
+        results["create_sections"] = measure(create_sections, args.repeat)
+        sections = section_service.get_sections_by_book_id(book.id)
+
+        def generate_questions():
+            section_service.generate_questions_magically(
+                sections[0].id, num_questions=args.questions
+            )
+
+        results["generate_questions"] = measure(generate_questions, args.repeat)
+
+        def chat_quiz():
+            chat_service = chat_service_factory()
+            chat_service.init_chat_session(
+                user_id=book.user_id,
+                document_id=book.id,
+                section_ids=[sections[0].id],
+            )
+            question = chat_service.get_next_question()
+            turn = 0
+            while question is not None:
+                if turn % 3 == 0:
+                    chat_service.process_user_message("Can you explain this concept?")
+                answer = question.question.rstrip("?")
+                chat_service.process_user_message(
+                    f"I think {answer} because small habits compound"
+                )
+                turn += 1
+                if chat_service.process_user_message("next") == "__ALL_DONE__":
+                    break
+                question = chat_service.current_question
+            chat_service.finish_chat_session()
+
+        results["chat_quiz"] = measure(chat_quiz, args.repeat)
+
+        book_service.delete_book(book.id)
+        section_service.delete_all_sections(book.id)
+    get_mongo_database().client.drop_database(args.mongo_db)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--pages-per-chapter", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo-db", default="ai-memory-assistant-bench")
+    parser.add_argument("--json", type=Path, default=None, help="Write results here")
+    args = parser.parse_args()
+
+    profile = FakeServerProfile(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    with FakeOpenAIServer(profile) as server:
+        settings.OPENAI_BASE_URL = server.base_url
+        results = run(args)
+
+    for name, result in results.items():
+        print(
+            f"{name:<20} wall mean {result['wall_mean']:.3f}s "
+            f"p50 {result['wall_p50']:.3f}s p95 {result['wall_p95']:.3f}s "
+            f"cpu {result['cpu_mean']:.3f}s ({result['cpu_overhead']:.1%} of wall)"
+        )
+        for row in result["llm"]:
+            print(
+                f"    {row['task']:<22} calls {row['llm_calls_total']:.0f} "
+                f"prompt tokens {row['llm_prompt_tokens_total']:.0f} "
+                f"cached {row['cache_hit_rate']:.0%} "
+                f"p95 {row['latency_p95']:.2f}s"
+            )
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Local stand-in for the OpenAI chat-completions API.
+
+Implements `POST /v1/chat/completions` the way `langchain_openai.ChatOpenAI`
+uses it: plain and streamed completions, function-calling structured output
+and `response_format: json_schema`. Structured responses are schema-valid fake
+`SectionInfoList`, `QuestionList`, router, evaluation (and any other) payloads.
+Latency (including a slow tail), token rate and injected errors are configurable,
+and prompt caching is simulated the way the provider does it: prompts of at
+least 1024 tokens report the longest previously seen prefix, in 128-token
+blocks, as `cached_tokens`.
+
+Run standalone from `src/`:
+
+    python -m benchmarks.fake_openai --port 8089 --ttft-ms 400 --tokens-per-second 60
+
+and set OPENAI_BASE_URL=http://127.0.0.1:8089/v1.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pydantic import BaseModel
+
+WORDS = (
+    "the learner should explain how the main concept connects to practical "
+    "examples and why the author emphasises consistent small improvements over "
+    "time while considering feedback loops incentives and identity"
+).split()
+TOC_LINE_PATTERN = re.compile(
+    r"^\s*(?:chapter\s+\d+[:.]?\s*)?(.+?)\s*\.{2,}\s*(\d+)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+NUM_QUESTIONS_PATTERN = re.compile(r"create\s+(\d+)\s+questions", re.IGNORECASE)
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+CHARS_PER_TOKEN = 4
+
+
+class FakeServerProfile(BaseModel):
+    """Latency, token-rate and error-injection settings for the fake server."""
+
+    ttft_ms: float = 300.0
+    tokens_per_second: float = 80.0
+    jitter: float = 0.2
+    completion_tokens: int = 120
+    error_rate: float = 0.0
+    error_statuses: list[int] = [429, 500, 503]
+    # Fraction of requests whose time to first token is `slow_factor` times longer
+    slow_rate: float = 0.0
+    slow_factor: float = 10.0
+    prompt_caching: bool = True
+    seed: int | None = None
+
+
+def _words(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def _fake_section_info(prompt: str, rng: random.Random) -> dict:
+    matches = TOC_LINE_PATTERN.findall(prompt)
+    if matches:
+        sections = [{"title": t.strip(), "page_number": int(p)} for t, p in matches]
+    else:
+        sections = [
+            {"title": f"Chapter {i + 1}", "page_number": 1 + i * 10} for i in range(5)
+        ]
+    return {"sections_info": sections}
+
+
+def _fake_questions(prompt: str, rng: random.Random) -> dict:
+    match = NUM_QUESTIONS_PATTERN.search(prompt)
+    count = int(match.group(1)) if match else 3
+    return {
+        "questions": [
+            {"question": f"How does {_words(rng, 6)[:-1].lower()} apply in practice?"}
+            for _ in range(count)
+        ]
+    }
+
+
+def _fake_router(prompt: str, rng: random.Random) -> dict:
+    message = prompt.split("User Message:")[-1].split("\n")[0]
+    return {"type": "help" if "?" in message else "answer"}
+
+
+FAKE_PAYLOADS = {
+    "SectionInfoList": _fake_section_info,
+    "QuestionList": _fake_questions,
+    "Question": lambda prompt, rng: {"question": f"What is {_words(rng, 5)[:-1]}?"},
+    "UserMessageRouterOutput": _fake_router,
+    "UserAnswerEvaluationOutput": lambda prompt, rng: {
+        "feedback": _words(rng, 40),
+        "score": float(rng.randint(4, 10)),
+    },
+    "UserExplanationGenerationOutput": lambda prompt, rng: {
+        "explanation": _words(rng, 80)
+    },
+    "QuestionReference": lambda prompt, rng: {
+        "reference_answer": _words(rng, 40),
+        "rubric": [_words(rng, 8) for _ in range(4)],
+    },
+}
+
+
+def fake_from_schema(schema: dict, rng: random.Random, defs: dict | None = None):
+    """Generate a value that validates against a (pydantic-generated) JSON schema."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return fake_from_schema(defs[schema["$ref"].split("/")[-1]], rng, defs)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if "const" in schema:
+        return schema["const"]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            return fake_from_schema(options[0], rng, defs)
+
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {
+            name: fake_from_schema(prop, rng, defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [fake_from_schema(schema.get("items", {}), rng, defs) for _ in range(3)]
+    if kind == "integer":
+        return rng.randint(1, 10)
+    if kind == "number":
+        return round(rng.uniform(0, 10), 1)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "null":
+        return None
+    return _words(rng, 6)
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class PrefixCache:
+    """Remembers prompt prefixes at 128-token block boundaries (LRU)."""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._seen: OrderedDict[bytes, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, prompt: str) -> int:
+        """Number of cached prompt tokens; stores the prompt's prefixes."""
+        total = _approx_tokens(prompt)
+        cached = 0
+        with self._lock:
+            for boundary in range(CACHE_MIN_TOKENS, total + 1, CACHE_BLOCK_TOKENS):
+                key = hashlib.sha1(
+                    prompt[: boundary * CHARS_PER_TOKEN].encode()
+                ).digest()
+                if key in self._seen:
+                    cached = boundary
+                    self._seen.move_to_end(key)
+                else:
+                    self._seen[key] = None
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return cached
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    profile: FakeServerProfile = FakeServerProfile()
+    rng: random.Random = random.Random()
+    rng_lock = threading.Lock()
+    prefix_cache: PrefixCache = PrefixCache()
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def handle(self) -> None:
+        # Clients drop connections on purpose, e.g. cancelled hedged requests
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sleep(self, seconds: float) -> None:
+        with self.rng_lock:
+            factor = 1 + self.rng.uniform(-self.profile.jitter, self.profile.jitter)
+        time.sleep(max(seconds * factor, 0))
+
+    def do_POST(self):  # noqa: N802
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.rng_lock:
+            rng = random.Random(self.rng.random())
+            inject_error = self.rng.random() < self.profile.error_rate
+            slow = self.rng.random() < self.profile.slow_rate
+        ttft = self.profile.ttft_ms / 1000 * (self.profile.slow_factor if slow else 1)
+        if inject_error:
+            self._sleep(ttft)
+            status = rng.choice(self.profile.error_statuses)
+            self._send_json(
+                status, {"error": {"message": "Injected error", "type": "fake_error"}}
+            )
+            return
+
+        prompt = "\n".join(
+            m["content"]
+            if isinstance(m.get("content"), str)
+            else json.dumps(m.get("content"))
+            for m in request.get("messages", [])
+        )
+        content, tool_call = self._build_response(request, prompt, rng)
+        completion_text = (
+            content if tool_call is None else tool_call["function"]["arguments"]
+        )
+        usage = {
+            "prompt_tokens": _approx_tokens(prompt),
+            "completion_tokens": _approx_tokens(completion_text),
+            "total_tokens": _approx_tokens(prompt) + _approx_tokens(completion_text),
+            "prompt_tokens_details": {
+                "cached_tokens": self.prefix_cache.lookup_and_store(prompt)
+                if self.profile.prompt_caching
+                else 0
+            },
+        }
+
+        if request.get("stream"):
+            self._stream(request, content, tool_call, usage, ttft)
+        else:
+            self._sleep(
+                ttft + usage["completion_tokens"] / self.profile.tokens_per_second
+            )
+            message = {"role": "assistant", "content": content}
+            if tool_call is not None:
+                message = {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [tool_call],
+                }
+            self._send_json(
+                200,
+                {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": message,
+                            "finish_reason": "tool_calls" if tool_call else "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+
+    def _build_response(self, request: dict, prompt: str, rng: random.Random):
+        schema_name, schema = None, None
+        if request.get("tools"):
+            function = request["tools"][0]["function"]
+            schema_name, schema = function["name"], function.get("parameters", {})
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            json_schema = response_format["json_schema"]
+            schema_name, schema = json_schema["name"], json_schema.get("schema", {})
+
+        if schema is None:
+            text = _words(rng, self.profile.completion_tokens)
+            if "Score: <number" in prompt:
+                text += f"\nScore: {rng.randint(4, 10)}"
+            return text, None
+
+        factory = FAKE_PAYLOADS.get(schema_name)
+        payload = factory(prompt, rng) if factory else fake_from_schema(schema, rng)
+        arguments = json.dumps(payload)
+        if request.get("tools"):
+            return None, {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": schema_name, "arguments": arguments},
+            }
+        return arguments, None
+
+    def _stream(
+        self, request: dict, content, tool_call, usage: dict, ttft: float
+    ) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+        }
+
+        def send(delta: dict, finish_reason: str | None = None, **extra) -> None:
+            chunk = {
+                **base,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+                **extra,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        self._sleep(ttft)
+        send({"role": "assistant", "content": ""})
+        text = content if tool_call is None else tool_call["function"]["arguments"]
+        pieces = re.findall(r"\S+\s*", text)
+        for piece in pieces:
+            self._sleep(_approx_tokens(piece) / self.profile.tokens_per_second)
+            if tool_call is None:
+                send({"content": piece})
+            else:
+                send(
+                    {
+                        "tool_calls": [
+                            {
+                                "index": 0,
+                                "id": tool_call["id"],
+                                "type": "function",
+                                "function": {
+                                    "name": tool_call["function"]["name"],
+                                    "arguments": piece,
+                                },
+                            }
+                        ]
+                    }
+                )
+        send({}, finish_reason="tool_calls" if tool_call else "stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = {**base, "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def _serve(host: str, port: int, profile: FakeServerProfile) -> None:
+    handler = type(
+        "ConfiguredFakeOpenAIHandler",
+        (FakeOpenAIHandler,),
+        {
+            "profile": profile,
+            "rng": random.Random(profile.seed),
+            "prefix_cache": PrefixCache(),
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeOpenAIServer:
+    """
+    Runs the fake server in a child process so its CPU time doesn't count
+    against the client being benchmarked. Use as a context manager.
+    """
+
+    def __init__(
+        self,
+        profile: FakeServerProfile | None = None,
+        host: str = "127.0.0.1",
+        port: int | None = None,
+    ):
+        self.profile = profile or FakeServerProfile()
+        self.host = host
+        self.port = port or _free_port()
+        self._process: multiprocessing.Process | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.host, self.port, self.profile), daemon=True
+        )
+        self._process.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("Fake OpenAI server did not start")
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(timeout=5)
+            self._process = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    profile = FakeServerProfile(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_factor=args.slow_factor,
+        seed=args.seed,
+    )
+    print(f"Fake OpenAI server on http://{args.host}:{args.port}/v1")
+    _serve(args.host, args.port, profile)
+
+
+if __name__ == "__main__":
+    main()
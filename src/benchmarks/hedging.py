@@ -0,0 +1,127 @@
+"""
+Tail-latency benchmark for hedged requests against the fake OpenAI server.
+
+The server is started with a slow tail (a fraction of requests take
+`--slow-factor` times longer to produce their first token) and the same
+interactive calls are made with hedging disabled and enabled:
+
+    python -m benchmarks.hedging --calls 200 --slow-rate 0.05 --slow-factor 10
+
+Reports p50/p90/p99 latency of `evaluate_answer` and time to first chunk of
+`stream_explanation`, plus how many extra (hedged) requests were sent.
+No MongoDB is needed.
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_openai import FakeOpenAIServer, FakeServerProfile
+from config import LLMTaskPolicy, settings
+
+QUESTION = "Why do systems matter more than goals?"
+ANSWER = "Because goals only set a direction while systems produce the daily progress."
+SECTION = "Small habits compound over time. Systems matter more than goals. " * 20
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _evaluate() -> float:
+    from llm.llm import evaluate_answer
+
+    started_at = time.perf_counter()
+    evaluate_answer(ANSWER, QUESTION, SECTION)
+    return time.perf_counter() - started_at
+
+
+def _explanation_first_chunk() -> float:
+    from llm.llm import stream_explanation
+
+    started_at = time.perf_counter()
+    chunks = stream_explanation("What does this mean?", QUESTION, SECTION)
+    next(chunks)
+    elapsed = time.perf_counter() - started_at
+    for _ in chunks:
+        pass
+    return elapsed
+
+
+def run_scenario(hedge: bool, args: argparse.Namespace) -> dict:
+    import llm.executor as executor_module
+    from llm.executor import HedgedRequestExecutor
+
+    executor_module._executor = HedgedRequestExecutor(
+        hedge_budget_ratio=args.hedge_budget, min_samples=args.min_samples
+    )
+    for task in ("evaluate_answer", "generate_explanation"):
+        settings.LLM_TASKS[task] = LLMTaskPolicy(
+            deadline=args.deadline, hedge=hedge, hedge_delay=args.hedge_delay
+        )
+
+    results = {}
+    for name, fn in (
+        ("evaluate_answer", _evaluate),
+        ("explanation_ttfc", _explanation_first_chunk),
+    ):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = list(pool.map(lambda _, fn=fn: fn(), range(args.calls)))
+        results[name] = {
+            "p50": statistics.median(latencies),
+            "p90": _percentile(latencies, 0.9),
+            "p99": _percentile(latencies, 0.99),
+        }
+    executor = executor_module.get_executor()
+    results["hedged_requests"] = executor.hedged_requests
+    results["primary_requests"] = executor.primary_requests
+    executor.shutdown()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--deadline", type=float, default=30.0)
+    parser.add_argument(
+        "--hedge-delay", type=float, default=None, help="Default: observed p90"
+    )
+    parser.add_argument("--hedge-budget", type=float, default=0.1)
+    parser.add_argument("--min-samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    profile = FakeServerProfile(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=60,
+        slow_rate=args.slow_rate,
+        slow_factor=args.slow_factor,
+        seed=args.seed,
+    )
+    with FakeOpenAIServer(profile) as server:
+        settings.OPENAI_BASE_URL = server.base_url
+        for hedge in (False, True):
+            results = run_scenario(hedge, args)
+            print(
+                f"hedging {'on ' if hedge else 'off'}: "
+                f"{results['hedged_requests']} hedges / "
+                f"{results['primary_requests']} requests"
+            )
+            for name in ("evaluate_answer", "explanation_ttfc"):
+                row = results[name]
+                print(
+                    f"    {name:<18} p50 {row['p50']:.3f}s "
+                    f"p90 {row['p90']:.3f}s p99 {row['p99']:.3f}s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Offline accuracy benchmark for the local chat message router.
+
+Run from `src/`:
+
+    python -m benchmarks.router_accuracy [--threshold 0.65] [--with-llm]
+
+Reports overall accuracy, per-label precision/recall, how many messages the
+local router would answer on its own at the given confidence threshold (rule
+matches, and answers the model is confident about) and the accuracy on that
+subset. Both data sets are held out from `TRAINING_EXAMPLES`: the threshold
+sweep used to pick ROUTER_CONFIDENCE_THRESHOLD runs on the dev split and the
+reported numbers come from the eval split. `--with-llm` also scores the LLM
+router on the eval split (requires OPENAI_API_KEY).
+"""
+
+import argparse
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+from llm.router import LABELS, classify_message
+
+DATA_PATH = Path(__file__).parent / "data" / "router_eval.jsonl"
+DEV_DATA_PATH = Path(__file__).parent / "data" / "router_dev.jsonl"
+
+
+def load_dataset(path: Path = DATA_PATH) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def report(name: str, labels: list[str], predictions: list[str]) -> None:
+    correct = sum(1 for y, p in zip(labels, predictions, strict=True) if y == p)
+    print(f"\n{name}: accuracy {correct / len(labels):.1%} ({correct}/{len(labels)})")
+    for label in [label.value for label in LABELS]:
+        tp = sum(
+            1 for y, p in zip(labels, predictions, strict=True) if y == p == label
+        )
+        predicted = Counter(predictions)[label]
+        actual = Counter(labels)[label]
+        precision = tp / predicted if predicted else 0.0
+        recall = tp / actual if actual else 0.0
+        print(f"  {label:<7} precision {precision:.2f}  recall {recall:.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--with-llm", action="store_true")
+    args = parser.parse_args()
+
+    threshold = args.threshold
+    if threshold is None:
+        from config import settings
+
+        threshold = settings.ROUTER_CONFIDENCE_THRESHOLD
+
+    dataset = load_dataset()
+    labels = [row["label"] for row in dataset]
+
+    classify_message("warm up", "warm up")
+    started = time.perf_counter()
+    predictions = [classify_message(row["message"], row["question"]) for row in dataset]
+    elapsed = time.perf_counter() - started
+
+    report("local router", labels, [p.type.value for p in predictions])
+    print(f"  mean latency {elapsed / len(dataset) * 1000:.3f} ms/message")
+
+    confident = [
+        (label, p)
+        for label, p in zip(labels, predictions, strict=True)
+        if p.is_decisive(threshold)
+    ]
+    print(
+        f"\nthreshold {threshold}: {len(confident)}/{len(dataset)} "
+        f"({len(confident) / len(dataset):.1%}) handled locally"
+    )
+    if confident:
+        report(
+            "local router above threshold",
+            [label for label, _ in confident],
+            [p.type.value for _, p in confident],
+        )
+
+    dev = load_dataset(DEV_DATA_PATH)
+    dev_predictions = [classify_message(row["message"], row["question"]) for row in dev]
+    print("\ndev split calibration: threshold, handled locally, accuracy of those")
+    for step in range(10, 20):
+        candidate = step / 20
+        handled = [
+            row["label"] == p.type.value
+            for row, p in zip(dev, dev_predictions, strict=True)
+            if p.is_decisive(candidate)
+        ]
+        accuracy = sum(handled) / len(handled) if handled else 0.0
+        print(f"  {candidate:.2f}  {len(handled):>3}/{len(dev)}  {accuracy:.1%}")
+
+    if args.with_llm:
+        from llm.llm import determine_message_type
+
+        llm_predictions = [
+            determine_message_type(
+                message=row["message"], question=row["question"]
+            ).type
+            for row in dataset
+        ]
+        report("llm router", labels, llm_predictions)
+
+
+if __name__ == "__main__":
+    main()
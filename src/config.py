@@ -1,9 +1,124 @@
 import os
+from typing import Literal
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+LLMPriority = Literal["interactive", "editing", "bulk"]
+
+
+class LLMTaskPolicy(BaseModel):
+    """
+    Model tier for one kind of LLM call. `escalation_model` is used to rerun
+    the call when its result fails validation.
+
+    Tasks with a `deadline` (seconds, whole call including retries) run through
+    `llm.executor`; with `hedge` enabled a duplicate request is sent after
+    `hedge_delay`, or after the observed p90 latency when it is unset.
+
+    `priority` is the class the call queues in at the `llm.governor`.
+
+    `max_prompt_tokens` caps the prompt size; `overflow` says what happens to
+    content that doesn't fit (see `llm.budget`).
+    """
+
+    model: str = "gpt-4o"
+    max_tokens: int | None = None
+    timeout: float | None = None
+    escalation_model: str | None = None
+    max_attempts: int = 3
+    deadline: float | None = None
+    hedge: bool = False
+    hedge_delay: float | None = None
+    priority: LLMPriority = "interactive"
+    max_prompt_tokens: int | None = None
+    overflow: Literal["truncate", "digest", "reject"] = "reject"
+
+
+class ModelPrice(BaseModel):
+    """USD per 1M tokens."""
+
+    input: float
+    cached_input: float
+    output: float
+
+
+DEFAULT_LLM_TASKS: dict[str, LLMTaskPolicy] = {
+    "section_info": LLMTaskPolicy(
+        model="gpt-4o-mini",
+        max_tokens=2000,
+        timeout=60,
+        escalation_model="gpt-4o",
+        priority="bulk",
+        max_prompt_tokens=16_000,
+        overflow="truncate",
+    ),
+    "generate_questions": LLMTaskPolicy(
+        model="gpt-4o",
+        max_tokens=2000,
+        timeout=90,
+        max_attempts=5,
+        priority="editing",
+        max_prompt_tokens=12_000,
+        overflow="truncate",
+    ),
+    "improve_question": LLMTaskPolicy(
+        model="gpt-4o-mini",
+        max_tokens=300,
+        timeout=20,
+        priority="editing",
+        max_prompt_tokens=2000,
+    ),
+    "question_reference": LLMTaskPolicy(
+        model="gpt-4o",
+        max_tokens=600,
+        timeout=60,
+        max_attempts=5,
+        priority="editing",
+        max_prompt_tokens=4000,
+        overflow="truncate",
+    ),
+    "message_router": LLMTaskPolicy(
+        model="gpt-4o-mini",
+        max_tokens=20,
+        timeout=10,
+        deadline=15,
+        hedge=True,
+        max_prompt_tokens=2000,
+        overflow="truncate",
+    ),
+    "evaluate_answer": LLMTaskPolicy(
+        model="gpt-4o",
+        max_tokens=1000,
+        timeout=60,
+        deadline=45,
+        hedge=True,
+        max_prompt_tokens=8000,
+        overflow="truncate",
+    ),
+    "generate_explanation": LLMTaskPolicy(
+        model="gpt-4o",
+        max_tokens=1500,
+        timeout=60,
+        deadline=45,
+        hedge=True,
+        max_prompt_tokens=8000,
+        overflow="digest",
+    ),
+}
+
+DEFAULT_LLM_PRICES: dict[str, ModelPrice] = {
+    "gpt-4o": ModelPrice(input=2.50, cached_input=1.25, output=10.00),
+    "gpt-4o-mini": ModelPrice(input=0.15, cached_input=0.075, output=0.60),
+}
+
+
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_nested_delimiter="__")
+
     OPENAI_API_KEY: str
+    # Point at an OpenAI-compatible server, e.g. benchmarks.fake_openai
+    OPENAI_BASE_URL: str | None = None
 
     MONGO_DATABASE_HOST: str = "mongodb://localhost:27017"
     MONGO_DATABASE_NAME: str = "ai-memory-assistant"
@@ -14,4 +129,77 @@ class Settings(BaseSettings):
     AWS_BUCKET_NAME: str
 
     PASSWORD: str
+
+    BULK_GENERATION_MAX_CONCURRENCY: int = 4
+    BULK_GENERATION_REQUESTS_PER_MINUTE: int = 60
+
+    # Process-wide limits enforced by llm.governor
+    LLM_REQUESTS_PER_MINUTE: int = 500
+    LLM_TOKENS_PER_MINUTE: int = 200_000
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_INTERACTIVE_RESERVED_SLOTS: int = 4
+
+    # Hedged requests may add at most this fraction on top of primary requests
+    LLM_HEDGE_BUDGET_RATIO: float = 0.1
+    # Latency samples needed per task before hedging on the observed p90
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+
+    # "local" runs batch jobs in-process against OPENAI_BASE_URL
+    LLM_BATCH_CLIENT: Literal["openai", "local"] = "openai"
+    BATCH_POLL_INTERVAL_SECONDS: float = 60
+
+    # Lowest model confidence at which an answer skips the LLM router,
+    # calibrated on the dev split of benchmarks.router_accuracy
+    ROUTER_CONFIDENCE_THRESHOLD: float = 0.65
+
+    EXAM_GRADING_MAX_CONCURRENCY: int = 8
+    # Answers graded in the background in deferred mode, across all sessions
+    DEFERRED_GRADING_MAX_CONCURRENCY: int = 8
+
+    # Where live chat session state is kept; "memory" only works with one process
+    CHAT_SESSION_STORE: Literal["mongo", "memory"] = "mongo"
+    # In-process memory a session's message history may use before its older
+    # messages are spilled to the session store
+    CHAT_SESSION_MEMORY_BUDGET: int = 64 * 1024
+    # A live session untouched for this long counts as abandoned; its
+    # in-process deferred grades are evicted
+    CHAT_SESSION_TTL_SECONDS: int = 24 * 60 * 60
+
+    # Books per page in the document library
+    LIBRARY_PAGE_SIZE: int = 20
+
+    PASSAGE_MAX_TOKENS: int = 300
+    RETRIEVAL_TOP_K: int = 6
+    RETRIEVAL_TOKEN_BUDGET: int = 2000
+    REFERENCE_PASSAGES_TOKEN_BUDGET: int = 1000
+    # Extractive digest stored on each section, used when its text doesn't fit
+    SECTION_DIGEST_TOKENS: int = 1500
+
+    # Longer sections generate questions per window and merge them locally
+    QUESTION_WINDOW_TOKENS: int = 6000
+    QUESTION_MAX_SIMILARITY: float = 0.6
+
+    # Overrides on top of DEFAULT_LLM_TASKS,
+    # e.g. LLM_TASKS__message_router__model=gpt-4o
+    LLM_TASKS: dict[str, LLMTaskPolicy] = Field(default_factory=dict)
+
+    LLM_PRICES: dict[str, ModelPrice] = Field(
+        default_factory=lambda: dict(DEFAULT_LLM_PRICES)
+    )
+
+    def get_llm_policy(self, task: str) -> LLMTaskPolicy:
+        default = DEFAULT_LLM_TASKS.get(task, LLMTaskPolicy())
+        override = self.LLM_TASKS.get(task)
+        if override is None:
+            return default
+        return default.model_copy(update=override.model_dump(exclude_unset=True))
+
+    def get_model_price(self, model: str) -> ModelPrice | None:
+        """Price for `model`, matching dated snapshots such as gpt-4o-2024-08-06."""
+        for name in sorted(self.LLM_PRICES, key=len, reverse=True):
+            if model == name or model.startswith(f"{name}-"):
+                return self.LLM_PRICES[name]
+        return None
+
+
 settings = Settings()
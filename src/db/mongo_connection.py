@@ -1,3 +1,5 @@
+import os
+
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 from loguru import logger
@@ -27,3 +29,18 @@ def get_mongo_database():
     """Get the main MongoDB database handle"""
     connection = MongoDatabaseConnector()
     return connection[settings.MONGO_DATABASE_NAME]
+
+
+def close_mongo_connection() -> None:
+    client = MongoDatabaseConnector._instance
+    MongoDatabaseConnector._instance = None
+    if client is not None:
+        client.close()
+
+
+def _reset_after_fork() -> None:
+    # MongoClient isn't fork-safe; the child connects again on first use
+    MongoDatabaseConnector._instance = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
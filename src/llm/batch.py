@@ -0,0 +1,223 @@
+"""
+Offline batch jobs in the OpenAI Batch API format.
+
+Requests are serialised as JSONL lines (`custom_id`, `method`, `url`, `body`)
+with the same model, token limit and function-calling structured output that
+`invoke_llm` would use for the task, submitted through a `BatchClient` and
+the output file is parsed back into the task's schema. Batch requests don't
+count against the interactive rate limits and are billed at a discount.
+
+`LocalBatchClient` runs the lines itself against the configured (or a fake)
+OpenAI-compatible endpoint, which is handy for tests and benchmarks.
+"""
+
+import io
+import json
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any
+
+import openai
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from config import settings
+from llm.telemetry import LLMCallRecord, estimate_cost, telemetry
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# Batch requests are billed at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchResult(BaseModel):
+    custom_id: str
+    parsed: Any = None
+    error: str | None = None
+    model: str | None = None
+    usage: dict | None = None
+
+
+def build_batch_line(
+    custom_id: str, task: str, prompt: str, schema: type[BaseModel]
+) -> dict:
+    """One request of a batch input file, forcing `schema` as a tool call."""
+    policy = settings.get_llm_policy(task)
+    tool = convert_to_openai_tool(schema)
+    body = {
+        "model": policy.model,
+        "messages": [{"role": "user", "content": prompt}],
+        "tools": [tool],
+        "tool_choice": {
+            "type": "function",
+            "function": {"name": tool["function"]["name"]},
+        },
+        "parallel_tool_calls": False,
+    }
+    if policy.max_tokens:
+        body["max_tokens"] = policy.max_tokens
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }
+
+
+def to_jsonl(lines: list[dict]) -> str:
+    return "".join(json.dumps(line) + "\n" for line in lines)
+
+
+def _parse_response(body: dict, schema: type[BaseModel]) -> BaseModel:
+    message = body["choices"][0]["message"]
+    if message.get("tool_calls"):
+        arguments = message["tool_calls"][0]["function"]["arguments"]
+    else:
+        arguments = message.get("content") or ""
+    return schema.model_validate_json(arguments)
+
+
+def record_batch_usage(task: str, result: BatchResult) -> None:
+    """Records a batch result in `telemetry` at the discounted batch price."""
+    usage = result.usage or {}
+    model = result.model or settings.get_llm_policy(task).model
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    telemetry.record(
+        LLMCallRecord(
+            task=task,
+            model=model,
+            caller="batch",
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            cost=BATCH_PRICE_FACTOR
+            * estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+            error=result.error,
+        )
+    )
+
+
+def parse_batch_output(output: str, schema: type[BaseModel]) -> dict[str, BatchResult]:
+    """Results of a batch output (and error) file keyed by `custom_id`."""
+    results = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        custom_id = data["custom_id"]
+        response = data.get("response") or {}
+        if data.get("error") or response.get("status_code") != 200:
+            error = data.get("error") or (response.get("body") or {}).get("error")
+            results[custom_id] = BatchResult(custom_id=custom_id, error=str(error))
+            continue
+        body = response["body"]
+        result = BatchResult(
+            custom_id=custom_id, model=body.get("model"), usage=body.get("usage")
+        )
+        try:
+            result.parsed = _parse_response(body, schema)
+        except (KeyError, IndexError, ValidationError) as e:
+            result.error = str(e)
+        results[custom_id] = result
+    return results
+
+
+class BatchClient(ABC):
+    """Submits batch input files and fetches their results."""
+
+    @abstractmethod
+    def submit(self, jsonl: str, metadata: dict[str, str] | None = None) -> str:
+        """Submit a JSONL input file and return the batch ID."""
+
+    @abstractmethod
+    def get_status(self, batch_id: str) -> str:
+        """Provider status, e.g. "in_progress" or "completed"."""
+
+    @abstractmethod
+    def get_output(self, batch_id: str) -> str:
+        """JSONL output of a finished batch, including failed requests."""
+
+
+class OpenAIBatchClient(BatchClient):
+    def __init__(self, client: openai.OpenAI | None = None):
+        self.client = client or openai.OpenAI(
+            api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL
+        )
+
+    def submit(self, jsonl: str, metadata: dict[str, str] | None = None) -> str:
+        input_file = self.client.files.create(
+            file=("batch.jsonl", io.BytesIO(jsonl.encode())), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata,
+        )
+        logger.info(f"Submitted batch {batch.id} ({jsonl.count(chr(10))} requests)")
+        return batch.id
+
+    def get_status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def get_output(self, batch_id: str) -> str:
+        batch = self.client.batches.retrieve(batch_id)
+        output = ""
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                output += self.client.files.content(file_id).text
+        return output
+
+
+class LocalBatchClient(BatchClient):
+    """
+    Executes batch lines synchronously on submit through the chat completions
+    endpoint. Outputs are kept in memory and shared by all instances in the
+    process.
+    """
+
+    _outputs: dict[str, str] = {}
+
+    def __init__(self, client: openai.OpenAI | None = None):
+        self.client = client or openai.OpenAI(
+            api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL
+        )
+
+    def _execute(self, line: dict) -> dict:
+        try:
+            completion = self.client.chat.completions.create(**line["body"])
+        except openai.APIStatusError as e:
+            return {
+                "custom_id": line["custom_id"],
+                "response": {
+                    "status_code": e.status_code,
+                    "body": {"error": e.message},
+                },
+            }
+        return {
+            "custom_id": line["custom_id"],
+            "response": {"status_code": 200, "body": completion.model_dump()},
+        }
+
+    def submit(self, jsonl: str, metadata: dict[str, str] | None = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        lines = [json.loads(line) for line in jsonl.splitlines() if line.strip()]
+        self._outputs[batch_id] = to_jsonl([self._execute(line) for line in lines])
+        return batch_id
+
+    def get_status(self, batch_id: str) -> str:
+        return "completed" if batch_id in self._outputs else "failed"
+
+    def get_output(self, batch_id: str) -> str:
+        return self._outputs.get(batch_id, "")
+
+
+def get_batch_client() -> BatchClient:
+    if settings.LLM_BATCH_CLIENT == "local":
+        return LocalBatchClient()
+    return OpenAIBatchClient()
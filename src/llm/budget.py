@@ -0,0 +1,106 @@
+"""
+Prompt token budgets and cost estimates.
+
+Tasks can set `max_prompt_tokens` in their policy. Prompt builders fit their
+variable part (section text, table of contents, reference content) into what
+the fixed part of the prompt leaves, following the task's `overflow`
+strategy: truncate the content, replace it with the precomputed section
+digest, or reject the call. `invoke_llm` checks the finished prompt again
+before sending it, so nothing over budget reaches the API.
+"""
+
+from langchain_core.messages import BaseMessage
+from loguru import logger
+from pydantic import BaseModel
+
+from config import settings
+from llm.telemetry import estimate_cost
+from llm.tokens import count_tokens, truncate_to_tokens
+
+# Completion budget assumed for tasks without max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+# Kept free when fitting content: tokens merge or split where the content
+# joins the fixed part, so the parts don't add up exactly
+BUDGET_MARGIN_TOKENS = 16
+
+
+class PromptBudgetExceeded(ValueError):
+    def __init__(self, task: str, prompt_tokens: int, max_prompt_tokens: int):
+        self.task = task
+        self.prompt_tokens = prompt_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        super().__init__(
+            f"The {task} prompt would be {prompt_tokens} tokens, "
+            f"over its budget of {max_prompt_tokens}"
+        )
+
+
+def prompt_tokens(prompt: str | list[BaseMessage]) -> int:
+    text = prompt if isinstance(prompt, str) else "\n".join(m.content for m in prompt)
+    return count_tokens(text)
+
+
+def completion_budget(task: str) -> int:
+    return settings.get_llm_policy(task).max_tokens or DEFAULT_COMPLETION_TOKENS
+
+
+def fit_content(
+    task: str, content: str, fixed_tokens: int, digest: str | None = None
+) -> str:
+    """
+    Returns `content` if the prompt stays within the task budget with it,
+    otherwise degrades it according to the task's overflow strategy. The
+    digest strategy falls back to truncation when no digest fits.
+    """
+    policy = settings.get_llm_policy(task)
+    if policy.max_prompt_tokens is None or not content:
+        return content
+    available = policy.max_prompt_tokens - fixed_tokens - BUDGET_MARGIN_TOKENS
+    content_tokens = count_tokens(content)
+    if content_tokens <= available:
+        return content
+
+    if policy.overflow == "digest" and digest and count_tokens(digest) <= available:
+        logger.warning(
+            f"{task} content is {content_tokens} tokens, using the section digest"
+        )
+        return digest
+    if policy.overflow != "reject" and available > 0:
+        logger.warning(
+            f"{task} content is {content_tokens} tokens, truncating to {available}"
+        )
+        return truncate_to_tokens(content, available)
+    raise PromptBudgetExceeded(
+        task, fixed_tokens + content_tokens, policy.max_prompt_tokens
+    )
+
+
+def check_prompt_budget(task: str, prompt: str | list[BaseMessage]) -> int:
+    """Prompt tokens of a finished prompt; raises if it is over the task budget."""
+    tokens = prompt_tokens(prompt)
+    max_prompt_tokens = settings.get_llm_policy(task).max_prompt_tokens
+    if max_prompt_tokens is not None and tokens > max_prompt_tokens:
+        raise PromptBudgetExceeded(task, tokens, max_prompt_tokens)
+    return tokens
+
+
+class CostEstimate(BaseModel):
+    """
+    Upper-bound estimate for a set of calls: full prompts without prompt
+    caching and every completion using its `max_tokens`.
+    """
+
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+
+    def add(self, task: str, input_tokens: int, calls: int = 1) -> None:
+        """Adds `calls` calls of `task` with `input_tokens` prompt tokens in total."""
+        output_tokens = completion_budget(task) * calls
+        self.calls += calls
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += estimate_cost(
+            settings.get_llm_policy(task).model, input_tokens, output_tokens
+        )
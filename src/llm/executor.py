@@ -0,0 +1,266 @@
+"""
+Deadline-aware request executor with hedged requests.
+
+Calls are run as coroutines on a private event loop thread so that a losing
+request can actually be cancelled (closing its HTTP connection). If the first
+attempt hasn't answered after the hedge delay - a fixed value from the task
+policy or the observed p90 latency of the task - a duplicate request is fired
+and whichever finishes first wins. Hedges are limited to a fraction of all
+primary requests process-wide, and retryable errors (429/5xx, timeouts) are
+retried with exponential backoff as long as the deadline allows.
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from typing import Any, TypeVar
+
+from config import LLMTaskPolicy, settings
+from llm.rate_limit import backoff_delay, is_retryable_error
+from llm.telemetry import LLMCall
+
+T = TypeVar("T")
+
+LATENCY_WINDOW = 200
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when a call did not finish within its task deadline."""
+
+
+class HedgedRequestExecutor:
+    def __init__(
+        self,
+        hedge_budget_ratio: float | None = None,
+        min_samples: int | None = None,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+    ):
+        self.hedge_budget_ratio = (
+            hedge_budget_ratio
+            if hedge_budget_ratio is not None
+            else settings.LLM_HEDGE_BUDGET_RATIO
+        )
+        self.min_samples = (
+            min_samples if min_samples is not None else settings.LLM_HEDGE_MIN_SAMPLES
+        )
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._latencies: dict[str, deque[float]] = {}
+        self.primary_requests = 0
+        self.hedged_requests = 0
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="llm-executor", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+                self._loop = None
+                self._thread = None
+
+    def observed_latency(self, task: str, quantile: float = 0.9) -> float | None:
+        with self._lock:
+            samples = sorted(self._latencies.get(task, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def _record_latency(self, task: str, latency: float) -> None:
+        with self._lock:
+            samples = self._latencies.setdefault(task, deque(maxlen=LATENCY_WINDOW))
+            samples.append(latency)
+
+    def _hedge_delay(self, task: str, policy: LLMTaskPolicy) -> float | None:
+        if not policy.hedge:
+            return None
+        if policy.hedge_delay is not None:
+            return policy.hedge_delay
+        return self.observed_latency(task)
+
+    def _try_acquire_hedge(self) -> bool:
+        with self._lock:
+            budget = self.hedge_budget_ratio * self.primary_requests
+            if self.hedged_requests + 1 > budget:
+                return False
+            self.hedged_requests += 1
+            return True
+
+    async def _race(
+        self,
+        task: str,
+        make_attempt: Callable[[], Awaitable[T]],
+        hedge_delay: float | None,
+        call: LLMCall,
+        discard: Callable[[T], Awaitable[None]] | None = None,
+    ) -> T:
+        """
+        Races the attempts. Unfinished losers are cancelled; `discard` is
+        awaited with the result of every loser that finished anyway, e.g. to
+        close a stream it opened.
+        """
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        with self._lock:
+            self.primary_requests += 1
+        pending = {asyncio.ensure_future(make_attempt())}
+        losers: list[asyncio.Future] = []
+        try:
+            if hedge_delay is not None:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+                if not done and self._try_acquire_hedge():
+                    call.mark_hedged()
+                    pending.add(asyncio.ensure_future(make_attempt()))
+                pending |= done
+
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                succeeded = [a for a in done if a.exception() is None]
+                if succeeded:
+                    self._record_latency(task, loop.time() - started_at)
+                    losers = succeeded[1:]
+                    return succeeded[0].result()
+                error = next(iter(done)).exception()
+            raise error
+        finally:
+            for attempt in pending:
+                # cancel() is a no-op on an attempt that already finished
+                if not attempt.cancel() and attempt.exception() is None:
+                    losers.append(attempt)
+            if discard is not None:
+                for attempt in losers:
+                    await discard(attempt.result())
+
+    async def _run(
+        self,
+        task: str,
+        make_attempt: Callable[[], Awaitable[T]],
+        policy: LLMTaskPolicy,
+        call: LLMCall,
+        discard: Callable[[T], Awaitable[None]] | None = None,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.deadline if policy.deadline else None
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline - loop.time() if deadline else None
+            try:
+                return await asyncio.wait_for(
+                    self._race(
+                        task,
+                        make_attempt,
+                        self._hedge_delay(task, policy),
+                        call,
+                        discard,
+                    ),
+                    timeout=remaining,
+                )
+            except TimeoutError:
+                raise LLMDeadlineExceeded(
+                    f"LLM task '{task}' exceeded its {policy.deadline}s deadline"
+                )
+            except Exception as e:
+                if attempt == policy.max_attempts or not is_retryable_error(e):
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                if deadline and loop.time() + delay >= deadline:
+                    raise
+                call.add_retry(e)
+                await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def run(
+        self,
+        task: str,
+        make_attempt: Callable[[], Awaitable[T]],
+        policy: LLMTaskPolicy,
+        call: LLMCall,
+    ) -> T:
+        """Run `make_attempt()` hedged, retried and within the deadline; wait for it."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(task, make_attempt, policy, call), self._get_loop()
+        )
+        return future.result()
+
+    def stream(
+        self,
+        task: str,
+        make_stream: Callable[[], AsyncIterator[Any]],
+        policy: LLMTaskPolicy,
+        call: LLMCall,
+    ) -> Iterator[Any]:
+        """
+        Hedged streaming: attempts race for the first chunk, the losing stream
+        is closed and the winner is relayed chunk by chunk. The deadline applies
+        to the first chunk only, so long answers are never cut off.
+        """
+        loop = self._get_loop()
+
+        async def open_stream():
+            stream = make_stream()
+            try:
+                return stream, await anext(stream)
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close_stream(opened) -> None:
+            await opened[0].aclose()
+
+        stream, first = asyncio.run_coroutine_threadsafe(
+            self._run(task, open_stream, policy, call, discard=close_stream), loop
+        ).result()
+        try:
+            yield first
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(anext(stream), loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+
+
+_executor: HedgedRequestExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> HedgedRequestExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = HedgedRequestExecutor()
+        return _executor
+
+
+def shutdown_executor() -> None:
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+
+
+def _reset_after_fork() -> None:
+    # The event loop thread doesn't exist in a forked child
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
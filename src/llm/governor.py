@@ -0,0 +1,302 @@
+"""
+Process-wide admission control for LLM calls.
+
+Every call in `llm.llm` takes a permit from the governor before it is sent.
+Permits are limited by a request-per-minute bucket, a token-per-minute bucket
+(charged with an estimate up front and corrected with the actual usage) and
+a concurrency limit. A few slots, and the same share of both buckets, are
+reserved for interactive calls, so bulk work can't use up what chat needs.
+
+Waiting calls are served by priority class (interactive chat, then editing,
+then bulk) and round-robin across users within a class, so one user
+regenerating a whole book can't starve chat sessions or other users. The
+first waiter in that order that fits its class's limits goes next; a waiter
+held back by its limits doesn't block those behind it that fit theirs.
+
+The priority comes from the task policy and can be overridden, together with
+the user, for a block of code with `llm_context`. Use `in_llm_context` for
+work handed to thread pools, which don't inherit context variables, and
+`iter_in_llm_context` for generators.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from config import LLMPriority as Priority
+from config import settings
+
+PRIORITIES: tuple[Priority, ...] = ("interactive", "editing", "bulk")
+
+_current_user: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "llm_user", default=None
+)
+_current_priority: contextvars.ContextVar[Priority | None] = contextvars.ContextVar(
+    "llm_priority", default=None
+)
+
+
+@contextmanager
+def llm_context(user_id: object | None = None, priority: Priority | None = None):
+    """Attributes LLM calls made inside the block to a user and/or priority."""
+    tokens = []
+    if user_id is not None:
+        tokens.append((_current_user, _current_user.set(str(user_id))))
+    if priority is not None:
+        tokens.append((_current_priority, _current_priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def in_llm_context[T](fn: Callable[..., T]) -> Callable[..., T]:
+    """Wraps `fn` to run in (a copy of) the current context, e.g. in a thread pool."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def iter_in_llm_context[T](
+    iterator: Iterator[T],
+    user_id: object | None = None,
+    priority: Priority | None = None,
+) -> Iterator[T]:
+    """
+    Advances `iterator` step by step inside a context attributed to the user
+    and/or priority. For generators, which can't hold a `llm_context` block
+    across yields safely.
+    """
+    context = contextvars.copy_context()
+    if user_id is not None:
+        context.run(_current_user.set, str(user_id))
+    if priority is not None:
+        context.run(_current_priority.set, priority)
+    while True:
+        try:
+            yield context.run(next, iterator)
+        except StopIteration:
+            return
+
+
+class _Waiter:
+    __slots__ = ("priority", "user", "tokens", "enqueued_at")
+
+    def __init__(self, priority: Priority, user: str, tokens: int):
+        self.priority = priority
+        self.user = user
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class Permit:
+    """Admission for one LLM call; release it (or use it as a context manager)."""
+
+    def __init__(self, governor: "LLMGovernor", waiter: _Waiter):
+        self._governor = governor
+        self.priority = waiter.priority
+        self.user = waiter.user
+        self.tokens = waiter.tokens
+        self.queue_wait = time.monotonic() - waiter.enqueued_at
+        self.used_tokens: int | None = None
+        self._released = False
+
+    def record_usage(self, usage: dict | None) -> None:
+        if usage:
+            self.used_tokens = usage.get("input_tokens", 0) + usage.get(
+                "output_tokens", 0
+            )
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._governor._release(self)
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class LLMGovernor:
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_concurrency: int | None = None,
+        reserved_interactive_slots: int | None = None,
+    ):
+        self.requests_per_minute = (
+            requests_per_minute or settings.LLM_REQUESTS_PER_MINUTE
+        )
+        self.tokens_per_minute = tokens_per_minute or settings.LLM_TOKENS_PER_MINUTE
+        self.max_concurrency = max_concurrency or settings.LLM_MAX_CONCURRENCY
+        self.reserved_interactive_slots = (
+            reserved_interactive_slots
+            if reserved_interactive_slots is not None
+            else settings.LLM_INTERACTIVE_RESERVED_SLOTS
+        )
+
+        self._cond = threading.Condition()
+        self._queues: dict[Priority, OrderedDict[str, deque[_Waiter]]] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._in_flight: dict[Priority, int] = dict.fromkeys(PRIORITIES, 0)
+        self._requests = float(self.requests_per_minute)
+        self._tokens = float(self.tokens_per_minute)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._tokens = min(
+            self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60
+        )
+
+    def _reserved_share(self, priority: Priority) -> float:
+        """Share of each limit that `priority` has to leave to interactive calls."""
+        if priority == "interactive":
+            return 0.0
+        return min(self.reserved_interactive_slots / self.max_concurrency, 1.0)
+
+    def _has_slot(self, priority: Priority) -> bool:
+        slots = self.max_concurrency
+        if priority != "interactive":
+            slots -= self.reserved_interactive_slots
+        return sum(self._in_flight.values()) < max(slots, 1)
+
+    def _next_waiter(self) -> _Waiter | None:
+        """The first waiter, in priority and round-robin order, with a free slot."""
+        for priority in PRIORITIES:
+            users = self._queues[priority]
+            if users and self._has_slot(priority):
+                return next(iter(users.values()))[0]
+        return None
+
+    def _admission_delay(self, waiter: _Waiter) -> float:
+        """Seconds until the buckets can pay for `waiter`, 0 if they can now."""
+        share = self._reserved_share(waiter.priority)
+        requests = min(1 + share * self.requests_per_minute, self.requests_per_minute)
+        tokens = min(
+            waiter.tokens + share * self.tokens_per_minute, self.tokens_per_minute
+        )
+        delay = 0.0
+        if self._requests < requests:
+            delay = (requests - self._requests) * 60 / self.requests_per_minute
+        if self._tokens < tokens:
+            delay = max(delay, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return delay
+
+    def _admit(self, waiter: _Waiter) -> None:
+        users = self._queues[waiter.priority]
+        queue = users[waiter.user]
+        queue.popleft()
+        # Round-robin: the user goes to the back of their class
+        del users[waiter.user]
+        if queue:
+            users[waiter.user] = queue
+        self._in_flight[waiter.priority] += 1
+        self._requests -= 1
+        self._tokens -= min(waiter.tokens, self.tokens_per_minute)
+
+    def acquire(
+        self, priority: Priority, estimated_tokens: int, user: str | None = None
+    ) -> Permit:
+        """Blocks until the call may be sent."""
+        waiter = _Waiter(priority, user or "anonymous", estimated_tokens)
+        with self._cond:
+            self._queues[priority].setdefault(waiter.user, deque()).append(waiter)
+            while True:
+                self._refill()
+                delay = None
+                if self._next_waiter() is waiter:
+                    delay = self._admission_delay(waiter)
+                    if delay == 0:
+                        self._admit(waiter)
+                        self._cond.notify_all()
+                        return Permit(self, waiter)
+                self._cond.wait(timeout=delay or 1.0)
+
+    def _release(self, permit: Permit) -> None:
+        with self._cond:
+            self._in_flight[permit.priority] -= 1
+            if permit.used_tokens is not None:
+                charged = min(permit.tokens, self.tokens_per_minute)
+                self._tokens += charged - permit.used_tokens
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        """Queue depth and in-flight calls per priority, and remaining budget."""
+        with self._cond:
+            self._refill()
+            return {
+                "queued": {
+                    priority: sum(len(queue) for queue in users.values())
+                    for priority, users in self._queues.items()
+                },
+                "queued_users": {
+                    priority: len(users) for priority, users in self._queues.items()
+                },
+                "in_flight": dict(self._in_flight),
+                "requests_available": self._requests,
+                "tokens_available": self._tokens,
+            }
+
+    def export_prometheus(self) -> str:
+        data = self.snapshot()
+        lines = ["# TYPE llm_governor_queue_depth gauge"]
+        lines.extend(
+            f'llm_governor_queue_depth{{priority="{p}"}} {n}'
+            for p, n in data["queued"].items()
+        )
+        lines.append("# TYPE llm_governor_in_flight gauge")
+        lines.extend(
+            f'llm_governor_in_flight{{priority="{p}"}} {n}'
+            for p, n in data["in_flight"].items()
+        )
+        lines.append("# TYPE llm_governor_tokens_available gauge")
+        lines.append(f"llm_governor_tokens_available {data['tokens_available']}")
+        return "\n".join(lines) + "\n"
+
+
+_governor: LLMGovernor | None = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> LLMGovernor:
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = LLMGovernor()
+        return _governor
+
+
+def _reset_after_fork() -> None:
+    # Permits held by the parent's threads would never be released here
+    global _governor, _governor_lock
+    _governor = None
+    _governor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def governed_call(task: str, estimated_tokens: int) -> Iterator[Permit]:
+    """Permit for one call of `task`, using the task priority unless overridden."""
+    priority = _current_priority.get() or settings.get_llm_policy(task).priority
+    permit = get_governor().acquire(priority, estimated_tokens, _current_user.get())
+    try:
+        yield permit
+    finally:
+        permit.release()
@@ -1,12 +1,32 @@
+import re
+from collections.abc import Iterator
 from typing import Literal
+from langchain_core.exceptions import OutputParserException
 from langchain_openai import ChatOpenAI
-from pydantic import BaseModel
-from langchain.prompts import PromptTemplate
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+from langchain.prompts import ChatPromptTemplate, PromptTemplate
+from langchain_core.messages import BaseMessage
 from config import settings
 from langsmith import traceable
 
+from llm.budget import (
+    check_prompt_budget,
+    completion_budget,
+    fit_content,
+    prompt_tokens,
+)
+from llm.executor import get_executor
+from llm.governor import governed_call
+from llm.rate_limit import TokenBucket, retry_with_jitter
+from llm.telemetry import telemetry
 from models.chat_session import ChatMessageType
 
+SCORE_LINE_PATTERN = re.compile(
+    r"^\W*score\W*:?\W*(\d+(?:\.\d+)?)(?:\s*/\s*10)?\W*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
 
 class SectionInfo(BaseModel):
     title: str
@@ -25,6 +45,11 @@ class QuestionList(BaseModel):
     questions: list[Question]
 
 
+class QuestionReference(BaseModel):
+    reference_answer: str
+    rubric: list[str]
+
+
 class UserMessageRouterOutput(BaseModel):
     type: Literal[
         ChatMessageType.ANSWER.value,
@@ -42,12 +67,119 @@ class UserExplanationGenerationOutput(BaseModel):
     explanation: str
 
 
-@traceable(name="section-info")
-def get_section_info(content: str, example_titles: list[str]) -> SectionInfoList:
-    llm = ChatOpenAI(
-        model="gpt-4o", api_key=settings.OPENAI_API_KEY
-    ).with_structured_output(SectionInfoList)
+def get_llm(task: str, escalate: bool = False, streaming: bool = False) -> ChatOpenAI:
+    """Build the chat model configured for `task` in `settings.LLM_TASKS`."""
+    policy = settings.get_llm_policy(task)
+    model = policy.model
+    if escalate and policy.escalation_model:
+        model = policy.escalation_model
+    return ChatOpenAI(
+        model=model,
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        max_tokens=policy.max_tokens,
+        timeout=policy.timeout,
+        # Retries are done in invoke_llm so they are visible to telemetry.
+        max_retries=0,
+        stream_usage=streaming,
+    )
 
+
+def _estimate_tokens(task: str, prompt: str | list[BaseMessage]) -> int:
+    """
+    Prompt tokens plus the completion limit, charged to the governor up front.
+    Raises `PromptBudgetExceeded` if the prompt is over the task budget.
+    """
+    return check_prompt_budget(task, prompt) + completion_budget(task)
+
+
+def invoke_llm(
+    task: str,
+    prompt: str | list[BaseMessage],
+    schema: type[BaseModel] | None = None,
+    escalate: bool = False,
+    bucket: TokenBucket | None = None,
+):
+    """
+    Every non-streaming LLM call goes through here: the prompt is checked
+    against the task budget, the call waits for a permit from the governor,
+    the model comes from the task policy, retryable errors are retried with
+    jitter and usage, latency and retries are recorded in `telemetry`. Tasks
+    with a deadline go through the hedged executor instead. Returns the
+    parsed `schema` instance, or the raw message when no schema is given.
+    Every attempt takes a token from `bucket`, if given; deadline tasks take
+    one for the whole call.
+    """
+    policy = settings.get_llm_policy(task)
+    llm = get_llm(task, escalate=escalate)
+    runnable = llm.with_structured_output(schema, include_raw=True) if schema else llm
+
+    with governed_call(task, _estimate_tokens(task, prompt)) as permit:
+        call = telemetry.start_call(task, llm.model_name)
+        call.set_queue_wait(permit.queue_wait)
+        try:
+            if policy.deadline is not None:
+                if bucket is not None:
+                    bucket.acquire()
+                result = get_executor().run(
+                    task, lambda: runnable.ainvoke(prompt), policy, call
+                )
+            else:
+                result = retry_with_jitter(
+                    lambda: runnable.invoke(prompt),
+                    max_attempts=policy.max_attempts,
+                    bucket=bucket,
+                    on_retry=call.add_retry,
+                )
+        except Exception as e:
+            call.finish(error=e)
+            raise
+
+        raw = result["raw"] if schema else result
+        call.finish(usage=raw.usage_metadata)
+        permit.record_usage(raw.usage_metadata)
+
+    if not schema:
+        return raw
+    if result["parsing_error"] is not None:
+        raise result["parsing_error"]
+    return result["parsed"]
+
+
+def stream_llm(task: str, prompt: str | list[BaseMessage]) -> Iterator[str]:
+    """
+    Streaming counterpart of `invoke_llm`, yields text chunks as they arrive.
+    The governor permit is held until the stream ends.
+    """
+    policy = settings.get_llm_policy(task)
+    llm = get_llm(task, streaming=True)
+    with governed_call(task, _estimate_tokens(task, prompt)) as permit:
+        call = telemetry.start_call(task, llm.model_name)
+        call.set_queue_wait(permit.queue_wait)
+        if policy.deadline is not None:
+            chunks = get_executor().stream(
+                task, lambda: llm.astream(prompt), policy, call
+            )
+        else:
+            chunks = llm.stream(prompt)
+        usage = None
+        error = None
+        try:
+            for chunk in chunks:
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                if chunk.content:
+                    call.mark_first_token()
+                    yield chunk.content
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            call.finish(usage=usage, error=error)
+            permit.record_usage(usage)
+
+
+def section_info_prompt(content: str, example_titles: list[str]) -> str:
     example_titles_str = "\n".join(
         [f"{i + 1}. {title}" for i, title in enumerate(example_titles)]
     )
@@ -78,16 +210,42 @@ def get_section_info(content: str, example_titles: list[str]) -> SectionInfoList
         Ensure the output is well-structured and corresponds to the given content. If no chapters or sections are found, return an empty list.
     """
     )
-    return llm.invoke(
-        prompt.format(content=content, example_titles_str=example_titles_str)
+    fixed_tokens = prompt_tokens(
+        prompt.format(content="", example_titles_str=example_titles_str)
     )
+    content = fit_content("section_info", content, fixed_tokens)
+    return prompt.format(content=content, example_titles_str=example_titles_str)
 
 
-@traceable(name="section-questions")
-def generate_questions(content: str, num_questions: int) -> QuestionList:
-    llm = ChatOpenAI(
-        model="gpt-4o", api_key=settings.OPENAI_API_KEY
-    ).with_structured_output(QuestionList)
+@traceable(name="section-info")
+def get_section_info(content: str, example_titles: list[str]) -> SectionInfoList:
+    prompt_text = section_info_prompt(content, example_titles)
+    policy = settings.get_llm_policy("section_info")
+    try:
+        result = invoke_llm("section_info", prompt_text, SectionInfoList)
+        if is_valid_section_info(result) or not policy.escalation_model:
+            return result
+    except (OutputParserException, ValidationError) as e:
+        if not policy.escalation_model:
+            raise
+        logger.warning(f"Section info could not be parsed: {e}")
+
+    logger.warning(
+        f"Section info from {policy.model} failed validation, "
+        f"escalating to {policy.escalation_model}"
+    )
+    return invoke_llm("section_info", prompt_text, SectionInfoList, escalate=True)
+
+
+def is_valid_section_info(section_info_list: SectionInfoList) -> bool:
+    """Page numbers must be positive and strictly increasing in TOC order."""
+    page_numbers = [section.page_number for section in section_info_list.sections_info]
+    if any(page_number <= 0 for page_number in page_numbers):
+        return False
+    return all(a < b for a, b in zip(page_numbers, page_numbers[1:], strict=False))
+
+
+def questions_prompt(content: str, num_questions: int) -> str:
     prompt = PromptTemplate(
         template="""
         You are an expert in generating thought-provoking, insightful, and educational questions from a text. 
@@ -111,15 +269,25 @@ def generate_questions(content: str, num_questions: int) -> QuestionList:
 
         """
     )
-    return llm.invoke(prompt.format(content=content, num_questions=num_questions))
+    fixed_tokens = prompt_tokens(prompt.format(content="", num_questions=num_questions))
+    content = fit_content("generate_questions", content, fixed_tokens)
+    return prompt.format(content=content, num_questions=num_questions)
+
+
+@traceable(name="section-questions")
+def generate_questions(
+    content: str, num_questions: int, bucket: TokenBucket | None = None
+) -> QuestionList:
+    return invoke_llm(
+        "generate_questions",
+        questions_prompt(content, num_questions),
+        QuestionList,
+        bucket=bucket,
+    )
 
 
 @traceable(name="improve_question")
 def improve_question(question: str, feedback: str) -> Question:
-    llm = ChatOpenAI(
-        model="gpt-4o", api_key=settings.OPENAI_API_KEY
-    ).with_structured_output(Question)
-
     # Enhanced prompt for improved performance
     prompt = PromptTemplate(
         template="""
@@ -145,15 +313,53 @@ def improve_question(question: str, feedback: str) -> Question:
         """
     )
 
-    return llm.invoke(prompt.format(question=question, feedback=feedback))
+    return invoke_llm(
+        "improve_question",
+        prompt.format(question=question, feedback=feedback),
+        Question,
+    )
+
+
+def question_reference_prompt(question: str, section_content: str) -> str:
+    prompt = PromptTemplate(
+        template="""
+        You are an expert educator preparing a grading key for an open-ended
+        study question. Using only the reference content, write a compact model
+        answer and a grading rubric.
+
+        Question:
+        {question}
+
+        Reference Content:
+        {section_content}
+
+        OUTPUT REQUIREMENTS:
+        - `reference_answer`: a concise model answer (at most 120 words),
+          grounded in the reference content
+        - `rubric`: 3 to 6 short, checkable criteria a complete answer must satisfy,
+          ordered from most to least important
+        - Do not copy long passages; paraphrase the key points
+        """
+    )
+    fixed_tokens = prompt_tokens(prompt.format(question=question, section_content=""))
+    section_content = fit_content("question_reference", section_content, fixed_tokens)
+    return prompt.format(question=question, section_content=section_content)
+
+
+@traceable(name="question-reference")
+def generate_question_reference(
+    question: str, section_content: str, bucket: TokenBucket | None = None
+) -> QuestionReference:
+    return invoke_llm(
+        "question_reference",
+        question_reference_prompt(question, section_content),
+        QuestionReference,
+        bucket=bucket,
+    )
 
 
 @traceable(name="user_message_router")
 def determine_message_type(message: str, question: str) -> UserMessageRouterOutput:
-    llm = ChatOpenAI(
-        model="gpt-4o", api_key=settings.OPENAI_API_KEY
-    ).with_structured_output(UserMessageRouterOutput)
-
     prompt = PromptTemplate(
         template="""
         You are an expert message classifier specializing in educational interactions. Your task is to analyze user messages and classify them into specific response types.
@@ -193,16 +399,18 @@ def determine_message_type(message: str, question: str) -> UserMessageRouterOutp
         """
     )
 
-    return llm.invoke(prompt.format(question=question, message=message))
-
+    fixed_tokens = prompt_tokens(prompt.format(question=question, message=""))
+    message = fit_content("message_router", message, fixed_tokens)
+    return invoke_llm(
+        "message_router",
+        prompt.format(question=question, message=message),
+        UserMessageRouterOutput,
+    )
 
-def evaluate_answer(answer: str, question: str, section_content: str) -> str:
-    llm = ChatOpenAI(
-        model="gpt-4o", api_key=settings.OPENAI_API_KEY
-    ).with_structured_output(UserAnswerEvaluationOutput)
 
-    prompt = PromptTemplate(
-        template="""
+# Instructions and reference content go in the system message and the per-turn
+# parts last, so repeated turns on the same question share a cacheable prefix.
+EVALUATION_SYSTEM_PROMPT = """
         You are an expert educational evaluator specializing in providing constructive feedback on student answers.
         Your task is to evaluate the answer comprehensively and provide detailed, actionable feedback.
 
@@ -212,14 +420,8 @@ def evaluate_answer(answer: str, question: str, section_content: str) -> str:
         3. Understanding (Does it demonstrate deep comprehension?)
         4. Clarity (Is it well-articulated and logically structured?)
 
-        Question:
-        {question}
-
-        Student Answer:
-        {answer}
-
-        Reference Content:
-        {section_content}
+        If the reference content contains a reference answer and a rubric, grade against
+        each rubric criterion and use the reference answer as the expected answer.
 
         INSTRUCTIONS:
         1. Score the answer from 0 to 10, where:
@@ -241,21 +443,26 @@ def evaluate_answer(answer: str, question: str, section_content: str) -> str:
         - Provide specific examples from the reference content
         - Explain why certain points are important
         - Suggest concrete steps for improvement
+
+        Reference Content:
+        {section_content}
         """
-    )
 
-    return llm.invoke(
-        prompt.format(answer=answer, question=question, section_content=section_content)
-    )
+EVALUATION_USER_PROMPT = """
+        Question:
+        {question}
 
+        Student Answer:
+        {answer}
+        """
 
-def generate_explanation(message: str, question: str, section_content: str) -> str:
-    llm = ChatOpenAI(
-        model="gpt-4o", api_key=settings.OPENAI_API_KEY
-    ).with_structured_output(UserExplanationGenerationOutput)
+STREAMED_EVALUATION_FORMAT = """
+        OUTPUT FORMAT:
+        Write the feedback as plain text. On the very last line write only
+        `Score: <number from 0 to 10>`.
+        """
 
-    prompt = PromptTemplate(
-        template="""
+EXPLANATION_SYSTEM_PROMPT = """
         You are an expert educational explainer specializing in providing clear, engaging, and comprehensive explanations.
         Your goal is to help students understand concepts thoroughly by combining information from the reference content
         and your general knowledge when appropriate.
@@ -275,15 +482,6 @@ def generate_explanation(message: str, question: str, section_content: str) -> s
         5. Use simple language while maintaining accuracy
         6. Include visual descriptions or metaphors when helpful
 
-        Question:
-        {question}
-
-        User Message:
-        {message}
-
-        Reference Content:
-        {section_content}
-
         RESPONSE FORMAT:
         - Begin with a direct answer to the user's specific query
         - Follow with detailed explanation
@@ -295,11 +493,109 @@ def generate_explanation(message: str, question: str, section_content: str) -> s
         - Balance depth with clarity
         - Make complex concepts accessible
         - Encourage further understanding
+
+        Reference Content:
+        {section_content}
         """
+
+EXPLANATION_USER_PROMPT = """
+        Question:
+        {question}
+
+        User Message:
+        {message}
+        """
+
+
+def evaluation_messages(
+    answer: str, question: str, section_content: str, streamed: bool = False
+) -> list[BaseMessage]:
+    user_prompt = EVALUATION_USER_PROMPT
+    if streamed:
+        user_prompt += STREAMED_EVALUATION_FORMAT
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", EVALUATION_SYSTEM_PROMPT), ("human", user_prompt)]
+    )
+    fixed_tokens = prompt_tokens(
+        prompt.format_messages(answer=answer, question=question, section_content="")
+    )
+    section_content = fit_content("evaluate_answer", section_content, fixed_tokens)
+    return prompt.format_messages(
+        answer=answer, question=question, section_content=section_content
+    )
+
+
+def explanation_messages(
+    message: str, question: str, section_content: str, digest: str | None = None
+) -> list[BaseMessage]:
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", EXPLANATION_SYSTEM_PROMPT), ("human", EXPLANATION_USER_PROMPT)]
+    )
+    fixed_tokens = prompt_tokens(
+        prompt.format_messages(message=message, question=question, section_content="")
+    )
+    section_content = fit_content(
+        "generate_explanation", section_content, fixed_tokens, digest
+    )
+    return prompt.format_messages(
+        message=message, question=question, section_content=section_content
+    )
+
+
+@traceable(name="evaluate_answer")
+def evaluate_answer(answer: str, question: str, section_content: str) -> str:
+    return invoke_llm(
+        "evaluate_answer",
+        evaluation_messages(answer, question, section_content),
+        UserAnswerEvaluationOutput,
     )
 
-    return llm.invoke(
-        prompt.format(
-            message=message, question=question, section_content=section_content
-        )
+
+def stream_answer_evaluation(
+    answer: str, question: str, section_content: str
+) -> Iterator[str]:
+    """
+    Streaming variant of `evaluate_answer`: yields feedback tokens as they
+    arrive. Use `parse_answer_evaluation` on the joined text to get the
+    structured output.
+    """
+    yield from stream_llm(
+        "evaluate_answer",
+        evaluation_messages(answer, question, section_content, streamed=True),
+    )
+
+
+def parse_answer_evaluation(text: str) -> UserAnswerEvaluationOutput:
+    """
+    Split streamed evaluation text into feedback and the trailing score line.
+    Raises `ValueError` if the text has no score line.
+    """
+    matches = list(SCORE_LINE_PATTERN.finditer(text))
+    if not matches:
+        raise ValueError("Streamed evaluation has no score line")
+    match = matches[-1]
+    score = min(max(float(match.group(1)), 0.0), 10.0)
+    return UserAnswerEvaluationOutput(
+        feedback=text[: match.start()].strip(), score=score
+    )
+
+
+@traceable(name="generate_explanation")
+def generate_explanation(
+    message: str, question: str, section_content: str, digest: str | None = None
+) -> str:
+    return invoke_llm(
+        "generate_explanation",
+        explanation_messages(message, question, section_content, digest),
+        UserExplanationGenerationOutput,
+    )
+
+
+def stream_explanation(
+    message: str, question: str, section_content: str, digest: str | None = None
+) -> Iterator[str]:
+    """Streaming variant of `generate_explanation`, yields plain-text tokens."""
+    yield from stream_llm(
+        "generate_explanation",
+        explanation_messages(message, question, section_content, digest),
     )
@@ -0,0 +1,85 @@
+"""
+Helpers for map-reduce question generation over long sections.
+
+The map step generates candidate questions for token-bounded windows of the
+section; the reduce step picks the requested number of questions locally,
+interleaving windows so the whole chapter is covered and dropping candidates
+too similar to an already selected question.
+"""
+
+import math
+from itertools import zip_longest
+
+from llm.retrieval import tokenize
+from llm.tokens import count_tokens
+
+# Generate somewhat more candidates than needed so the reduce step can dedupe
+CANDIDATE_OVERSAMPLING = 1.5
+
+
+def make_windows(passages: list[str], max_tokens: int) -> list[str]:
+    """Group consecutive passages into windows of at most ~`max_tokens` tokens."""
+    windows = []
+    current: list[str] = []
+    current_tokens = 0
+    for passage in passages:
+        passage_tokens = count_tokens(passage)
+        if current and current_tokens + passage_tokens > max_tokens:
+            windows.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(passage)
+        current_tokens += passage_tokens
+    if current:
+        windows.append("\n\n".join(current))
+    return windows
+
+
+def candidates_per_window(num_questions: int, num_windows: int) -> int:
+    return max(2, math.ceil(num_questions * CANDIDATE_OVERSAMPLING / num_windows))
+
+
+def question_similarity(a: set[str], b: set[str]) -> float:
+    """Dice coefficient of the content words of two questions."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def select_questions(
+    candidates: list[list[str]], num_questions: int, max_similarity: float
+) -> list[str]:
+    """
+    Picks `num_questions` from per-window candidate lists, round-robin across
+    windows, skipping near-duplicates. If too few distinct questions remain,
+    the least similar of the skipped ones fill up the selection.
+    """
+    interleaved = [
+        question
+        for group in zip_longest(*candidates)
+        for question in group
+        if question
+    ]
+    selected: list[tuple[str, set[str]]] = []
+    skipped: list[tuple[str, set[str]]] = []
+    for question in interleaved:
+        words = set(tokenize(question))
+        if any(
+            question_similarity(words, other) > max_similarity for _, other in selected
+        ):
+            skipped.append((question, words))
+            continue
+        selected.append((question, words))
+        if len(selected) == num_questions:
+            break
+
+    while len(selected) < num_questions and skipped:
+        best = min(
+            skipped,
+            key=lambda item: max(
+                question_similarity(item[1], other) for _, other in selected
+            ),
+        )
+        skipped.remove(best)
+        if best[0] not in {question for question, _ in selected}:
+            selected.append(best)
+    return [question for question, _ in selected]
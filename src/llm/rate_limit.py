@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+from collections.abc import Callable
+
+import openai
+from loguru import logger
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to pace outgoing LLM requests.
+
+    `rate` tokens are added per second up to `capacity`; `acquire` blocks
+    until enough tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float) -> "TokenBucket":
+        return cls(rate=requests_per_minute / 60, capacity=1.0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    """Rate limits, timeouts, connection errors and 5xx responses are retryable."""
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def retry_with_jitter[T](
+    fn: Callable[[], T],
+    max_attempts: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    bucket: TokenBucket | None = None,
+    on_retry: Callable[[Exception], None] | None = None,
+) -> T:
+    """
+    Call `fn`, retrying retryable OpenAI errors with exponential backoff
+    and full jitter. If a bucket is given, every attempt is paced through it.
+    """
+    for attempt in range(1, max_attempts + 1):
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts or not is_retryable_error(e):
+                raise
+            if on_retry:
+                on_retry(e)
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(
+                f"LLM call failed ({e}), retrying in {delay:.1f}s "
+                f"(attempt {attempt}/{max_attempts})"
+            )
+            time.sleep(delay)
+    raise RuntimeError("unreachable")
@@ -0,0 +1,219 @@
+"""
+Passage chunking and BM25 retrieval over section text.
+
+Sections are split into token-bounded passages when their text is extracted.
+At chat time only the passages most relevant to the question and the user
+message are put into the prompt, so prompt size no longer grows with the
+length of the chapter.
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from llm.tokens import count_tokens
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+PASSAGE_SEPARATOR = "\n\n[...]\n\n"
+
+STOPWORDS = frozenset(
+    """a an and are as at be but by for from has have he her his i in is it its
+    of on or she so that the their them then there these they this to was we
+    were what when where which who why will with you your do does did can could
+    would should how about into than not no""".split()
+)
+
+INDEX_CACHE_SIZE = 128
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        word
+        for word in WORD_PATTERN.findall(text.lower())
+        if word not in STOPWORDS and len(word) > 1
+    ]
+
+
+def _split_long_block(block: str, max_tokens: int) -> list[str]:
+    pieces = []
+    current: list[str] = []
+    current_tokens = 0
+    for sentence in SENTENCE_PATTERN.split(block):
+        sentence_tokens = count_tokens(sentence)
+        if sentence_tokens > max_tokens:
+            words = sentence.split()
+            step = max(1, len(words) * max_tokens // sentence_tokens)
+            sentences = [
+                " ".join(words[i : i + step]) for i in range(0, len(words), step)
+            ]
+        else:
+            sentences = [sentence]
+        for piece in sentences:
+            piece_tokens = count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_text(text: str | None, max_tokens: int = 300) -> list[str]:
+    """
+    Split text into passages of at most ~`max_tokens` tokens, keeping
+    lines (or, for very long lines, sentences) together.
+    """
+    if not text:
+        return []
+
+    passages = []
+    current: list[str] = []
+    current_tokens = 0
+    for block in (line.strip() for line in text.splitlines()):
+        if not block:
+            continue
+        block_tokens = count_tokens(block)
+        blocks = [block]
+        if block_tokens > max_tokens:
+            blocks = _split_long_block(block, max_tokens)
+        for piece in blocks:
+            piece_tokens = count_tokens(piece) if len(blocks) > 1 else block_tokens
+            if current and current_tokens + piece_tokens > max_tokens:
+                passages.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 index with an inverted posting list per term.
+    """
+
+    def __init__(self, passages: list[str], k1: float = 1.5, b: float = 0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+
+        for doc_id, passage in enumerate(passages):
+            terms = Counter(tokenize(passage))
+            self.doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+
+        self.avg_doc_length = (
+            sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        )
+        n = len(passages)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, top_k: int = 5) -> list[tuple[int, float]]:
+        """Return up to `top_k` (passage index, score) pairs, best first."""
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                length_norm = 1 - self.b + self.b * (
+                    self.doc_lengths[doc_id] / (self.avg_doc_length or 1)
+                )
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * (
+                    tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+                )
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+_index_cache: OrderedDict[str, BM25Index] = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    global _index_cache_lock
+    _index_cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_index(key: str, passages: list[str]) -> BM25Index:
+    """Return a cached index for `key`, rebuilding it if the passages changed."""
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None and index.passages == passages:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = BM25Index(passages)
+    with _index_cache_lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def select_passages(
+    index: BM25Index, query: str, top_k: int, token_budget: int
+) -> list[str]:
+    """
+    Pick the best matching passages that fit in `token_budget`, returned in
+    their original document order.
+    """
+    selected = []
+    used_tokens = 0
+    for doc_id, _ in index.search(query, top_k=top_k):
+        passage_tokens = count_tokens(index.passages[doc_id])
+        if used_tokens + passage_tokens > token_budget:
+            continue
+        selected.append(doc_id)
+        used_tokens += passage_tokens
+    if not selected:
+        # Nothing matched the query: fall back to the start of the section.
+        for doc_id, passage in enumerate(index.passages):
+            passage_tokens = count_tokens(passage)
+            if used_tokens + passage_tokens > token_budget:
+                break
+            selected.append(doc_id)
+            used_tokens += passage_tokens
+    return [index.passages[doc_id] for doc_id in sorted(selected)]
+
+
+def make_digest(passages: list[str], token_budget: int) -> str:
+    """
+    Extractive digest of a section: the lead sentences of passages spread
+    evenly over the section, in document order, within `token_budget`.
+    """
+    leads = [
+        SENTENCE_PATTERN.split(" ".join(passage.split()), maxsplit=1)[0]
+        for passage in passages
+    ]
+    lead_tokens = [count_tokens(lead) for lead in leads]
+    total_tokens = sum(lead_tokens)
+    if not total_tokens:
+        return ""
+    # Every `step`-th passage, so the picked leads roughly fill the budget
+    step = max(1.0, total_tokens / token_budget)
+    picked = sorted({int(i * step) for i in range(int(len(leads) / step) + 1)})
+
+    selected = []
+    used_tokens = 0
+    for doc_id in picked:
+        if doc_id >= len(leads) or used_tokens + lead_tokens[doc_id] > token_budget:
+            continue
+        selected.append(leads[doc_id])
+        used_tokens += lead_tokens[doc_id]
+    return "\n".join(selected)
@@ -0,0 +1,288 @@
+"""
+In-process telemetry for LLM calls.
+
+Every call made through `llm.llm` is recorded here with its task, model,
+calling service method, token usage, latency, retries and estimated cost.
+Records are aggregated into counters and histograms that can be queried with
+`LLMTelemetry.summary` or exported with `snapshot` / `export_prometheus`.
+Nothing here depends on LangSmith being enabled.
+"""
+
+import bisect
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any
+
+from pydantic import BaseModel
+
+from config import settings
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+class LLMCallRecord(BaseModel):
+    task: str
+    model: str
+    caller: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = 0.0
+    time_to_first_token: float | None = None
+    retries: int = 0
+    queue_wait: float = 0.0
+    hedged: bool = False
+    cost: float = 0.0
+    error: str | None = None
+
+
+class Histogram:
+    """Fixed-bucket histogram with interpolated percentiles."""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([*self.buckets, "+Inf"], self.counts, strict=True)),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+def estimate_cost(
+    model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0
+) -> float:
+    """Estimated USD cost from `settings.LLM_PRICES` (prices per 1M tokens)."""
+    price = settings.get_model_price(model)
+    if price is None:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached * price.input
+        + cached_tokens * price.cached_input
+        + completion_tokens * price.output
+    ) / 1_000_000
+
+
+def find_caller() -> str:
+    """Qualified name of the closest `services.*` function on the call stack."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("services."):
+            return f"{module.removeprefix('services.')}.{frame.f_code.co_qualname}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class LLMCall:
+    """Measures one LLM call; created by `LLMTelemetry.start_call`."""
+
+    def __init__(self, telemetry: "LLMTelemetry", task: str, model: str, caller: str):
+        self._telemetry = telemetry
+        self.record = LLMCallRecord(task=task, model=model, caller=caller)
+        self._started_at = time.perf_counter()
+
+    def add_retry(self, *_: Any) -> None:
+        self.record.retries += 1
+
+    def set_queue_wait(self, seconds: float) -> None:
+        self.record.queue_wait = seconds
+
+    def mark_hedged(self) -> None:
+        self.record.hedged = True
+
+    def mark_first_token(self) -> None:
+        if self.record.time_to_first_token is None:
+            self.record.time_to_first_token = time.perf_counter() - self._started_at
+
+    def finish(self, usage: dict | None = None, error: Exception | None = None) -> None:
+        self.record.latency = time.perf_counter() - self._started_at
+        if usage:
+            self.record.prompt_tokens = usage.get("input_tokens", 0)
+            self.record.completion_tokens = usage.get("output_tokens", 0)
+            details = usage.get("input_token_details") or {}
+            self.record.cached_tokens = details.get("cache_read", 0) or 0
+            self.record.cost = estimate_cost(
+                self.record.model,
+                self.record.prompt_tokens,
+                self.record.completion_tokens,
+                self.record.cached_tokens,
+            )
+        if error is not None:
+            self.record.error = type(error).__name__
+        self._telemetry.record(self.record)
+
+
+class LLMTelemetry:
+    """Thread-safe aggregation of `LLMCallRecord`s into counters and histograms."""
+
+    COUNTERS = {
+        "llm_calls_total": lambda r: 1,
+        "llm_errors_total": lambda r: 1 if r.error else 0,
+        "llm_retries_total": lambda r: r.retries,
+        "llm_hedges_total": lambda r: 1 if r.hedged else 0,
+        "llm_prompt_tokens_total": lambda r: r.prompt_tokens,
+        "llm_completion_tokens_total": lambda r: r.completion_tokens,
+        "llm_cached_tokens_total": lambda r: r.cached_tokens,
+        "llm_cost_usd_total": lambda r: r.cost,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters: dict[str, dict[LabelKey, float]] = defaultdict(
+                lambda: defaultdict(float)
+            )
+            self._histograms: dict[str, dict[LabelKey, Histogram]] = defaultdict(dict)
+
+    def start_call(self, task: str, model: str, caller: str | None = None) -> LLMCall:
+        return LLMCall(self, task, model, caller or find_caller())
+
+    def _observe(self, name: str, labels: LabelKey, buckets, value: float) -> None:
+        histogram = self._histograms[name].get(labels)
+        if histogram is None:
+            histogram = self._histograms[name][labels] = Histogram(buckets)
+        histogram.observe(value)
+
+    def record(self, record: LLMCallRecord) -> None:
+        labels: LabelKey = (
+            ("task", record.task),
+            ("model", record.model),
+            ("caller", record.caller),
+        )
+        with self._lock:
+            for name, value in self.COUNTERS.items():
+                self._counters[name][labels] += value(record)
+            self._observe(
+                "llm_latency_seconds", labels, LATENCY_BUCKETS, record.latency
+            )
+            self._observe(
+                "llm_prompt_tokens", labels, TOKEN_BUCKETS, record.prompt_tokens
+            )
+            self._observe(
+                "llm_queue_wait_seconds", labels, LATENCY_BUCKETS, record.queue_wait
+            )
+            if record.time_to_first_token is not None:
+                self._observe(
+                    "llm_time_to_first_token_seconds",
+                    labels,
+                    LATENCY_BUCKETS,
+                    record.time_to_first_token,
+                )
+
+    def snapshot(self) -> dict:
+        """All counters and histograms as plain, JSON-serialisable data."""
+        with self._lock:
+            return {
+                "counters": {
+                    name: [
+                        {"labels": dict(labels), "value": value}
+                        for labels, value in series.items()
+                    ]
+                    for name, series in self._counters.items()
+                },
+                "histograms": {
+                    name: [
+                        {"labels": dict(labels), **histogram.to_dict()}
+                        for labels, histogram in series.items()
+                    ]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def summary(self, group_by: str = "caller") -> list[dict]:
+        """
+        Totals per `group_by` label ("caller", "task" or "model"), sorted by
+        cost, with latency percentiles merged across the group and the share
+        of prompt tokens served from the provider's prompt cache.
+        """
+        rows: dict[str, dict] = {}
+        with self._lock:
+            for name, series in self._counters.items():
+                for labels, value in series.items():
+                    key = dict(labels)[group_by]
+                    row = rows.setdefault(key, {group_by: key})
+                    row[name] = row.get(name, 0) + value
+            for labels, histogram in self._histograms["llm_latency_seconds"].items():
+                key = dict(labels)[group_by]
+                merged = rows[key].setdefault("_latency", Histogram(LATENCY_BUCKETS))
+                merged.counts = [
+                    a + b for a, b in zip(merged.counts, histogram.counts, strict=True)
+                ]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+
+        for row in rows.values():
+            latency = row.pop("_latency", Histogram(LATENCY_BUCKETS))
+            row["latency_p50"] = latency.percentile(0.5)
+            row["latency_p95"] = latency.percentile(0.95)
+            row["latency_mean"] = latency.sum / latency.count if latency.count else 0.0
+            prompt_tokens = row.get("llm_prompt_tokens_total", 0)
+            row["cache_hit_rate"] = (
+                row.get("llm_cached_tokens_total", 0) / prompt_tokens
+                if prompt_tokens
+                else 0.0
+            )
+        return sorted(
+            rows.values(), key=lambda r: r.get("llm_cost_usd_total", 0), reverse=True
+        )
+
+    def export_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+
+        def fmt(labels: dict) -> str:
+            return ",".join(f'{k}="{v}"' for k, v in labels.items())
+
+        lines = []
+        data = self.snapshot()
+        for name, series in data["counters"].items():
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{{{fmt(s['labels'])}}} {s['value']}" for s in series)
+        for name, series in data["histograms"].items():
+            lines.append(f"# TYPE {name} histogram")
+            for s in series:
+                cumulative = 0
+                for bound, count in s["buckets"].items():
+                    cumulative += count
+                    labels = fmt({**s["labels"], "le": bound})
+                    lines.append(f"{name}_bucket{{{labels}}} {cumulative}")
+                lines.append(f"{name}_sum{{{fmt(s['labels'])}}} {s['sum']}")
+                lines.append(f"{name}_count{{{fmt(s['labels'])}}} {s['count']}")
+        return "\n".join(lines) + "\n"
+
+
+telemetry = LLMTelemetry()
@@ -0,0 +1,42 @@
+import math
+from functools import lru_cache
+
+import tiktoken
+from loguru import logger
+
+DEFAULT_ENCODING = "o200k_base"
+# Rough chars-per-token ratio for English text, used when no encoding is available.
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str) -> tiktoken.Encoding | None:
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; offline hosts fall back
+        # to an estimate rather than failing every prompt.
+        logger.warning(f"Couldn't load tiktoken encoding, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str | None, model: str = "gpt-4o") -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -1,3 +1,4 @@
+import hashlib
 import uuid
 from abc import ABC
 from typing import Type, TypeVar, Generic
@@ -9,6 +10,12 @@ from datetime import datetime, UTC
 T = TypeVar("T", bound="NoSQLBaseDocument")
 
 
+def stable_uuid4(*parts: object) -> uuid.UUID:
+    """Deterministic UUID (with version 4 bits) derived from `parts`."""
+    digest = hashlib.sha256(":".join(str(part) for part in parts).encode()).digest()
+    return uuid.UUID(bytes=digest[:16], version=4)
+
+
 class BasePydanticModel(BaseModel):
     model_config = ConfigDict(
         populate_by_name=True,
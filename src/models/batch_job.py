@@ -0,0 +1,52 @@
+import uuid
+from enum import Enum
+
+from pydantic import Field
+
+from models.base import BasePydanticModel, NoSQLBaseDocument
+
+
+class BatchJobKind(Enum):
+    QUESTIONS = "questions"
+    SECTION_INFO = "section_info"
+
+
+class SectionExtractionParams(BasePydanticModel):
+    """
+    Arguments of `SectionService.create_sections_magically` for one book.
+    """
+
+    book_id: uuid.UUID = Field(..., alias="bookId")
+    example_titles: list[str] = Field(default_factory=list, alias="exampleTitles")
+    start_page: int = Field(..., alias="startPage")
+    content_end_page: int = Field(..., alias="contentEndPage")
+    preface_start_page: int = Field(..., alias="prefaceStartPage")
+    preface_end_page: int = Field(..., alias="prefaceEndPage")
+
+
+class BatchJobItem(BasePydanticModel):
+    """
+    One request of a batch job: a section to generate questions for, or a
+    book to extract sections from.
+    """
+
+    custom_id: str = Field(..., alias="customId")
+    book_id: uuid.UUID = Field(..., alias="bookId")
+    section_id: uuid.UUID | None = Field(None, alias="sectionId")
+    num_questions: int | None = Field(None, alias="numQuestions")
+    extraction: SectionExtractionParams | None = None
+
+    applied: bool = False
+    error: str | None = None
+
+
+class BatchJobDocument(NoSQLBaseDocument):
+    """
+    Represents an offline LLM batch job in the 'batch_jobs' collection.
+    """
+
+    kind: BatchJobKind
+    provider_batch_id: str = Field(..., alias="providerBatchId")
+    status: str = "validating"
+    items: list[BatchJobItem] = Field(default_factory=list)
+    applied: bool = False
@@ -1,3 +1,4 @@
+from typing import Literal
 from pydantic import Field, UUID4
 from models.base import NoSQLBaseDocument, BasePydanticModel
 
@@ -24,3 +25,29 @@ class BookDocument(NoSQLBaseDocument):
 
     metadata: BookMetadata = Field(default_factory=BookMetadata)
     first_page: int | None = Field(None, alias="firstPage")
+    # Total tokens of the book's section texts
+    token_count: int | None = Field(None, alias="tokenCount")
+
+
+# Library sort orders: newest or oldest upload first, or title A-Z / Z-A
+BookSort = Literal["newest", "oldest", "title", "title_desc"]
+
+
+class BookListItem(NoSQLBaseDocument):
+    """
+    The fields of a book shown in library listings.
+    """
+
+    user_id: UUID4 = Field(..., alias="userId")
+    title: str
+    metadata: BookMetadata
+    token_count: int | None = Field(None, alias="tokenCount")
+
+
+class BookPage(BasePydanticModel):
+    """
+    One page of library results; `next_cursor` is None on the last page.
+    """
+
+    items: list[BookListItem] = Field(default_factory=list)
+    next_cursor: str | None = None
@@ -59,3 +59,40 @@ class ChatSessionSummary(BasePydanticModel):
     section_titles: List[str]
 
     created_at: datetime
+
+
+class ExamAnswerResult(BasePydanticModel):
+    """
+    Grading result for one answer of an exam.
+    """
+
+    question_id: UUID4
+    question: str
+    answer: str
+    feedback: str | None = None
+    score: float | None = None
+    error: str | None = None
+
+
+class ChatSessionState(NoSQLBaseDocument):
+    """
+    Resumable state of a live chat session, stored under the session's ID.
+    Questions are referenced by ID in their shuffled order. `session` only
+    holds the latest messages once older ones were spilled to the store.
+    """
+
+    session: ChatSessionDocument
+    question_ids: list[UUID4] = Field(default_factory=list, alias="questionIds")
+    answered_question_ids: list[UUID4] = Field(
+        default_factory=list, alias="answeredQuestionIds"
+    )
+    current_question_id: UUID4 | None = Field(None, alias="currentQuestionId")
+    exam: bool = False
+    deferred_grading: bool = Field(False, alias="deferredGrading")
+    # Answers queued for deferred grading, by question ID
+    pending_answers: dict[str, str] = Field(
+        default_factory=dict, alias="pendingAnswers"
+    )
+    # Number of spilled messages, and the feedback scores among them
+    spilled_messages: int = Field(0, alias="spilledMessages")
+    spilled_scores: list[float] = Field(default_factory=list, alias="spilledScores")
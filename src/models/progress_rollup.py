@@ -0,0 +1,37 @@
+from pydantic import UUID4, Field
+
+from models.base import NoSQLBaseDocument
+
+# Day key of the all-time rollups
+ALL_TIME = "all"
+
+
+class ProgressRollupDocument(NoSQLBaseDocument):
+    """
+    Pre-aggregated progress of a user on a book (`section_id` None) or on one
+    of its sections, for one UTC day (YYYY-MM-DD) or all time (ALL_TIME), in
+    the 'progress_rollups' collection. Maintained with $inc as sessions finish.
+    """
+
+    user_id: UUID4 = Field(..., alias="userId")
+    book_id: UUID4 = Field(..., alias="bookId")
+    section_id: UUID4 | None = Field(None, alias="sectionId")
+    day: str
+
+    sessions: int = 0
+    # Questions offered in those sessions, and graded answers to them
+    questions: int = 0
+    attempts: int = 0
+    score_sum: float = Field(0.0, alias="scoreSum")
+    # Number of scores per rounded score "0" to "10"
+    score_histogram: dict[str, int] = Field(
+        default_factory=dict, alias="scoreHistogram"
+    )
+
+    @property
+    def mean_score(self) -> float | None:
+        return round(self.score_sum / self.attempts, 2) if self.attempts else None
+
+    @property
+    def completion_rate(self) -> float:
+        return min(self.attempts / self.questions, 1.0) if self.questions else 0.0
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from pydantic import UUID4, Field
+
+from models.base import NoSQLBaseDocument
+
+
+class QuestionStatsDocument(NoSQLBaseDocument):
+    """
+    Spaced-repetition state of one question for one user, in the
+    'question_stats' collection. The ID is derived from user and question.
+    """
+
+    user_id: UUID4 = Field(..., alias="userId")
+    question_id: UUID4 = Field(..., alias="questionId")
+    section_id: UUID4 = Field(..., alias="sectionId")
+    book_id: UUID4 = Field(..., alias="bookId")
+
+    ease: float = 2.5
+    interval_days: float = Field(0.0, alias="intervalDays")
+    repetitions: int = 0
+    lapses: int = 0
+    reviews: int = 0
+    score_sum: float = Field(0.0, alias="scoreSum")
+    last_score: float | None = Field(None, alias="lastScore")
+    last_reviewed_at: datetime | None = Field(None, alias="lastReviewedAt")
+    due: datetime | None = None
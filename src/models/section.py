@@ -1,7 +1,7 @@
 import uuid
 from typing import List
 from pydantic import Field
-from models.base import NoSQLBaseDocument
+from models.base import NoSQLBaseDocument, BasePydanticModel
 
 
 class QuestionItem(NoSQLBaseDocument):
@@ -13,6 +13,12 @@ class QuestionItem(NoSQLBaseDocument):
     question: str
     type: str
 
+    reference_answer: str | None = Field(None, alias="referenceAnswer")
+    rubric: list[str] = Field(default_factory=list)
+    supporting_passages: list[str] = Field(
+        default_factory=list, alias="supportingPassages"
+    )
+
 
 class SectionDocument(NoSQLBaseDocument):
     """
@@ -25,5 +31,21 @@ class SectionDocument(NoSQLBaseDocument):
     start_page: int = Field(..., alias="startPage")
     end_page: int = Field(..., alias="endPage")
     text: str | None = None
+    passages: list[str] = Field(default_factory=list)
+    token_count: int | None = Field(None, alias="tokenCount")
+    digest: str | None = None
 
     questions: List[QuestionItem] = Field(default_factory=list)
+
+
+class QuestionGenerationProgress(BasePydanticModel):
+    """
+    Progress report for one section of a bulk question generation run.
+    """
+
+    section_id: uuid.UUID
+    section_name: str
+    completed: int
+    total: int
+    questions: list[QuestionItem] = Field(default_factory=list)
+    error: str | None = None
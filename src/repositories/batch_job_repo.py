@@ -0,0 +1,38 @@
+from models.batch_job import BatchJobDocument
+from repositories.base_repo import AbstractRepository
+
+
+class BatchJobRepository(AbstractRepository[BatchJobDocument]):
+    """
+    Concrete repository for the BatchJobDocument model.
+    """
+
+    def __init__(self):
+        super().__init__(collection_name="batch_jobs")
+
+    def model_class(self) -> type[BatchJobDocument]:
+        return BatchJobDocument
+
+    def list_pending(self) -> list[BatchJobDocument]:
+        return self.list({"applied": False})
+
+    def update_status(self, job_id: str, status: str) -> None:
+        self.collection.update_one({"_id": job_id}, {"$set": {"status": status}})
+
+    def mark_item_applied(
+        self, job_id: str, custom_id: str, error: str | None = None
+    ) -> bool:
+        """Marks an item applied once; False if it already was."""
+        result = self.collection.update_one(
+            {
+                "_id": job_id,
+                "items": {
+                    "$elemMatch": {"customId": custom_id, "applied": {"$ne": True}}
+                },
+            },
+            {"$set": {"items.$.applied": True, "items.$.error": error}},
+        )
+        return result.modified_count > 0
+
+    def mark_applied(self, job_id: str) -> None:
+        self.collection.update_one({"_id": job_id}, {"$set": {"applied": True}})
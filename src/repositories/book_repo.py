@@ -1,14 +1,98 @@
-from models.book import BookDocument
+import threading
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.collation import Collation
+
+from models.book import BookDocument, BookListItem, BookSort
 from repositories.base_repo import AbstractRepository
 
+# Case-insensitive ordering and matching of titles
+TITLE_COLLATION = Collation(locale="en", strength=2)
+
+# Fields read for library listings
+LIST_PROJECTION = {
+    "userId": 1,
+    "title": 1,
+    "createdAt": 1,
+    "metadata": 1,
+    "tokenCount": 1,
+}
+
+# Keyset of each sort order: the sort field, then _id as a tie breaker
+SORT_KEYS: dict[BookSort, tuple[str, int]] = {
+    "newest": ("createdAt", DESCENDING),
+    "oldest": ("createdAt", ASCENDING),
+    "title": ("title", ASCENDING),
+    "title_desc": ("title", DESCENDING),
+}
+
 
 class BookRepository(AbstractRepository[BookDocument]):
     """
     Concrete repository for the BookDocument model.
     """
 
+    _indexes_created = False
+    _indexes_lock = threading.Lock()
+
     def __init__(self):
         super().__init__(collection_name="books")
+        self.ensure_indexes()
 
     def model_class(self) -> type[BookDocument]:
         return BookDocument
+
+    def ensure_indexes(self) -> None:
+        """Creates the library listing and search indexes once per process."""
+        with self._indexes_lock:
+            if BookRepository._indexes_created:
+                return
+            self.collection.create_index(
+                [("userId", ASCENDING), ("createdAt", ASCENDING), ("_id", ASCENDING)]
+            )
+            self.collection.create_index(
+                [("userId", ASCENDING), ("title", ASCENDING), ("_id", ASCENDING)],
+                collation=TITLE_COLLATION,
+            )
+            self.collection.create_index([("userId", ASCENDING), ("title", TEXT)])
+            BookRepository._indexes_created = True
+
+    @staticmethod
+    def keyset(item: BookListItem, sort: BookSort) -> tuple[str, str]:
+        """The (sort value, _id) keyset of `item`, as stored."""
+        field, _ = SORT_KEYS[sort]
+        return item.to_mongo()[field], str(item.id)
+
+    def list_page(
+        self,
+        user_id: str,
+        sort: BookSort,
+        limit: int,
+        after: tuple | None = None,
+        search: str | None = None,
+    ) -> list[BookListItem]:
+        """
+        Up to `limit` of the user's books in `sort` order, starting after the
+        (sort value, _id) keyset `after`. With `search`, only books whose
+        title contains the search words are listed, using the text index.
+        """
+        field, direction = SORT_KEYS[sort]
+        filter_dict: dict = {"userId": user_id}
+        if search:
+            filter_dict["$text"] = {"$search": search}
+        if after is not None:
+            value, last_id = after
+            op = "$gt" if direction == ASCENDING else "$lt"
+            filter_dict["$or"] = [
+                {field: {op: value}},
+                {field: value, "_id": {op: last_id}},
+            ]
+
+        # Text search can't use a collation; its matches are sorted in memory
+        collation = TITLE_COLLATION if field == "title" and not search else None
+        cursor = (
+            self.collection.find(filter_dict, LIST_PROJECTION, collation=collation)
+            .sort([(field, direction), ("_id", direction)])
+            .limit(limit)
+        )
+        return [BookListItem.from_mongo(data) for data in cursor]
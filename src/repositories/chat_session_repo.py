@@ -40,3 +40,19 @@ class ChatSessionRepository(AbstractRepository[ChatSessionDocument]):
         )
 
         return [self.model_class().from_mongo(d) for d in cursor]
+
+    def record(self, session: ChatSessionDocument) -> bool:
+        """
+        Replaces or inserts the finished session; True if it wasn't recorded
+        before, so per-session aggregates are only counted once.
+        """
+        result = self.collection.replace_one(
+            {"_id": str(session.id)}, session.to_mongo(), upsert=True
+        )
+        return result.upserted_id is not None
+
+    def iter_chat_sessions(self, user_id: str | None = None):
+        """Streams sessions (of one user, or everyone) oldest first."""
+        filter_dict = {"userId": user_id} if user_id else {}
+        for data in self.collection.find(filter_dict).sort("createdAt", 1):
+            yield self.model_class().from_mongo(data)
@@ -0,0 +1,90 @@
+import threading
+
+from pymongo import ASCENDING, UpdateOne
+
+from models.base import stable_uuid4
+from models.progress_rollup import ALL_TIME, ProgressRollupDocument
+from repositories.base_repo import AbstractRepository
+
+
+class ProgressRollupRepository(AbstractRepository[ProgressRollupDocument]):
+    """
+    Concrete repository for the ProgressRollupDocument model.
+    """
+
+    _indexes_created = False
+    _indexes_lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__(collection_name="progress_rollups")
+        self.ensure_indexes()
+
+    def model_class(self) -> type[ProgressRollupDocument]:
+        return ProgressRollupDocument
+
+    def ensure_indexes(self) -> None:
+        """Creates the daily trend index once per process."""
+        with self._indexes_lock:
+            if ProgressRollupRepository._indexes_created:
+                return
+            self.collection.create_index(
+                [
+                    ("userId", ASCENDING),
+                    ("bookId", ASCENDING),
+                    ("sectionId", ASCENDING),
+                    ("day", ASCENDING),
+                ]
+            )
+            ProgressRollupRepository._indexes_created = True
+
+    @staticmethod
+    def rollup_id(user_id, book_id, section_id, day: str) -> str:
+        return str(stable_uuid4(user_id, book_id, section_id or "", day))
+
+    def increment(self, rollups: list[tuple[dict, dict]]) -> None:
+        """
+        Applies `(key, increments)` pairs, where the key has userId, bookId,
+        sectionId and day, creating missing rollups.
+        """
+        if not rollups:
+            return
+        self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {
+                        "_id": self.rollup_id(
+                            key["userId"],
+                            key["bookId"],
+                            key["sectionId"],
+                            key["day"],
+                        )
+                    },
+                    {"$inc": increments, "$setOnInsert": key},
+                    upsert=True,
+                )
+                for key, increments in rollups
+            ],
+            ordered=False,
+        )
+
+    def get_rollup(
+        self,
+        user_id: str,
+        book_id: str,
+        section_id: str | None = None,
+        day: str = ALL_TIME,
+    ) -> ProgressRollupDocument | None:
+        return self.get(self.rollup_id(user_id, book_id, section_id, day))
+
+    def list_days(
+        self, user_id: str, book_id: str, since_day: str, section_id: str | None = None
+    ) -> list[ProgressRollupDocument]:
+        cursor = self.collection.find(
+            {
+                "userId": user_id,
+                "bookId": book_id,
+                "sectionId": section_id,
+                "day": {"$gte": since_day, "$ne": ALL_TIME},
+            }
+        ).sort("day", ASCENDING)
+        return [self.model_class().from_mongo(data) for data in cursor]
@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from models.question_stats import QuestionStatsDocument
+from repositories.base_repo import AbstractRepository
+
+
+class QuestionStatsRepository(AbstractRepository[QuestionStatsDocument]):
+    """
+    Concrete repository for the QuestionStatsDocument model.
+    """
+
+    _indexes_created = False
+    _indexes_lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__(collection_name="question_stats")
+        self.ensure_indexes()
+
+    def model_class(self) -> type[QuestionStatsDocument]:
+        return QuestionStatsDocument
+
+    def ensure_indexes(self) -> None:
+        """Creates the scheduling indexes once per process."""
+        with self._indexes_lock:
+            if QuestionStatsRepository._indexes_created:
+                return
+            # next_due, weakest first
+            self.collection.create_index(
+                [
+                    ("userId", ASCENDING),
+                    ("sectionId", ASCENDING),
+                    ("lastScore", ASCENDING),
+                    ("due", ASCENDING),
+                ]
+            )
+            # next_scheduled, soonest first
+            self.collection.create_index(
+                [("userId", ASCENDING), ("sectionId", ASCENDING), ("due", ASCENDING)]
+            )
+            QuestionStatsRepository._indexes_created = True
+
+    def next_due(
+        self,
+        user_id: str,
+        section_ids: list[str],
+        now: datetime,
+        question_ids: list[str],
+    ) -> QuestionStatsDocument | None:
+        """
+        The weakest of `question_ids` that is due, most overdue first among
+        equals.
+        """
+        data = self.collection.find_one(
+            {
+                "userId": user_id,
+                "sectionId": {"$in": section_ids},
+                "due": {"$lte": now},
+                "questionId": {"$in": question_ids},
+            },
+            sort=[("lastScore", ASCENDING), ("due", ASCENDING)],
+        )
+        return self.model_class().from_mongo(data) if data else None
+
+    def next_scheduled(
+        self, user_id: str, section_ids: list[str], question_ids: list[str]
+    ) -> QuestionStatsDocument | None:
+        """The one of `question_ids` due soonest, for studying ahead of schedule."""
+        data = self.collection.find_one(
+            {
+                "userId": user_id,
+                "sectionId": {"$in": section_ids},
+                "questionId": {"$in": question_ids},
+            },
+            sort=[("due", ASCENDING)],
+        )
+        return self.model_class().from_mongo(data) if data else None
+
+    def reviewed_question_ids(self, user_id: str, section_ids: list[str]) -> set[str]:
+        cursor = self.collection.find(
+            {"userId": user_id, "sectionId": {"$in": section_ids}},
+            {"questionId": 1, "_id": 0},
+        )
+        return {data["questionId"] for data in cursor}
+
+    def apply_review(
+        self, stats: QuestionStatsDocument, updates: dict, score: float, lapsed: bool
+    ) -> bool:
+        """
+        Records a review on top of `stats` with atomic $set/$inc. Returns
+        False if another review was recorded since `stats` was read.
+        """
+        try:
+            result = self.collection.update_one(
+                {"_id": str(stats.id), "reviews": stats.reviews},
+                {
+                    "$set": updates,
+                    "$inc": {"reviews": 1, "scoreSum": score, "lapses": int(lapsed)},
+                    "$setOnInsert": {
+                        "userId": str(stats.user_id),
+                        "questionId": str(stats.question_id),
+                        "sectionId": str(stats.section_id),
+                        "bookId": str(stats.book_id),
+                        "createdAt": stats.created_at,
+                    },
+                },
+                upsert=stats.reviews == 0,
+            )
+        except DuplicateKeyError:
+            return False
+        return result.matched_count > 0 or result.upserted_id is not None
@@ -1,18 +1,55 @@
+import threading
+
+from loguru import logger
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
 from models.section import QuestionItem, SectionDocument
 from repositories.base_repo import AbstractRepository
 
+# Fields left out of section outlines, which are enough for listings
+OUTLINE_PROJECTION = {"text": 0, "passages": 0, "digest": 0, "questions": 0}
+
 
 class SectionRepository(AbstractRepository[SectionDocument]):
     """
     Concrete repository for the SectionDocument model.
     """
 
+    _indexes_created = False
+    _indexes_lock = threading.Lock()
+
     def __init__(self):
         super().__init__(collection_name="sections")
+        self.ensure_indexes()
 
     def model_class(self) -> type[SectionDocument]:
         return SectionDocument
 
+    def ensure_indexes(self) -> None:
+        """Creates the section identity index once per process."""
+        with self._indexes_lock:
+            if SectionRepository._indexes_created:
+                return
+            try:
+                # A book has one section per name and start page
+                self.collection.create_index(
+                    [
+                        ("bookId", ASCENDING),
+                        ("name", ASCENDING),
+                        ("startPage", ASCENDING),
+                    ],
+                    unique=True,
+                )
+            except OperationFailure as e:
+                logger.warning(f"Couldn't create the unique section index: {e}")
+            SectionRepository._indexes_created = True
+
+    def list_outlines(self, filter_dict: dict) -> list[SectionDocument]:
+        """Sections without their text, passages, digest and questions."""
+        cursor = self.collection.find(filter_dict, OUTLINE_PROJECTION)
+        return [self.model_class().from_mongo(d) for d in cursor]
+
     def get_question(self, section_id: str, question_id: str) -> QuestionItem | None:
         result = self.collection.find_one(
             {"_id": section_id, "questions._id": question_id},
@@ -30,6 +67,84 @@ class SectionRepository(AbstractRepository[SectionDocument]):
         )
         return result.modified_count > 0
 
+    def add_questions(
+        self, section_id: str, questions: list[QuestionItem]
+    ) -> list[QuestionItem]:
+        """
+        Append questions to a section without rewriting the whole document.
+        A question is skipped if the section already has its ID or the same
+        question text, so repeating a generation doesn't duplicate questions.
+        The new questions are pushed in one update, which only applies if
+        none of them was added concurrently since the section was read;
+        otherwise the section is read again. Returns the questions that were
+        actually added.
+        """
+        while True:
+            section = self.collection.find_one(
+                {"_id": section_id}, {"questions._id": 1, "questions.question": 1}
+            )
+            if section is None:
+                return []
+            ids = {q["_id"] for q in section.get("questions", [])}
+            texts = {q.get("question") for q in section.get("questions", [])}
+            new_questions = []
+            for question in questions:
+                if str(question.id) in ids or question.question in texts:
+                    continue
+                ids.add(str(question.id))
+                texts.add(question.question)
+                new_questions.append(question)
+            if not new_questions:
+                return []
+
+            result = self.collection.update_one(
+                {
+                    "_id": section_id,
+                    "questions._id": {"$nin": [str(q.id) for q in new_questions]},
+                    "questions.question": {"$nin": [q.question for q in new_questions]},
+                },
+                {
+                    "$push": {
+                        "questions": {"$each": [q.to_mongo() for q in new_questions]}
+                    }
+                },
+            )
+            if result.modified_count:
+                return new_questions
+
+    def find_question_by_text(
+        self, section_id: str, question_text: str
+    ) -> QuestionItem | None:
+        result = self.collection.find_one(
+            {"_id": section_id, "questions.question": question_text},
+            {"questions.$": 1},
+        )
+        if result and result.get("questions"):
+            return QuestionItem.from_mongo(result["questions"][0])
+        return None
+
+    def create_if_absent(self, section: SectionDocument) -> SectionDocument:
+        """
+        Inserts the section unless the book already has a section with the
+        same name and start page, in which case that one is returned.
+        """
+        key = {
+            "bookId": str(section.book_id),
+            "name": section.name,
+            "startPage": section.start_page,
+        }
+        try:
+            result = self.collection.find_one_and_update(
+                key,
+                {"$setOnInsert": section.to_mongo()},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # A concurrent upsert inserted it first
+            result = self.collection.find_one(key)
+        return self.model_class().from_mongo(result)
+
     def delete_question(self, section_id: str, question_id: str) -> bool:
         """Delete a specific question from a section
 
@@ -0,0 +1,173 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+
+from config import settings
+from db.mongo_connection import get_mongo_database
+from models.chat_session import ChatMessage, ChatSessionState
+from repositories.base_repo import AbstractRepository
+
+
+class SessionStore(ABC):
+    """
+    Keeps the state of live chat sessions outside the app process. Older
+    messages of long sessions are spilled to the store in chunks, keyed by
+    the number of messages spilled before them, so a chunk written by a run
+    that failed before saving the state is simply overwritten later.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> ChatSessionState | None:
+        pass
+
+    @abstractmethod
+    def save(self, state: ChatSessionState) -> None:
+        pass
+
+    @abstractmethod
+    def append(self, state: ChatSessionState, messages: list[ChatMessage]) -> bool:
+        """
+        Saves `state` except its messages and appends `messages` to the stored
+        ones. False if there is no stored state to append to.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def spill(self, session_id: str, offset: int, messages: list[ChatMessage]) -> None:
+        """Stores `messages`, the ones following the first `offset` spilled."""
+        pass
+
+    @abstractmethod
+    def get_spilled(self, session_id: str, count: int) -> list[ChatMessage]:
+        """The first `count` spilled messages of the session."""
+        pass
+
+
+class MongoSessionStore(AbstractRepository[ChatSessionState], SessionStore):
+    def __init__(self):
+        super().__init__(collection_name="chat_session_states")
+        self._spills = get_mongo_database()["chat_session_spills"]
+
+    def model_class(self) -> type[ChatSessionState]:
+        return ChatSessionState
+
+    def save(self, state: ChatSessionState) -> None:
+        self.update(state)
+
+    def append(self, state: ChatSessionState, messages: list[ChatMessage]) -> bool:
+        data = state.to_mongo()
+        session = data.pop("session")
+        del session["messages"]
+        updates = {
+            **{key: value for key, value in data.items() if key != "_id"},
+            **{f"session.{key}": value for key, value in session.items()},
+        }
+        result = self.collection.update_one(
+            {"_id": data["_id"]},
+            {
+                "$set": updates,
+                "$push": {
+                    "session.messages": {
+                        "$each": [message.to_mongo() for message in messages]
+                    }
+                },
+            },
+        )
+        return result.matched_count > 0
+
+    def delete(self, session_id: str) -> bool:
+        self._spills.delete_many({"sessionId": session_id})
+        return super().delete(session_id)
+
+    def spill(self, session_id: str, offset: int, messages: list[ChatMessage]) -> None:
+        self._spills.replace_one(
+            {"_id": f"{session_id}:{offset}"},
+            {
+                "sessionId": session_id,
+                "offset": offset,
+                "messages": [message.to_mongo() for message in messages],
+            },
+            upsert=True,
+        )
+
+    def get_spilled(self, session_id: str, count: int) -> list[ChatMessage]:
+        cursor = self._spills.find(
+            {"sessionId": session_id, "offset": {"$lt": count}}
+        ).sort("offset", 1)
+        messages = [
+            ChatMessage.from_mongo(data)
+            for chunk in cursor
+            for data in chunk["messages"]
+        ]
+        return messages[:count]
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Serialised states in a dict shared by all instances in the process, for
+    single-process deployments and local development.
+    """
+
+    _states: dict[str, dict] = {}
+    _spills: dict[str, dict[int, list[dict]]] = {}
+    _lock = threading.Lock()
+
+    def get(self, session_id: str) -> ChatSessionState | None:
+        with self._lock:
+            data = self._states.get(session_id)
+        return ChatSessionState.from_mongo(dict(data)) if data else None
+
+    def save(self, state: ChatSessionState) -> None:
+        data = state.to_mongo()
+        with self._lock:
+            self._states[data["_id"]] = data
+
+    def append(self, state: ChatSessionState, messages: list[ChatMessage]) -> bool:
+        data = state.to_mongo()
+        with self._lock:
+            stored = self._states.get(data["_id"])
+            if stored is None:
+                return False
+            data["session"]["messages"] = stored["session"]["messages"] + [
+                message.to_mongo() for message in messages
+            ]
+            self._states[data["_id"]] = data
+        return True
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._states.pop(session_id, None)
+            self._spills.pop(session_id, None)
+
+    def spill(self, session_id: str, offset: int, messages: list[ChatMessage]) -> None:
+        data = [message.to_mongo() for message in messages]
+        with self._lock:
+            self._spills.setdefault(session_id, {})[offset] = data
+
+    def get_spilled(self, session_id: str, count: int) -> list[ChatMessage]:
+        with self._lock:
+            chunks = sorted(self._spills.get(session_id, {}).items())
+        messages = [
+            ChatMessage.from_mongo(dict(data))
+            for offset, chunk in chunks
+            if offset < count
+            for data in chunk
+        ]
+        return messages[:count]
+
+
+def _reset_after_fork() -> None:
+    InMemorySessionStore._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_session_store() -> SessionStore:
+    if settings.CHAT_SESSION_STORE == "memory":
+        return InMemorySessionStore()
+    return MongoSessionStore()
@@ -0,0 +1,297 @@
+import argparse
+import time
+import uuid
+
+from loguru import logger
+
+from config import settings
+from llm.batch import (
+    TERMINAL_STATUSES,
+    BatchClient,
+    BatchResult,
+    build_batch_line,
+    get_batch_client,
+    parse_batch_output,
+    record_batch_usage,
+    to_jsonl,
+)
+from llm.llm import (
+    QuestionList,
+    SectionInfoList,
+    is_valid_section_info,
+    questions_prompt,
+    section_info_prompt,
+)
+from models.base import stable_uuid4
+from models.batch_job import (
+    BatchJobDocument,
+    BatchJobItem,
+    BatchJobKind,
+    SectionExtractionParams,
+)
+from repositories.batch_job_repo import BatchJobRepository
+from services.container import container
+from services.section_service import SectionService, get_section_service
+
+TASK_BY_KIND = {
+    BatchJobKind.QUESTIONS: ("generate_questions", QuestionList),
+    BatchJobKind.SECTION_INFO: ("section_info", SectionInfoList),
+}
+
+
+class BatchService:
+    """
+    Runs question generation and section extraction as offline batch jobs.
+    Results are applied idempotently, so a job can be polled and applied
+    any number of times. Run from `src/`:
+
+        python -m services.batch_service submit-questions <book_id>
+        python -m services.batch_service poll [--wait]
+    """
+
+    def __init__(
+        self,
+        section_service: SectionService,
+        batch_job_repo: BatchJobRepository,
+        batch_client: BatchClient,
+    ):
+        self.section_service = section_service
+        self.batch_job_repo = batch_job_repo
+        self.batch_client = batch_client
+
+    def submit_question_generation(
+        self,
+        book_id: uuid.UUID,
+        num_questions: int,
+        section_ids: list[uuid.UUID] | None = None,
+    ) -> BatchJobDocument:
+        sections = [
+            section
+            for section in self.section_service.get_sections_by_book_id(book_id)
+            if section.text and (section_ids is None or section.id in section_ids)
+        ]
+        if not sections:
+            raise ValueError(f"No sections with text found for book {book_id}")
+
+        items, lines = [], []
+        for section in sections:
+            custom_id = f"questions:{section.id}"
+            items.append(
+                BatchJobItem(
+                    custom_id=custom_id,
+                    book_id=book_id,
+                    section_id=section.id,
+                    num_questions=num_questions,
+                )
+            )
+            lines.append(
+                build_batch_line(
+                    custom_id,
+                    "generate_questions",
+                    questions_prompt(section.text, num_questions),
+                    QuestionList,
+                )
+            )
+        return self._submit(BatchJobKind.QUESTIONS, items, lines)
+
+    def submit_section_extraction(
+        self, extractions: list[SectionExtractionParams]
+    ) -> BatchJobDocument:
+        """Extracts the sections of many books (e.g. a library import) in one job."""
+        if not extractions:
+            raise ValueError("Nothing to extract")
+
+        book_service = self.section_service.book_service
+        items, lines = [], []
+        for params in extractions:
+            book_content_file = book_service.get_book_content(params.book_id)
+            if not book_content_file:
+                raise ValueError(f"Book content not found for book {params.book_id}")
+            preface_text = book_service.get_pages_text(
+                file_data=book_content_file,
+                start_page=params.preface_start_page,
+                end_page=params.preface_end_page,
+            )
+            custom_id = f"section_info:{params.book_id}"
+            items.append(
+                BatchJobItem(
+                    custom_id=custom_id, book_id=params.book_id, extraction=params
+                )
+            )
+            lines.append(
+                build_batch_line(
+                    custom_id,
+                    "section_info",
+                    section_info_prompt(preface_text, params.example_titles),
+                    SectionInfoList,
+                )
+            )
+        return self._submit(BatchJobKind.SECTION_INFO, items, lines)
+
+    def _submit(
+        self, kind: BatchJobKind, items: list[BatchJobItem], lines: list[dict]
+    ) -> BatchJobDocument:
+        provider_batch_id = self.batch_client.submit(
+            to_jsonl(lines), metadata={"kind": kind.value}
+        )
+        job = BatchJobDocument(
+            kind=kind, provider_batch_id=provider_batch_id, items=items
+        )
+        return self.batch_job_repo.create(job)
+
+    def get_job(self, job_id: uuid.UUID) -> BatchJobDocument:
+        job = self.batch_job_repo.get(str(job_id))
+        if not job:
+            raise ValueError(f"Batch job with id {job_id} not found")
+        return job
+
+    def refresh(self, job_id: uuid.UUID) -> BatchJobDocument:
+        """Polls the provider once and applies the results if the job finished."""
+        job = self.get_job(job_id)
+        if job.applied:
+            return job
+
+        job.status = self.batch_client.get_status(job.provider_batch_id)
+        self.batch_job_repo.update_status(str(job.id), job.status)
+        if job.status in TERMINAL_STATUSES:
+            self.apply_results(job)
+            job = self.get_job(job_id)
+        return job
+
+    def refresh_pending(self) -> list[BatchJobDocument]:
+        """Polls every job whose results haven't been applied yet."""
+        jobs = []
+        for job in self.batch_job_repo.list_pending():
+            try:
+                jobs.append(self.refresh(job.id))
+            except Exception as e:
+                logger.warning(f"Couldn't refresh batch job {job.id}: {e}")
+        return jobs
+
+    def wait(
+        self,
+        job_id: uuid.UUID,
+        poll_interval: float | None = None,
+        timeout: float | None = None,
+    ) -> BatchJobDocument:
+        poll_interval = poll_interval or settings.BATCH_POLL_INTERVAL_SECONDS
+        started_at = time.monotonic()
+        job = self.refresh(job_id)
+        while not job.applied:
+            if timeout is not None and time.monotonic() - started_at > timeout:
+                raise TimeoutError(f"Batch job {job_id} is still {job.status}")
+            time.sleep(poll_interval)
+            job = self.refresh(job_id)
+        return job
+
+    def apply_results(self, job: BatchJobDocument) -> None:
+        task, schema = TASK_BY_KIND[job.kind]
+        output = (
+            self.batch_client.get_output(job.provider_batch_id)
+            if job.status == "completed"
+            else ""
+        )
+        results = parse_batch_output(output, schema)
+
+        for item in job.items:
+            if item.applied:
+                continue
+            result = results.get(item.custom_id) or BatchResult(
+                custom_id=item.custom_id, error=f"No result (batch {job.status})"
+            )
+            if result.usage:
+                record_batch_usage(task, result)
+            error = result.error
+            if error is None:
+                try:
+                    self._apply_item(job, item, result)
+                except Exception as e:
+                    logger.warning(f"Couldn't apply batch item {item.custom_id}: {e}")
+                    error = str(e)
+            self.batch_job_repo.mark_item_applied(str(job.id), item.custom_id, error)
+
+        self.batch_job_repo.mark_applied(str(job.id))
+
+    def _apply_item(
+        self, job: BatchJobDocument, item: BatchJobItem, result: BatchResult
+    ) -> None:
+        if job.kind == BatchJobKind.QUESTIONS:
+            section = self.section_service.section_repo.get(str(item.section_id))
+            if not section:
+                raise ValueError(f"Section with id {item.section_id} not found")
+            questions = [question.question for question in result.parsed.questions]
+            self.section_service.add_generated_questions(
+                section,
+                questions,
+                question_ids=[
+                    stable_uuid4(job.id, item.custom_id, idx)
+                    for idx in range(len(questions))
+                ],
+            )
+            return
+
+        if not is_valid_section_info(result.parsed):
+            raise ValueError("Extracted sections failed validation")
+        self.section_service.apply_section_info(
+            item.book_id,
+            result.parsed,
+            start_page=item.extraction.start_page,
+            content_end_page=item.extraction.content_end_page,
+            id_seed=f"{job.id}:{item.custom_id}",
+        )
+
+
+def get_batch_service() -> BatchService:
+    return container.get(
+        "batch_service",
+        lambda: BatchService(
+            section_service=get_section_service(),
+            batch_job_repo=BatchJobRepository(),
+            batch_client=get_batch_client(),
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline LLM batch jobs")
+    subparsers = parser.add_subparsers(dest="command")
+    submit = subparsers.add_parser(
+        "submit-questions", help="Generate questions for a book's sections"
+    )
+    submit.add_argument("book_id", type=uuid.UUID)
+    submit.add_argument("--num-questions", type=int, default=5)
+    submit.add_argument(
+        "--section-id",
+        type=uuid.UUID,
+        action="append",
+        dest="section_ids",
+        help="Only these sections (repeatable)",
+    )
+    poll = subparsers.add_parser(
+        "poll", help="Poll pending jobs and apply the finished ones"
+    )
+    poll.add_argument(
+        "--wait", action="store_true", help="Keep polling until all are applied"
+    )
+    args = parser.parse_args()
+
+    batch_service = get_batch_service()
+    if args.command == "submit-questions":
+        job = batch_service.submit_question_generation(
+            args.book_id, args.num_questions, args.section_ids
+        )
+        logger.info(f"Submitted batch job {job.id} ({len(job.items)} sections)")
+    elif args.command == "poll":
+        while True:
+            jobs = batch_service.refresh_pending()
+            for job in jobs:
+                logger.info(f"Batch job {job.id}: {job.status}, applied={job.applied}")
+            if not args.wait or all(job.applied for job in jobs):
+                break
+            time.sleep(settings.BATCH_POLL_INTERVAL_SECONDS)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
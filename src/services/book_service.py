@@ -1,9 +1,14 @@
+import base64
+import json
+
+from config import settings
 from models.section import SectionDocument
 from repositories.book_repo import BookRepository
 from repositories.section_repo import SectionRepository
+from services.container import container
 from services.s3_storage import S3StorageService
 import uuid
-from models.book import BookDocument, BookMetadata
+from models.book import BookDocument, BookMetadata, BookPage, BookSort
 import pypdf
 from io import BytesIO
 
@@ -67,6 +72,41 @@ class BookService:
     def get_books_by_user_id(self, user_id: uuid.UUID) -> list[BookDocument]:
         return self.book_repo.list({"userId": str(user_id)})
 
+    def search_books(
+        self,
+        user_id: uuid.UUID,
+        query: str = "",
+        sort: BookSort = "newest",
+        cursor: str | None = None,
+        page_size: int | None = None,
+    ) -> BookPage:
+        """
+        One page of the user's library, optionally filtered to titles with
+        the words in `query`. Pass the returned `next_cursor` back to get
+        the following page; each page is a single indexed query.
+        """
+        page_size = page_size or settings.LIBRARY_PAGE_SIZE
+        after = None
+        if cursor:
+            try:
+                after = tuple(json.loads(base64.urlsafe_b64decode(cursor)))
+            except ValueError as e:
+                raise ValueError(f"Invalid library cursor: {cursor}") from e
+
+        items = self.book_repo.list_page(
+            user_id=str(user_id),
+            sort=sort,
+            limit=page_size + 1,
+            after=after,
+            search=query.strip() or None,
+        )
+        next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            keyset = self.book_repo.keyset(items[-1], sort)
+            next_cursor = base64.urlsafe_b64encode(json.dumps(keyset).encode()).decode()
+        return BookPage(items=items, next_cursor=next_cursor)
+
     def delete_book(self, book_id: uuid.UUID) -> None:
         book = self.get_book(book_id)
         if not book:
@@ -94,6 +134,13 @@ class BookService:
         book.first_page = start_page
         return self.book_repo.update(book)
 
+    def set_book_token_count(self, book_id: uuid.UUID, token_count: int):
+        book = self.get_book(book_id)
+        if not book:
+            return None
+        book.token_count = token_count
+        return self.book_repo.update(book)
+
     def get_book_sections(
         self, book_id: uuid.UUID, with_questions: bool = False
     ) -> list[SectionDocument]:
@@ -109,8 +156,11 @@ class BookService:
 
 
 def get_book_service() -> BookService:
-    return BookService(
-        book_repo=BookRepository(),
-        s3_storage=S3StorageService(),
-        section_repo=SectionRepository(),
+    return container.get(
+        "book_service",
+        lambda: BookService(
+            book_repo=BookRepository(),
+            s3_storage=S3StorageService(),
+            section_repo=SectionRepository(),
+        ),
     )
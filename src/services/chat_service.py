@@ -1,19 +1,107 @@
-from llm.llm import determine_message_type, evaluate_answer, generate_explanation
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from loguru import logger
+from llm.governor import in_llm_context, iter_in_llm_context, llm_context
+from llm.llm import (
+    determine_message_type,
+    evaluate_answer,
+    generate_explanation,
+    parse_answer_evaluation,
+    stream_answer_evaluation,
+    stream_explanation,
+)
+from llm.router import classify_message
+from config import settings
 from repositories.chat_session_repo import ChatSessionRepository
+from repositories.session_store import SessionStore, get_session_store
 from services.book_service import BookService, get_book_service
+from services.container import container
+from services.message_log import MessageLog
+from services.progress_service import ProgressService, get_progress_service
 from services.section_service import SectionService, get_section_service
+from services.spaced_repetition import (
+    SpacedRepetitionService,
+    get_spaced_repetition_service,
+)
+from services.working_set import (
+    ChatWorkingSet,
+    cache_working_set,
+    drop_working_set,
+    get_cached_working_set,
+)
 from models.chat_session import (
     ChatMessage,
     ChatMessageRole,
     ChatMessageType,
     ChatSessionDocument,
+    ChatSessionState,
     ChatSessionSummary,
+    ExamAnswerResult,
 )
 from models.section import QuestionItem, SectionDocument
+from collections.abc import Iterator
 from typing import List
 import uuid
 import random
 
+NEXT_QUESTION_HINT = " \n\n for next question type 'next'"
+
+# Deferred grades run on a process-wide pool and are tracked by (session ID,
+# question ID), so a ChatService rebuilt from the session store on the next
+# page run picks up the grades an earlier instance started. Entries are kept
+# in the order they were started, with their start time, so the ones of
+# abandoned sessions can be evicted from the front.
+_grading_executor: ThreadPoolExecutor | None = None
+_deferred_grades: dict[tuple[str, str], tuple[Future[ExamAnswerResult], float]] = {}
+_deferred_grades_lock = threading.Lock()
+
+
+def _evict_expired_grades(now: float) -> None:
+    """Drops grades started over CHAT_SESSION_TTL_SECONDS ago. Hold the lock."""
+    while _deferred_grades:
+        key, (future, started_at) = next(iter(_deferred_grades.items()))
+        if now - started_at < settings.CHAT_SESSION_TTL_SECONDS:
+            return
+        future.cancel()
+        del _deferred_grades[key]
+
+
+def _drop_deferred_grades(session_id: str) -> None:
+    """Forgets all deferred grades of a session, cancelling the queued ones."""
+    with _deferred_grades_lock:
+        keys = [key for key in _deferred_grades if key[0] == session_id]
+        for key in keys:
+            future, _ = _deferred_grades.pop(key)
+            future.cancel()
+
+
+def attributed_to_session_user(method):
+    """Queues the LLM calls made by `method` under the session's user."""
+
+    @functools.wraps(method)
+    def wrapper(self: "ChatService", *args, **kwargs):
+        with llm_context(user_id=self._session_user_id()):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def persists_session_state(method):
+    """Saves the session state to the session store after `method` returns."""
+
+    @functools.wraps(method)
+    def wrapper(self: "ChatService", *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.save_session()
+        return result
+
+    return wrapper
+
 
 class ChatService:
     """
@@ -25,28 +113,53 @@ class ChatService:
         chat_session_repo: ChatSessionRepository,
         section_service: SectionService,
         book_service: BookService,
+        session_store: SessionStore,
+        spaced_repetition: SpacedRepetitionService,
+        progress_service: ProgressService,
     ):
         self.chat_session_repo = chat_session_repo
         self.section_service = section_service
         self.book_service = book_service
+        self.session_store = session_store
+        self.spaced_repetition = spaced_repetition
+        self.progress_service = progress_service
         self.chat_session = None
+        self.messages = MessageLog()
+        # Older messages moved to the session store, see `_spill_messages`
+        self.spilled_messages = 0
+        self.spilled_scores: list[float] = []
+        # Messages of `messages` already in the stored state, None to rewrite it
+        self._saved_messages: int | None = None
 
-        self.questions = []
+        self.question_ids: list[uuid.UUID] = []
         self.answered_questions = set()
-        self.current_question = None
+        self.current_question_id: uuid.UUID | None = None
+        self.working_set: ChatWorkingSet | None = None
+
+        self.exam = False
+        self.deferred_grading = False
+        # Answers queued for deferred grading, by question ID
+        self.pending_answers: dict[str, str] = {}
 
+    @persists_session_state
     def init_chat_session(
         self,
         user_id: uuid.UUID,
         document_id: uuid.UUID,
         section_ids: List[uuid.UUID],
+        deferred_grading: bool = False,
+        exam: bool = False,
     ):
-        all_questions: List[QuestionItem] = []
-        for section_id in section_ids:
-            questions_in_section = self.section_service.get_questions_by_section_id(
-                section_id
-            )
-            all_questions.extend(questions_in_section)
+        """
+        With `deferred_grading` answers are graded in the background and the
+        next question is asked right away; see `collect_graded_answers`.
+        The session is saved to the session store and can be resumed from
+        its ID with `load_session`.
+        """
+        working_set = ChatWorkingSet(
+            self.section_service.get_sections_by_ids(section_ids)
+        )
+        question_ids = list(working_set.questions)
 
         self.chat_session = ChatSessionDocument(
             user_id=user_id,
@@ -55,22 +168,156 @@ class ChatService:
             messages=[],
             overall_score=None,
         )
-        random.shuffle(all_questions)
-        self.questions = all_questions
+        self.messages = MessageLog()
+        self.spilled_messages = 0
+        self.spilled_scores = []
+        self._saved_messages = None
+        # Exam order, and the order in which unseen questions are introduced
+        random.shuffle(question_ids)
+        self.question_ids = question_ids
+        self.working_set = working_set
+        cache_working_set(self.chat_session.id, working_set)
+        self.answered_questions = set()
+        self.current_question_id = None
+        self.exam = exam
+        self.deferred_grading = deferred_grading
+        self.pending_answers = {}
+
+    @property
+    def session_id(self) -> uuid.UUID | None:
+        return self.chat_session.id if self.chat_session else None
+
+    @property
+    def questions(self) -> list[QuestionItem]:
+        if self.working_set is None:
+            return []
+        return [self.working_set.questions[qid] for qid in self.question_ids]
+
+    @property
+    def current_question(self) -> QuestionItem | None:
+        if self.working_set is None or self.current_question_id is None:
+            return None
+        return self.working_set.questions.get(self.current_question_id)
 
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes held in memory for this session, not counting the
+        working set shared by all services of the session.
+        """
+        return (
+            self.messages.memory_bytes()
+            + sys.getsizeof(self.question_ids)
+            + len(self.question_ids) * sys.getsizeof(uuid.UUID(int=0))
+            + sys.getsizeof(self.answered_questions)
+            + sys.getsizeof(self.spilled_scores)
+            + len(self.spilled_scores) * sys.getsizeof(0.0)
+            + sys.getsizeof(self.pending_answers)
+            + sum(sys.getsizeof(answer) for answer in self.pending_answers.values())
+        )
+
+    def save_session(self) -> None:
+        """
+        Saves the state, appending only the messages added since the last
+        save. The whole message list is written for a new session, after
+        messages were spilled, or if the stored state is gone.
+        """
+        if self.chat_session is None:
+            return
+        state = ChatSessionState(
+            id=self.chat_session.id,
+            session=self.chat_session.model_copy(update={"messages": []}),
+            question_ids=self.question_ids,
+            answered_question_ids=list(self.answered_questions),
+            current_question_id=self.current_question_id,
+            exam=self.exam,
+            deferred_grading=self.deferred_grading,
+            pending_answers=self.pending_answers,
+            spilled_messages=self.spilled_messages,
+            spilled_scores=self.spilled_scores,
+        )
+        if self._saved_messages is None or not self.session_store.append(
+            state, self.messages.to_messages(start=self._saved_messages)
+        ):
+            state.session.messages = self.messages.to_messages()
+            self.session_store.save(state)
+        self._saved_messages = len(self.messages)
+        logger.debug(
+            f"Chat session {self.chat_session.id} holds "
+            f"~{self.memory_usage() // 1024} KiB in memory"
+        )
+
+    def load_session(self, session_id: uuid.UUID | str) -> bool:
+        """
+        Rebuilds the service from the session store with one read for the
+        state, plus one for the sections if this process has no working set
+        for the session yet. Returns False if there is no live session with
+        that ID.
+        """
+        state = self.session_store.get(str(session_id))
+        if state is None:
+            return False
+
+        working_set = get_cached_working_set(session_id)
+        if working_set is None:
+            working_set = ChatWorkingSet(
+                self.section_service.get_sections_by_ids(state.session.section_ids)
+            )
+            cache_working_set(session_id, working_set)
+        questions_by_id = working_set.questions
+        self.working_set = working_set
+        self.messages = MessageLog(state.session.messages)
+        self._saved_messages = len(self.messages)
+        self.chat_session = state.session.model_copy(update={"messages": []})
+        self.spilled_messages = state.spilled_messages
+        self.spilled_scores = list(state.spilled_scores)
+        # Questions deleted since the session started are dropped
+        self.question_ids = [
+            question_id
+            for question_id in state.question_ids
+            if question_id in questions_by_id
+        ]
+        self.answered_questions = set(state.answered_question_ids)
+        self.current_question_id = (
+            state.current_question_id
+            if state.current_question_id in questions_by_id
+            else None
+        )
+        self.exam = state.exam
+        self.deferred_grading = state.deferred_grading
+        self.pending_answers = dict(state.pending_answers)
+        return True
+
+    @persists_session_state
     def get_next_question(self) -> QuestionItem | None:
-        for question in self.questions:
-            if question.id not in self.answered_questions:
-                self.current_question = question
-                self.add_message(
-                    message=question.question,
-                    type=ChatMessageType.QUESTION,
-                    role=ChatMessageRole.ASSISTANT,
-                    question_id=question.id,
-                )
-                return question
-        return None
+        """
+        The next question the spaced-repetition scheduler picks for the user
+        among the session's unanswered questions.
+        """
+        return self._next_question()
 
+    def _next_question(self) -> QuestionItem | None:
+        """`get_next_question` for callers that save the session themselves."""
+        question_id = self.spaced_repetition.next_question_id(
+            user_id=self.chat_session.user_id,
+            section_ids=self.chat_session.section_ids,
+            candidate_ids=self.question_ids,
+            exclude_ids=self.answered_questions,
+        )
+        if question_id is None:
+            return None
+
+        question = self.working_set.questions[question_id]
+        self.current_question_id = question_id
+        self.add_message(
+            message=question.question,
+            type=ChatMessageType.QUESTION,
+            role=ChatMessageRole.ASSISTANT,
+            question_id=question.id,
+        )
+        return question
+
+    @persists_session_state
+    @attributed_to_session_user
     def process_user_message(self, message: str) -> None | str:
         if message.lower() == "next":
             self.add_message(
@@ -78,20 +325,23 @@ class ChatService:
                 type=ChatMessageType.NEXT_QUESTION,
                 role=ChatMessageRole.USER,
             )
-            self.answered_questions.add(self.current_question.id)
-            next_question = self.get_next_question()
+            # None if the question was deleted since the session was saved
+            if self.current_question_id is not None:
+                self.answered_questions.add(self.current_question_id)
+            next_question = self._next_question()
             if next_question is None:
                 return "__ALL_DONE__"
             else:
                 return next_question.question
 
-        message_type = determine_message_type(
-            message=message, question=self.current_question.question
-        )
-        section: SectionDocument = self.section_service.get_section_by_question_id(
-            self.current_question.id
-        )
-        message_type = ChatMessageType(message_type.type)
+        if self.current_question is None:
+            # Nothing to answer or explain, e.g. the question was deleted
+            next_question = self._next_question()
+            if next_question is None:
+                return "__ALL_DONE__"
+            return next_question.question
+
+        message_type = self._route_message(message)
         if message_type == ChatMessageType.ANSWER:
             self.add_message(
                 message=message,
@@ -99,31 +349,28 @@ class ChatService:
                 role=ChatMessageRole.USER,
                 question_id=self.current_question.id,
             )
+            if self.deferred_grading:
+                return self._defer_grading(message)
             response = evaluate_answer(
                 answer=message,
                 question=self.current_question.question,
-                section_content=section.text,
+                section_content=self._get_grading_context(
+                    self.current_question, message
+                ),
             )
-            assistant_message = f"Feedback: {response.feedback}\n\nScore: {response.score} \n\n for next question type 'next'"
-            self.add_message(
-                message=assistant_message,
-                type=ChatMessageType.FEEDBACK,
-                role=ChatMessageRole.ASSISTANT,
-                question_id=self.current_question.id,
-                feedback=response.feedback,
-                score=response.score,
-            )
-            return assistant_message
+            return self._add_feedback_message(response.feedback, response.score)
         elif message_type == ChatMessageType.HELP:
             self.add_message(
                 message=message,
                 type=ChatMessageType.HELP,
                 role=ChatMessageRole.USER,
             )
+            section = self._current_section()
             response = generate_explanation(
                 message=message,
                 question=self.current_question.question,
-                section_content=section.text,
+                section_content=self._get_section_context(),
+                digest=section.digest,
             )
             self.add_message(
                 message=response.explanation,
@@ -132,13 +379,314 @@ class ChatService:
             )
             return response.explanation
         else:
-            assistant_message = "Please provide an answer or ask for help. If you want to skip the question, type 'next'."
+            return self._add_other_message()
+
+    def stream_user_message(self, message: str) -> Iterator[str]:
+        """
+        Streaming counterpart of `process_user_message` for answers and help
+        requests. Yields the assistant reply as it is generated; the messages
+        are persisted once the stream is exhausted. "next" is not handled here.
+        """
+        return iter_in_llm_context(
+            self._stream_user_message(message), user_id=self._session_user_id()
+        )
+
+    def _stream_user_message(self, message: str) -> Iterator[str]:
+        message_type = self._route_message(message)
+        if message_type == ChatMessageType.ANSWER:
+            self.add_message(
+                message=message,
+                type=ChatMessageType.ANSWER,
+                role=ChatMessageRole.USER,
+                question_id=self.current_question.id,
+            )
+            chunks = []
+            yield "Feedback: "
+            for chunk in stream_answer_evaluation(
+                answer=message,
+                question=self.current_question.question,
+                section_content=self._get_grading_context(
+                    self.current_question, message
+                ),
+            ):
+                chunks.append(chunk)
+                yield chunk
+            try:
+                response = parse_answer_evaluation("".join(chunks))
+                feedback, score = response.feedback, response.score
+            except ValueError as e:
+                # Never store a made-up score. Grade again with structured
+                # output and show that feedback, so what is stored is what
+                # the user saw.
+                logger.warning(
+                    f"{e}, grading question {self.current_question.id} again"
+                )
+                result = self._grade_answer(self.current_question, message)
+                feedback, score = result.feedback, result.score
+                if result.error is None:
+                    yield f"\n\nGraded again: {feedback}\n\nScore: {score}"
+                else:
+                    yield "\n\nCouldn't grade your answer."
+            yield NEXT_QUESTION_HINT
+            if score is not None:
+                self._add_feedback_message(feedback, score)
+            else:
+                self.add_message(
+                    message="Couldn't grade your answer.",
+                    type=ChatMessageType.OTHER,
+                    role=ChatMessageRole.ASSISTANT,
+                    question_id=self.current_question.id,
+                )
+        elif message_type == ChatMessageType.HELP:
+            self.add_message(
+                message=message,
+                type=ChatMessageType.HELP,
+                role=ChatMessageRole.USER,
+            )
+            chunks = []
+            section = self._current_section()
+            for chunk in stream_explanation(
+                message=message,
+                question=self.current_question.question,
+                section_content=self._get_section_context(),
+                digest=section.digest,
+            ):
+                chunks.append(chunk)
+                yield chunk
+            self.add_message(
+                message="".join(chunks),
+                type=ChatMessageType.EXPLANATION,
+                role=ChatMessageRole.ASSISTANT,
+            )
+        else:
+            yield self._add_other_message()
+        self.save_session()
+
+    @persists_session_state
+    @attributed_to_session_user
+    def grade_exam(
+        self, answers: dict[uuid.UUID, str], max_concurrency: int | None = None
+    ) -> list[ExamAnswerResult]:
+        """
+        Grades all answers of an exam at once, without routing, with at most
+        `max_concurrency` grading calls in flight. Each graded question is
+        recorded as QUESTION, ANSWER and FEEDBACK messages, in question order.
+        Unanswered questions are skipped.
+        """
+        if self.chat_session is None:
+            raise ValueError("Chat session is not initialized")
+
+        answered = [
+            (question, answers[question.id].strip())
+            for question in self.questions
+            if answers.get(question.id, "").strip()
+        ]
+        if not answered:
+            raise ValueError("Answer at least one question")
+
+        max_workers = max_concurrency or settings.EXAM_GRADING_MAX_CONCURRENCY
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                executor.map(
+                    in_llm_context(lambda item: self._grade_answer(*item)), answered
+                )
+            )
+
+        for result in results:
             self.add_message(
-                message=assistant_message,
-                type=ChatMessageType.OTHER,
+                message=result.question,
+                type=ChatMessageType.QUESTION,
                 role=ChatMessageRole.ASSISTANT,
+                question_id=result.question_id,
+            )
+            self.add_message(
+                message=result.answer,
+                type=ChatMessageType.ANSWER,
+                role=ChatMessageRole.USER,
+                question_id=result.question_id,
+            )
+            if result.error is None:
+                self.add_message(
+                    message=f"Feedback: {result.feedback}\n\nScore: {result.score}",
+                    type=ChatMessageType.FEEDBACK,
+                    role=ChatMessageRole.ASSISTANT,
+                    question_id=result.question_id,
+                    feedback=result.feedback,
+                    score=result.score,
+                )
+                self.answered_questions.add(result.question_id)
+        return results
+
+    def _grade_answer(self, question: QuestionItem, answer: str) -> ExamAnswerResult:
+        result = ExamAnswerResult(
+            question_id=question.id, question=question.question, answer=answer
+        )
+        try:
+            response = evaluate_answer(
+                answer=answer,
+                question=question.question,
+                section_content=self._get_grading_context(question, answer),
             )
-            return assistant_message
+            result.feedback = response.feedback
+            result.score = response.score
+        except Exception as e:
+            logger.warning(f"Couldn't grade answer to question {question.id}: {e}")
+            result.error = str(e)
+        return result
+
+    def _defer_grading(self, answer: str) -> str:
+        """Queues the answer for grading and moves on to the next question."""
+        question = self.current_question
+        self.pending_answers[str(question.id)] = answer
+        self._deferred_grade(str(question.id), answer)
+        self.answered_questions.add(question.id)
+
+        next_question = self._next_question()
+        if next_question is None:
+            return "__ALL_DONE__"
+        return next_question.question
+
+    def _deferred_grade(
+        self, question_id: str, answer: str
+    ) -> Future[ExamAnswerResult]:
+        """
+        The grading future for a pending answer. Grading is (re)started if
+        this process doesn't know about it, e.g. after a restart or when the
+        answer was given on another replica.
+        """
+        global _grading_executor
+        key = (str(self.session_id), question_id)
+        with _deferred_grades_lock:
+            entry = _deferred_grades.get(key)
+            if entry is None:
+                now = time.monotonic()
+                _evict_expired_grades(now)
+                if _grading_executor is None:
+                    _grading_executor = ThreadPoolExecutor(
+                        max_workers=settings.DEFERRED_GRADING_MAX_CONCURRENCY
+                    )
+                question = self.working_set.questions[uuid.UUID(question_id)]
+                with llm_context(user_id=self._session_user_id()):
+                    grade = in_llm_context(self._grade_answer)
+                future = _grading_executor.submit(grade, question, answer)
+                _deferred_grades[key] = (future, now)
+            else:
+                future, _ = entry
+        return future
+
+    @property
+    def pending_grades(self) -> int:
+        return len(self.pending_answers)
+
+    def collect_graded_answers(self) -> list[ExamAnswerResult]:
+        """
+        Adds feedback for the deferred answers graded since the last call to
+        the session and returns their results. Call it from the thread that
+        owns the session, e.g. on every page run.
+        """
+        results = []
+        for question_id, answer in list(self.pending_answers.items()):
+            future = self._deferred_grade(question_id, answer)
+            if not future.done():
+                continue
+            with _deferred_grades_lock:
+                _deferred_grades.pop((str(self.session_id), question_id), None)
+            del self.pending_answers[question_id]
+            results.append(future.result())
+
+        for result in results:
+            if result.error is None:
+                self.add_message(
+                    message=(
+                        f"Feedback on \"{result.question}\": {result.feedback}"
+                        f"\n\nScore: {result.score}"
+                    ),
+                    type=ChatMessageType.FEEDBACK,
+                    role=ChatMessageRole.ASSISTANT,
+                    question_id=result.question_id,
+                    feedback=result.feedback,
+                    score=result.score,
+                )
+            else:
+                self.add_message(
+                    message=f"Couldn't grade your answer to \"{result.question}\".",
+                    type=ChatMessageType.OTHER,
+                    role=ChatMessageRole.ASSISTANT,
+                    question_id=result.question_id,
+                )
+        if results:
+            self.save_session()
+        return results
+
+    def wait_for_grades(self, timeout: float | None = None) -> list[ExamAnswerResult]:
+        """Waits for the outstanding deferred grades and collects them."""
+        futures = [
+            self._deferred_grade(question_id, answer)
+            for question_id, answer in self.pending_answers.items()
+        ]
+        if futures:
+            wait(futures, timeout=timeout)
+        return self.collect_graded_answers()
+
+    def _session_user_id(self) -> uuid.UUID | None:
+        return self.chat_session.user_id if self.chat_session else None
+
+    def _route_message(self, message: str) -> ChatMessageType:
+        prediction = classify_message(
+            message=message, question=self.current_question.question
+        )
+        message_type = prediction.type
+        if not prediction.is_decisive(settings.ROUTER_CONFIDENCE_THRESHOLD):
+            message_type = ChatMessageType(
+                determine_message_type(
+                    message=message, question=self.current_question.question
+                ).type
+            )
+        return message_type
+
+    def _current_section(self) -> SectionDocument:
+        return self.working_set.section_for(self.current_question.id)
+
+    def _get_section_context(self) -> str:
+        # Retrieved for the question only, so every turn on the same question
+        # sends the same prompt prefix and can hit the provider's prompt cache.
+        return self.working_set.question_context(
+            self.current_question.id,
+            lambda section: self.section_service.get_relevant_context(
+                section, question=self.current_question.question
+            ),
+        )
+
+    def _get_grading_context(self, question: QuestionItem, answer: str) -> str:
+        return self.section_service.get_grading_context(
+            question, answer, section=self.working_set.section_for(question.id)
+        )
+
+    def _add_feedback_message(self, feedback: str, score: float) -> str:
+        assistant_message = (
+            f"Feedback: {feedback}\n\nScore: {score}{NEXT_QUESTION_HINT}"
+        )
+        self.add_message(
+            message=assistant_message,
+            type=ChatMessageType.FEEDBACK,
+            role=ChatMessageRole.ASSISTANT,
+            question_id=self.current_question.id,
+            feedback=feedback,
+            score=score,
+        )
+        return assistant_message
+
+    def _add_other_message(self) -> str:
+        assistant_message = (
+            "Please provide an answer or ask for help. "
+            "If you want to skip the question, type 'next'."
+        )
+        self.add_message(
+            message=assistant_message,
+            type=ChatMessageType.OTHER,
+            role=ChatMessageRole.ASSISTANT,
+        )
+        return assistant_message
 
     def add_message(
         self,
@@ -152,55 +700,112 @@ class ChatService:
         if self.chat_session is None:
             return
 
-        if len(self.chat_session.messages) == 0:
-            previous_message = None
-        else:
-            previous_message = self.chat_session.messages[-1]
-
-        self.chat_session.messages.append(
-            ChatMessage(
-                role=role,
-                content=message,
-                type=type,
-                previous_message_id=previous_message.id if previous_message else None,
-                question_id=question_id if question_id else self.current_question.id,
-                feedback=feedback,
+        question_id = question_id or self.current_question_id
+        self.messages.append(
+            role=role,
+            type=type,
+            content=message,
+            question_id=question_id,
+            feedback=feedback,
+            score=score,
+        )
+        if self.messages.memory_bytes() > settings.CHAT_SESSION_MEMORY_BUDGET:
+            self._spill_messages()
+        if type == ChatMessageType.FEEDBACK and score is not None:
+            self.spaced_repetition.record_review(
+                user_id=self.chat_session.user_id,
+                question_id=question_id,
+                section_id=self.working_set.section_for(question_id).id,
+                book_id=self.chat_session.document_id,
                 score=score,
             )
+
+    def _spill_messages(self) -> None:
+        """
+        Moves the oldest messages to the session store until the history
+        uses half of its memory budget. They are saved with the session
+        state on the next save and read back when the session is finished.
+        """
+        count = self.messages.oldest_over(settings.CHAT_SESSION_MEMORY_BUDGET // 2)
+        if not count:
+            return
+        spilled = self.messages.pop_oldest(count)
+        self.session_store.spill(
+            str(self.chat_session.id), self.spilled_messages, spilled
+        )
+        self.spilled_messages += count
+        self._saved_messages = None
+        self.spilled_scores.extend(
+            message.score
+            for message in spilled
+            if message.type == ChatMessageType.FEEDBACK and message.score is not None
         )
 
-    def get_history_messages(self) -> List[ChatMessage]:
-        if self.chat_session is None:
-            return []
-        messages = [
-            {"role": message.role.value, "content": message.content}
-            for message in self.chat_session.messages
-        ]
-        return messages
+    def get_history_messages(self) -> Iterator[tuple[str, str]]:
+        """(role, content) of the messages kept in memory, oldest first."""
+        return self.messages.history()
+
+    def _all_messages(self) -> list[ChatMessage]:
+        spilled = (
+            self.session_store.get_spilled(
+                str(self.chat_session.id), self.spilled_messages
+            )
+            if self.spilled_messages
+            else []
+        )
+        return spilled + self.messages.to_messages()
 
     def finish_chat_session(self) -> None:
         if self.chat_session is None:
             return
 
+        self.wait_for_grades()
+
         self.chat_session.overall_score = self.calculate_overall_score()
-        self.chat_session.number_of_questions = len(self.questions)
-        self.chat_session_repo.create(self.chat_session)
+        self.chat_session.number_of_questions = len(self.question_ids)
+        self.chat_session.messages = self._all_messages()
+        # Upsert, so finishing a session twice (e.g. from two tabs) is harmless
+        if self.chat_session_repo.record(self.chat_session):
+            self._record_progress()
+        self.session_store.delete(str(self.chat_session.id))
+        drop_working_set(self.chat_session.id)
+        _drop_deferred_grades(str(self.chat_session.id))
+
+    def _record_progress(self) -> None:
+        section_by_question = {
+            question_id: self.working_set.section_for(question_id).id
+            for question_id in self.question_ids
+        }
+        try:
+            self.progress_service.record_session(
+                self.chat_session,
+                section_by_question,
+                Counter(section_by_question.values()),
+            )
+        except Exception as e:
+            logger.exception(f"Failed to update progress rollups: {e}")
+
+    def discard_chat_session(self) -> None:
+        """Drops the live session without recording it."""
+        if self.chat_session is not None:
+            self.session_store.delete(str(self.chat_session.id))
+            drop_working_set(self.chat_session.id)
+            _drop_deferred_grades(str(self.chat_session.id))
+        self.chat_session = None
 
     def calculate_overall_score(self) -> float:
         if self.chat_session is None:
             return 0
 
         assistant_feedback = self.get_assistant_feedback_scores()
+        if not assistant_feedback:
+            return 0
         return round(sum(assistant_feedback) / len(assistant_feedback), 1)
 
     def get_assistant_feedback_scores(self) -> List[float]:
         if self.chat_session is None:
             return []
-        return [
-            message.score
-            for message in self.chat_session.messages
-            if message.type == ChatMessageType.FEEDBACK
-        ]
+        return self.spilled_scores + self.messages.feedback_scores()
 
     def get_chat_session_summaries(
         self,
@@ -272,9 +877,37 @@ class ChatService:
         )
 
 
+def _shutdown_grading() -> None:
+    global _grading_executor
+    with _deferred_grades_lock:
+        executor, _grading_executor = _grading_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _reset_after_fork() -> None:
+    # The parent's grading threads don't exist in a forked child; pending
+    # answers are graded again on demand, see `_deferred_grade`
+    global _grading_executor, _deferred_grades_lock
+    _grading_executor = None
+    _deferred_grades.clear()
+    _deferred_grades_lock = threading.Lock()
+
+
+container.on_shutdown(_shutdown_grading)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
 def get_chat_service() -> ChatService:
+    """
+    A new service for one session, built from the shared dependencies. The
+    service holds the session's state, so it is never shared itself.
+    """
     return ChatService(
-        chat_session_repo=ChatSessionRepository(),
+        chat_session_repo=container.get("chat_session_repo", ChatSessionRepository),
         section_service=get_section_service(),
         book_service=get_book_service(),
+        session_store=container.get("session_store", get_session_store),
+        spaced_repetition=get_spaced_repetition_service(),
+        progress_service=get_progress_service(),
     )
@@ -0,0 +1,74 @@
+"""
+Process-wide service container.
+
+Repositories, stateless services and the clients they hold (Mongo, S3,
+OpenAI) are built lazily on first use and shared by every page run and
+thread of the process, so a Streamlit rerun doesn't construct any of them.
+Services that hold per-session state, like ChatService, are still built per
+run, from the shared dependencies.
+
+`shutdown()` runs the registered hooks (also at interpreter exit). A forked
+child starts with an empty container instead of the parent's instances,
+whose sockets, threads and locks can't be used after a fork; modules with
+their own process singletons reset them with `os.register_at_fork` too.
+"""
+
+import atexit
+import os
+import threading
+from collections.abc import Callable
+from typing import TypeVar
+
+from loguru import logger
+
+from db.mongo_connection import close_mongo_connection
+from llm.executor import shutdown_executor
+
+T = TypeVar("T")
+
+
+class ServiceContainer:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._instances: dict[str, object] = {}
+        self._shutdown_hooks: list[Callable[[], None]] = []
+
+    def get(self, name: str, factory: Callable[[], T]) -> T:
+        """The shared instance `name`, built with `factory` on first use."""
+        instance = self._instances.get(name)
+        if instance is None:
+            # Reentrant, so a factory can get its own dependencies
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = factory()
+                    logger.debug(f"Created {name}")
+        return instance
+
+    def on_shutdown(self, hook: Callable[[], None]) -> None:
+        """Registers `hook` to run on shutdown, in reverse registration order."""
+        with self._lock:
+            self._shutdown_hooks.append(hook)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            hooks = self._shutdown_hooks[::-1]
+            self._instances.clear()
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.warning(f"Shutdown hook {hook.__name__} failed: {e}")
+
+    def reset(self) -> None:
+        """Forgets the instances without shutting them down."""
+        self._lock = threading.RLock()
+        self._instances = {}
+
+
+container = ServiceContainer()
+container.on_shutdown(close_mongo_connection)
+container.on_shutdown(shutdown_executor)
+
+atexit.register(container.shutdown)
+os.register_at_fork(after_in_child=container.reset)
@@ -0,0 +1,196 @@
+"""
+Compact message history of a live chat session.
+
+Instead of one pydantic ChatMessage per message, the history is kept in
+parallel columns: IDs as 16 bytes each, role and type interned as one byte,
+scores in a float array, question IDs as indexes into a small table and
+feedback only for the rows that have it. ChatMessage objects are only built
+when the session is saved or recorded.
+"""
+
+import math
+import sys
+import uuid
+from array import array
+from collections.abc import Iterable, Iterator
+
+from models.chat_session import ChatMessage, ChatMessageRole, ChatMessageType
+
+_KINDS = tuple(
+    (role, message_type) for role in ChatMessageRole for message_type in ChatMessageType
+)
+_KIND_CODES = {kind: code for code, kind in enumerate(_KINDS)}
+_NO_QUESTION = -1
+
+
+class MessageLog:
+    __slots__ = (
+        "previous_message_id",
+        "_ids",
+        "_kinds",
+        "_contents",
+        "_question_refs",
+        "_scores",
+        "_feedback",
+        "_question_ids",
+        "_question_codes",
+        "_text_bytes",
+    )
+
+    def __init__(self, messages: Iterable[ChatMessage] = ()):
+        # ID of the message before the first one kept here, if that was spilled
+        self.previous_message_id: uuid.UUID | None = None
+        self._ids = bytearray()
+        self._kinds = array("B")
+        self._contents: list[str] = []
+        self._question_refs = array("i")
+        self._scores = array("d")
+        self._feedback: dict[int, str] = {}
+        self._question_ids: list[uuid.UUID] = []
+        self._question_codes: dict[uuid.UUID, int] = {}
+        self._text_bytes = 0
+
+        for index, message in enumerate(messages):
+            if index == 0:
+                self.previous_message_id = message.previous_message_id
+            self.append(
+                role=message.role,
+                type=message.type,
+                content=message.content,
+                question_id=message.question_id,
+                feedback=message.feedback,
+                score=message.score,
+                id=message.id,
+            )
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    @property
+    def last_id(self) -> uuid.UUID | None:
+        if not self._contents:
+            return self.previous_message_id
+        return self._message_id(len(self) - 1)
+
+    def append(
+        self,
+        role: ChatMessageRole,
+        type: ChatMessageType,
+        content: str,
+        question_id: uuid.UUID | None = None,
+        feedback: str | None = None,
+        score: float | None = None,
+        id: uuid.UUID | None = None,
+    ) -> None:
+        self._ids += (id or uuid.uuid4()).bytes
+        self._kinds.append(_KIND_CODES[(role, type)])
+        self._contents.append(content)
+        self._question_refs.append(self._question_code(question_id))
+        self._scores.append(math.nan if score is None else score)
+        if feedback is not None:
+            self._feedback[len(self._contents) - 1] = feedback
+            self._text_bytes += sys.getsizeof(feedback)
+        self._text_bytes += sys.getsizeof(content)
+
+    def _question_code(self, question_id: uuid.UUID | None) -> int:
+        if question_id is None:
+            return _NO_QUESTION
+        code = self._question_codes.get(question_id)
+        if code is None:
+            code = self._question_codes[question_id] = len(self._question_ids)
+            self._question_ids.append(question_id)
+        return code
+
+    def history(self) -> Iterator[tuple[str, str]]:
+        """(role, content) of every message, without building message objects."""
+        for code, content in zip(self._kinds, self._contents, strict=True):
+            yield _KINDS[code][0].value, content
+
+    def feedback_scores(self) -> list[float]:
+        return [
+            score
+            for code, score in zip(self._kinds, self._scores, strict=True)
+            if _KINDS[code][1] == ChatMessageType.FEEDBACK and not math.isnan(score)
+        ]
+
+    def to_messages(self, start: int = 0, stop: int | None = None) -> list[ChatMessage]:
+        messages = []
+        previous_message_id = (
+            self._message_id(start - 1) if start else self.previous_message_id
+        )
+        for index in range(start, len(self) if stop is None else stop):
+            role, message_type = _KINDS[self._kinds[index]]
+            question_ref = self._question_refs[index]
+            score = self._scores[index]
+            message = ChatMessage(
+                id=self._message_id(index),
+                previous_message_id=previous_message_id,
+                role=role,
+                type=message_type,
+                content=self._contents[index],
+                feedback=self._feedback.get(index),
+                score=None if math.isnan(score) else score,
+                question_id=(
+                    None
+                    if question_ref == _NO_QUESTION
+                    else self._question_ids[question_ref]
+                ),
+            )
+            messages.append(message)
+            previous_message_id = message.id
+        return messages
+
+    def _message_id(self, index: int) -> uuid.UUID:
+        return uuid.UUID(bytes=bytes(self._ids[index * 16 : index * 16 + 16]))
+
+    def pop_oldest(self, count: int) -> list[ChatMessage]:
+        """Removes the `count` oldest messages and returns them."""
+        popped = self.to_messages(stop=count)
+        if popped:
+            self.previous_message_id = popped[-1].id
+        for index in range(count):
+            self._text_bytes -= self._row_text_bytes(index)
+        del self._ids[: count * 16]
+        del self._kinds[:count]
+        del self._contents[:count]
+        del self._question_refs[:count]
+        del self._scores[:count]
+        self._feedback = {
+            index - count: feedback
+            for index, feedback in self._feedback.items()
+            if index >= count
+        }
+        return popped
+
+    def oldest_over(self, budget_bytes: int) -> int:
+        """
+        How many of the oldest messages to drop to fit in `budget_bytes`. The
+        latest message is always kept.
+        """
+        excess = self.memory_bytes() - budget_bytes
+        count = 0
+        while excess > 0 and count < len(self) - 1:
+            excess -= self._row_text_bytes(count)
+            count += 1
+        return count
+
+    def _row_text_bytes(self, index: int) -> int:
+        feedback = self._feedback.get(index)
+        return sys.getsizeof(self._contents[index]) + (
+            sys.getsizeof(feedback) if feedback is not None else 0
+        )
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the log, including the message texts."""
+        return (
+            sys.getsizeof(self._ids)
+            + sys.getsizeof(self._kinds)
+            + sys.getsizeof(self._contents)
+            + sys.getsizeof(self._question_refs)
+            + sys.getsizeof(self._scores)
+            + sys.getsizeof(self._feedback)
+            + sys.getsizeof(self._question_ids)
+            + sys.getsizeof(self._question_codes)
+            + len(self._question_ids) * sys.getsizeof(uuid.UUID(int=0))
+            + self._text_bytes
+        )
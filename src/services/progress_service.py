@@ -0,0 +1,182 @@
+"""
+Pre-aggregated progress rollups for dashboards.
+
+Every finished chat session adds its counts (sessions, questions offered,
+graded answers, score sum and score histogram) to the rollups of its book
+and of each of its sections, once for the day it started and once for all
+time. Dashboards read these small documents instead of scanning sessions.
+`python -m services.progress_service --rebuild` recomputes them from the
+recorded sessions.
+"""
+
+import argparse
+import uuid
+from collections import Counter, defaultdict
+from datetime import UTC, datetime, timedelta
+
+from loguru import logger
+
+from models.chat_session import ChatMessageType, ChatSessionDocument
+from models.progress_rollup import ALL_TIME, ProgressRollupDocument
+from repositories.chat_session_repo import ChatSessionRepository
+from repositories.progress_rollup_repo import ProgressRollupRepository
+from repositories.section_repo import SectionRepository
+from services.container import container
+
+
+def score_bucket(score: float) -> str:
+    return str(round(max(0.0, min(score, 10.0))))
+
+
+def session_rollups(
+    session: ChatSessionDocument,
+    section_by_question: dict[uuid.UUID, uuid.UUID],
+    questions_per_section: dict[uuid.UUID, int],
+) -> list[tuple[dict, dict]]:
+    """
+    The `(key, increments)` pairs a finished session adds to the rollups of
+    its book and sections, for its day and for all time.
+    """
+    started = session.created_at
+    if started.tzinfo is not None:
+        started = started.astimezone(UTC)
+    day = started.date().isoformat()
+
+    increments: dict[uuid.UUID | None, Counter] = defaultdict(Counter)
+    increments[None].update(sessions=1, questions=session.number_of_questions)
+    for section_id in session.section_ids:
+        increments[section_id].update(
+            sessions=1, questions=questions_per_section.get(section_id, 0)
+        )
+    for message in session.messages:
+        if message.type != ChatMessageType.FEEDBACK or message.score is None:
+            continue
+        section_id = section_by_question.get(message.question_id)
+        targets = [None] if section_id is None else [None, section_id]
+        for target in targets:
+            increments[target].update(
+                {
+                    "attempts": 1,
+                    "scoreSum": message.score,
+                    f"scoreHistogram.{score_bucket(message.score)}": 1,
+                }
+            )
+
+    rollups = []
+    for section_id, counts in increments.items():
+        for rollup_day in (day, ALL_TIME):
+            key = {
+                "userId": str(session.user_id),
+                "bookId": str(session.document_id),
+                "sectionId": str(section_id) if section_id else None,
+                "day": rollup_day,
+            }
+            rollups.append((key, dict(counts)))
+    return rollups
+
+
+class ProgressService:
+    def __init__(
+        self,
+        rollup_repo: ProgressRollupRepository,
+        chat_session_repo: ChatSessionRepository,
+        section_repo: SectionRepository,
+    ):
+        self.rollup_repo = rollup_repo
+        self.chat_session_repo = chat_session_repo
+        self.section_repo = section_repo
+
+    def record_session(
+        self,
+        session: ChatSessionDocument,
+        section_by_question: dict[uuid.UUID, uuid.UUID],
+        questions_per_section: dict[uuid.UUID, int],
+    ) -> None:
+        """Adds a newly finished session to the rollups."""
+        self.rollup_repo.increment(
+            session_rollups(session, section_by_question, questions_per_section)
+        )
+
+    def rebuild_rollups(self, user_id: str | None = None) -> int:
+        """
+        Recomputes the rollups (of one user, or everyone) from the recorded
+        sessions and returns the number of sessions counted. Questions are
+        mapped to sections as they are now, so questions deleted since a
+        session only count towards its book.
+        """
+        self.rollup_repo.delete_many({"userId": user_id} if user_id else {})
+
+        section_questions: dict[uuid.UUID, list[uuid.UUID]] = {}
+        count = 0
+        for session in self.chat_session_repo.iter_chat_sessions(user_id):
+            missing = [
+                str(section_id)
+                for section_id in session.section_ids
+                if section_id not in section_questions
+            ]
+            if missing:
+                for section in self.section_repo.list({"_id": {"$in": missing}}):
+                    section_questions[section.id] = [q.id for q in section.questions]
+
+            section_by_question = {}
+            questions_per_section = {}
+            for section_id in session.section_ids:
+                question_ids = section_questions.get(section_id, [])
+                questions_per_section[section_id] = len(question_ids)
+                section_by_question.update(dict.fromkeys(question_ids, section_id))
+            self.record_session(session, section_by_question, questions_per_section)
+            count += 1
+        return count
+
+    def get_totals(
+        self,
+        user_id: uuid.UUID,
+        book_id: uuid.UUID,
+        section_id: uuid.UUID | None = None,
+    ) -> ProgressRollupDocument | None:
+        return self.rollup_repo.get_rollup(
+            str(user_id), str(book_id), str(section_id) if section_id else None
+        )
+
+    def get_daily_trend(
+        self,
+        user_id: uuid.UUID,
+        book_id: uuid.UUID,
+        days: int = 30,
+        section_id: uuid.UUID | None = None,
+    ) -> list[ProgressRollupDocument]:
+        since = (datetime.now(UTC) - timedelta(days=days - 1)).date().isoformat()
+        return self.rollup_repo.list_days(
+            str(user_id),
+            str(book_id),
+            since,
+            section_id=str(section_id) if section_id else None,
+        )
+
+
+def get_progress_service() -> ProgressService:
+    return container.get(
+        "progress_service",
+        lambda: ProgressService(
+            ProgressRollupRepository(), ChatSessionRepository(), SectionRepository()
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain progress rollups")
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Recompute rollups from sessions"
+    )
+    parser.add_argument("--user-id", help="Only rebuild this user's rollups")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        count = get_progress_service().rebuild_rollups(args.user_id)
+        logger.info(f"Rebuilt progress rollups from {count} chat sessions")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
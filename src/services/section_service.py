@@ -1,18 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from io import BytesIO
+import threading
+from collections.abc import Callable
 import pypdf
+from pymongo.errors import DuplicateKeyError
+from config import settings
 from repositories.section_repo import SectionRepository
 from repositories.book_repo import BookRepository
 from services.book_service import BookService, get_book_service
-from models.section import QuestionItem, SectionDocument
+from services.container import container
+from models.base import stable_uuid4
+from models.section import QuestionGenerationProgress, QuestionItem, SectionDocument
+from services.single_flight import single_flight
+from loguru import logger
+from llm.governor import in_llm_context, llm_context
+from llm.map_reduce import candidates_per_window, make_windows, select_questions
+from llm.rate_limit import TokenBucket
+from llm.budget import CostEstimate, prompt_tokens
+from llm.retrieval import (
+    PASSAGE_SEPARATOR,
+    chunk_text,
+    get_index,
+    make_digest,
+    select_passages,
+)
+from llm.tokens import count_tokens
 from llm.llm import (
+    generate_question_reference,
     generate_questions,
     get_section_info,
     SectionInfoList,
     improve_question,
+    question_reference_prompt,
+    questions_prompt,
 )
+import math
 import uuid
 
 
+def normalize_question(question: str) -> str:
+    return " ".join(question.split())
+
+
+def set_section_text(section: SectionDocument, text: str) -> SectionDocument:
+    """Sets the text with its passages, token count and digest."""
+    section.text = text
+    section.passages = chunk_text(text, settings.PASSAGE_MAX_TOKENS)
+    section.token_count = count_tokens(text)
+    section.digest = make_digest(section.passages, settings.SECTION_DIGEST_TOKENS)
+    return section
+
+
+def section_tokens(section: SectionDocument) -> int:
+    """Stored token count, counted on the fly for sections created without one."""
+    if section.token_count is not None:
+        return section.token_count
+    return count_tokens(section.text)
+
+
 class SectionService:
     """
     Handles business logic for books/documents.
@@ -29,6 +75,35 @@ class SectionService:
     def get_sections_by_book_id(self, book_id: uuid.UUID) -> list[SectionDocument]:
         return self.section_repo.list({"bookId": str(book_id)})
 
+    def get_section_outlines(
+        self, book_id: uuid.UUID, with_questions: bool = False
+    ) -> list[SectionDocument]:
+        """
+        The book's sections without text, passages, digest or questions, for
+        pages that only list them. `with_questions` keeps only sections that
+        have questions.
+        """
+        filter_dict = {"bookId": str(book_id)}
+        if with_questions:
+            filter_dict["questions.0"] = {"$exists": True}
+        return self.section_repo.list_outlines(filter_dict)
+
+    def get_sections_by_ids(
+        self, section_ids: list[uuid.UUID]
+    ) -> list[SectionDocument]:
+        return self.section_repo.list(
+            {"_id": {"$in": [str(section_id) for section_id in section_ids]}}
+        )
+
+    @single_flight(
+        "create_sections",
+        "book_id",
+        "example_titles",
+        "start_page",
+        "content_end_page",
+        "preface_start_page",
+        "preface_end_page",
+    )
     def create_sections_magically(
         self,
         book_id: uuid.UUID,
@@ -50,6 +125,34 @@ class SectionService:
         section_info_list = get_section_info(
             content=preface_text, example_titles=example_titles
         )
+        return self.apply_section_info(
+            book_id,
+            section_info_list,
+            start_page=start_page,
+            content_end_page=content_end_page,
+            book_content_file=book_content_file,
+        )
+
+    def apply_section_info(
+        self,
+        book_id: uuid.UUID,
+        section_info_list: SectionInfoList,
+        start_page: int,
+        content_end_page: int,
+        book_content_file: bytes | None = None,
+        id_seed: str | None = None,
+    ) -> list[SectionDocument]:
+        """
+        Creates sections from extracted section info. A section that the book
+        already has (same name and start page) is kept instead of duplicated.
+        With `id_seed` the section IDs are derived from it, so re-applying the
+        same result skips the existing sections without reading their pages.
+        """
+        if book_content_file is None:
+            book_content_file = self.book_service.get_book_content(book_id)
+        if not book_content_file:
+            raise ValueError("Book content not found")
+
         filtered_sections = [
             section
             for section in section_info_list.sections_info
@@ -61,6 +164,13 @@ class SectionService:
         created_sections = []
         sorted_info = sorted(filtered_sections, key=lambda x: x.page_number)
         for idx, section_info in enumerate(sorted_info):
+            section_id = stable_uuid4(id_seed, idx) if id_seed is not None else None
+            if section_id is not None:
+                existing = self.section_repo.get(str(section_id))
+                if existing:
+                    created_sections.append(existing)
+                    continue
+
             # If there's a "next" section, end_page = next start_page - 1
             if idx < len(sorted_info) - 1:
                 next_start = sorted_info[idx + 1].page_number
@@ -74,19 +184,31 @@ class SectionService:
                 end_page=end_page + start_page - 3,
             )
 
-            section_document = SectionDocument(
-                book_id=book_id,
-                name=section_info.title,
-                start_page=section_info.page_number,
-                end_page=end_page,
-                text=text,
-                order=idx + 1,
+            section_document = set_section_text(
+                SectionDocument(
+                    book_id=book_id,
+                    name=section_info.title,
+                    start_page=section_info.page_number,
+                    end_page=end_page,
+                    order=idx + 1,
+                ),
+                text,
             )
-            saved = self.section_repo.create(section_document)
+            if section_id is not None:
+                section_document.id = section_id
+            saved = self.section_repo.create_if_absent(section_document)
             created_sections.append(saved)
 
+        self.update_book_token_count(book_id)
         return created_sections
 
+    def update_book_token_count(self, book_id: uuid.UUID) -> int:
+        token_count = sum(
+            section_tokens(section) for section in self.get_sections_by_book_id(book_id)
+        )
+        self.book_service.set_book_token_count(book_id, token_count)
+        return token_count
+
     def delete_section(self, section_id: uuid.UUID) -> None:
         """
         Deletes a section by its ID and reorders remaining sections.
@@ -96,7 +218,8 @@ class SectionService:
             raise ValueError(f"Section with id {section_id} not found")
 
         # Get all sections for the same book
-        book_sections = self.section_repo.list({"bookId": str(section.book_id)})
+        book_id = section.book_id
+        book_sections = self.section_repo.list({"bookId": str(book_id)})
         deleted_order = section.order
 
         # Delete the section first
@@ -116,6 +239,7 @@ class SectionService:
         # Bulk update all modified sections
         if sections_to_update:
             self.section_repo.bulk_update(sections_to_update)
+        self.update_book_token_count(book_id)
 
     def update_section(
         self,
@@ -145,9 +269,11 @@ class SectionService:
                 start_page=new_start_page + book.first_page - 2,
                 end_page=new_end_page + book.first_page - 3,
             )
-            section.text = updated_text
+            set_section_text(section, updated_text)
 
         updated_section = self.section_repo.update(section)
+        if pages_changed:
+            self.update_book_token_count(section.book_id)
         return updated_section
 
     def delete_all_sections(self, book_id: uuid.UUID) -> None:
@@ -155,6 +281,7 @@ class SectionService:
         Deletes all sections associated with a book.
         """
         self.section_repo.delete_many({"bookId": str(book_id)})
+        self.book_service.set_book_token_count(book_id, 0)
 
     def add_section_to_book(
         self, book_id: uuid.UUID, start_page: int, end_page: int, title: str, order: int
@@ -184,17 +311,27 @@ class SectionService:
                 self.section_repo.bulk_update(sections_to_update)
             new_order = order
 
-        section = SectionDocument(
-            book_id=book_id,
-            name=title,
-            start_page=start_page,
-            end_page=end_page,
-            text=text,
-            order=new_order,
+        section = set_section_text(
+            SectionDocument(
+                book_id=book_id,
+                name=title,
+                start_page=start_page,
+                end_page=end_page,
+                order=new_order,
+            ),
+            text,
         )
 
-        return self.section_repo.create(section)
+        try:
+            created = self.section_repo.create(section)
+        except DuplicateKeyError:
+            raise ValueError(
+                f"Section '{title}' starting on page {start_page} already exists"
+            )
+        self.update_book_token_count(book_id)
+        return created
 
+    @single_flight("generate_questions", "section_id", "num_questions")
     def generate_questions_magically(
         self, section_id: uuid.UUID, num_questions: int
     ) -> list[QuestionItem]:
@@ -205,14 +342,273 @@ class SectionService:
         if not section.text:
             raise ValueError(f"Section with id {section_id} has no text")
 
-        questions = generate_questions(section.text, num_questions)
+        return self._generate_section_questions(section, num_questions)
+
+    def _generate_section_questions(
+        self,
+        section: SectionDocument,
+        num_questions: int,
+        bucket: TokenBucket | None = None,
+        slots: threading.Semaphore | None = None,
+    ) -> list[QuestionItem]:
+        """
+        Generates, references and stores questions for one section. Every LLM
+        call holds one of `slots` while in flight; bulk generation passes the
+        same semaphore to all its sections so the per-question fan-out counts
+        against its concurrency limit instead of adding to it.
+        """
+        if slots is None:
+            slots = threading.Semaphore(settings.BULK_GENERATION_MAX_CONCURRENCY)
+        questions = self._generate_question_texts(
+            section, num_questions, bucket, slots
+        )
+        return self.add_generated_questions(
+            section, questions, bucket=bucket, slots=slots
+        )
+
+    def add_generated_questions(
+        self,
+        section: SectionDocument,
+        questions: list[str],
+        question_ids: list[uuid.UUID] | None = None,
+        bucket: TokenBucket | None = None,
+        slots: threading.Semaphore | None = None,
+    ) -> list[QuestionItem]:
+        """
+        Normalizes generated question texts, skips those the section already
+        has, references the rest and stores them. Pass stable `question_ids`
+        to make replaying the same questions a no-op.
+        """
+        if question_ids is None:
+            question_ids = [uuid.uuid4() for _ in questions]
+        existing_ids = {q.id for q in section.questions}
+        existing_texts = {q.question for q in section.questions}
         questions_to_create = [
-            QuestionItem(question=question.question, type="general")
-            for question in questions.questions
+            QuestionItem(id=question_id, question=question, type="general")
+            for question_id, question in zip(
+                question_ids, map(normalize_question, questions), strict=True
+            )
+            if question_id not in existing_ids and question not in existing_texts
         ]
-        section.questions.extend(questions_to_create)
-        self.section_repo.update(section)
-        return questions_to_create
+        with ThreadPoolExecutor(
+            max_workers=settings.BULK_GENERATION_MAX_CONCURRENCY
+        ) as executor:
+            list(
+                executor.map(
+                    in_llm_context(
+                        lambda item: self._add_question_reference(
+                            section, item, bucket, slots
+                        )
+                    ),
+                    questions_to_create,
+                )
+            )
+        return self.section_repo.add_questions(str(section.id), questions_to_create)
+
+    def _generate_question_texts(
+        self,
+        section: SectionDocument,
+        num_questions: int,
+        bucket: TokenBucket | None = None,
+        slots: threading.Semaphore | None = None,
+    ) -> list[str]:
+        """
+        Short sections are sent whole. Sections over QUESTION_WINDOW_TOKENS
+        are split into windows that get candidate questions concurrently, and
+        the candidates are merged and deduplicated locally. Each window call
+        holds one of `slots`, like every other call of the run.
+        """
+
+        def generate(content: str, count: int) -> list[str]:
+            questions = generate_questions(content, count, bucket=bucket).questions
+            return [q.question for q in questions]
+
+        if section_tokens(section) <= settings.QUESTION_WINDOW_TOKENS:
+            with slots or nullcontext():
+                return generate(section.text, num_questions)
+
+        passages = section.passages or chunk_text(
+            section.text, settings.PASSAGE_MAX_TOKENS
+        )
+        windows = make_windows(passages, settings.QUESTION_WINDOW_TOKENS)
+        per_window = candidates_per_window(num_questions, len(windows))
+
+        def generate_window(window: str) -> list[str]:
+            try:
+                with slots or nullcontext():
+                    return generate(window, per_window)
+            except Exception as e:
+                logger.warning(
+                    f"Question generation failed for a window of {section.id}: {e}"
+                )
+                return []
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(windows), settings.BULK_GENERATION_MAX_CONCURRENCY)
+        ) as executor:
+            candidates = list(executor.map(in_llm_context(generate_window), windows))
+        if not any(candidates):
+            raise ValueError(f"Couldn't generate questions for section {section.id}")
+
+        return select_questions(
+            candidates, num_questions, settings.QUESTION_MAX_SIMILARITY
+        )
+
+    def _add_question_reference(
+        self,
+        section: SectionDocument,
+        question_item: QuestionItem,
+        bucket: TokenBucket | None = None,
+        slots: threading.Semaphore | None = None,
+    ) -> QuestionItem:
+        """
+        Stores a reference answer, rubric and supporting passages on the
+        question so grading doesn't need the section text. Failures are
+        logged and leave the question without a reference.
+        """
+        if not section.text:
+            return question_item
+
+        passages = section.passages or chunk_text(
+            section.text, settings.PASSAGE_MAX_TOKENS
+        )
+        supporting_passages = select_passages(
+            get_index(str(section.id), passages),
+            question_item.question,
+            top_k=settings.RETRIEVAL_TOP_K,
+            token_budget=settings.REFERENCE_PASSAGES_TOKEN_BUDGET,
+        )
+        try:
+            with slots or nullcontext():
+                reference = generate_question_reference(
+                    question=question_item.question,
+                    section_content=PASSAGE_SEPARATOR.join(supporting_passages),
+                    bucket=bucket,
+                )
+        except Exception as e:
+            logger.warning(
+                f"Couldn't generate reference for question {question_item.id}: {e}"
+            )
+            question_item.reference_answer = None
+            question_item.rubric = []
+            question_item.supporting_passages = []
+            return question_item
+
+        question_item.reference_answer = reference.reference_answer
+        question_item.rubric = reference.rubric
+        question_item.supporting_passages = supporting_passages
+        return question_item
+
+    def estimate_question_generation(
+        self,
+        book_id: uuid.UUID,
+        num_questions: int,
+        section_ids: list[uuid.UUID] | None = None,
+    ) -> CostEstimate:
+        """
+        Upper-bound cost of generating `num_questions` per section, from the
+        stored token counts: the generation call(s) per section (one per
+        window for long sections) and one reference call per question.
+        """
+        section_ids = None if section_ids is None else {str(s) for s in section_ids}
+        questions_overhead = prompt_tokens(questions_prompt("", num_questions))
+        reference_tokens = (
+            prompt_tokens(question_reference_prompt("", ""))
+            + settings.REFERENCE_PASSAGES_TOKEN_BUDGET
+        )
+
+        sections = [
+            section
+            for section in self.get_section_outlines(book_id)
+            if section_ids is None or str(section.id) in section_ids
+        ]
+        # Sections stored without a token count are counted from their text
+        uncounted = [section.id for section in sections if section.token_count is None]
+        if uncounted:
+            counted = {
+                section.id: section for section in self.get_sections_by_ids(uncounted)
+            }
+            sections = [counted.get(section.id, section) for section in sections]
+
+        estimate = CostEstimate()
+        for section in sections:
+            if not (section.token_count or section.text):
+                continue
+            tokens = section_tokens(section)
+            windows = (
+                1
+                if tokens <= settings.QUESTION_WINDOW_TOKENS
+                else math.ceil(tokens / settings.QUESTION_WINDOW_TOKENS)
+            )
+            estimate.add(
+                "generate_questions", tokens + windows * questions_overhead, windows
+            )
+            estimate.add(
+                "question_reference", num_questions * reference_tokens, num_questions
+            )
+        return estimate
+
+    @single_flight("generate_book_questions", "book_id", "num_questions", "section_ids")
+    def generate_questions_for_book(
+        self,
+        book_id: uuid.UUID,
+        num_questions: int,
+        section_ids: list[uuid.UUID] | None = None,
+        on_progress: Callable[[QuestionGenerationProgress], None] | None = None,
+        max_concurrency: int | None = None,
+    ) -> list[QuestionGenerationProgress]:
+        """
+        Generates questions for every section of a book (or the given subset)
+        concurrently. At most `max_concurrency` requests are in flight, requests
+        are paced by a token bucket and each section is persisted as soon as its
+        questions arrive. `on_progress` is called from the calling thread.
+        The LLM calls queue at bulk priority under the book owner.
+        A duplicate call made while this one runs waits for it and returns
+        the same results without calling its own `on_progress`.
+        """
+        filter_dict = {"bookId": str(book_id), "text": {"$nin": [None, ""]}}
+        if section_ids is not None:
+            filter_dict["_id"] = {
+                "$in": [str(section_id) for section_id in section_ids]
+            }
+        sections = sorted(self.section_repo.list(filter_dict), key=lambda s: s.order)
+
+        bucket = TokenBucket.per_minute(settings.BULK_GENERATION_REQUESTS_PER_MINUTE)
+        max_workers = max_concurrency or settings.BULK_GENERATION_MAX_CONCURRENCY
+        slots = threading.Semaphore(max_workers)
+        results = []
+        if not sections:
+            return results
+
+        book = self.book_service.get_book(book_id)
+        with (
+            llm_context(user_id=book.user_id if book else None, priority="bulk"),
+            ThreadPoolExecutor(max_workers=max_workers) as executor,
+        ):
+            generate = in_llm_context(self._generate_section_questions)
+            futures = {
+                executor.submit(
+                    generate, section, num_questions, bucket, slots
+                ): section
+                for section in sections
+            }
+            for future in as_completed(futures):
+                section = futures[future]
+                progress = QuestionGenerationProgress(
+                    section_id=section.id,
+                    section_name=section.name,
+                    completed=len(results) + 1,
+                    total=len(sections),
+                )
+                try:
+                    progress.questions = future.result()
+                except Exception as e:
+                    progress.error = str(e)
+                results.append(progress)
+                if on_progress:
+                    on_progress(progress)
+
+        return results
 
     def get_questions_by_section_id(self, section_id: uuid.UUID) -> list[QuestionItem]:
         section = self.section_repo.get(str(section_id))
@@ -234,6 +630,7 @@ class SectionService:
             raise ValueError(f"Question with id {question_id} not found")
         return question
 
+    @single_flight("modify_question", "question_id", "section_id", "feedback")
     def modify_question_magically(
         self, question_id: uuid.UUID, section_id: uuid.UUID, feedback: str
     ) -> QuestionItem:
@@ -246,6 +643,7 @@ class SectionService:
             raise ValueError(f"Question with id {question_id} not found")
         improved_question = improve_question(question.question, feedback)
         question.question = improved_question.question
+        self._add_question_reference(section, question)
         self.section_repo.update_question(str(section_id), question)
         return question
 
@@ -267,10 +665,16 @@ class SectionService:
         if not section:
             raise ValueError(f"Section with id {section_id} not found")
 
-        question_item = QuestionItem(question=question, type=type)
-        section.questions.append(question_item)
-        self.section_repo.update(section)
+        question = normalize_question(question)
+        existing = self.section_repo.find_question_by_text(str(section_id), question)
+        if existing:
+            return existing
 
+        question_item = QuestionItem(question=question, type=type)
+        self._add_question_reference(section, question_item)
+        if not self.section_repo.add_questions(str(section_id), [question_item]):
+            # Added concurrently by another request
+            return self.section_repo.find_question_by_text(str(section_id), question)
         return question_item
 
     def update_question(
@@ -287,7 +691,9 @@ class SectionService:
         question_item = self.get_question_by_id(question_id, section_id)
         if not question_item:
             raise ValueError(f"Question with id {question_id} not found")
-        question_item.question = question
+        if question_item.question != question:
+            question_item.question = question
+            self._add_question_reference(section, question_item)
         if type:
             question_item.type = type
         self.section_repo.update_question(str(section_id), question_item)
@@ -299,8 +705,65 @@ class SectionService:
             raise ValueError(f"Question with id {question_id} not found")
         return section
 
+    def get_relevant_context(
+        self, section: SectionDocument, question: str, message: str | None = None
+    ) -> str:
+        """
+        Returns the part of the section text relevant to the question and the
+        user message: the top BM25 passages within RETRIEVAL_TOKEN_BUDGET, or
+        the whole text if it already fits. Sections without text but with
+        passages (compact copies) are retrieved from the passages.
+        """
+        if not section.text and not section.passages:
+            return ""
+        if section.text and section_tokens(section) <= settings.RETRIEVAL_TOKEN_BUDGET:
+            return section.text
+
+        passages = section.passages or chunk_text(
+            section.text, settings.PASSAGE_MAX_TOKENS
+        )
+        index = get_index(str(section.id), passages)
+        query = f"{question}\n{message}" if message else question
+        return PASSAGE_SEPARATOR.join(
+            select_passages(
+                index,
+                query,
+                top_k=settings.RETRIEVAL_TOP_K,
+                token_budget=settings.RETRIEVAL_TOKEN_BUDGET,
+            )
+        )
+
+    def get_grading_context(
+        self,
+        question_item: QuestionItem,
+        answer: str,
+        section: SectionDocument | None = None,
+    ) -> str:
+        """
+        Returns the compact reference stored on the question (model answer,
+        rubric and supporting passages). Questions created before references
+        existed fall back to passages retrieved from the section, which is
+        looked up unless given.
+        """
+        if not question_item.reference_answer:
+            section = section or self.get_section_by_question_id(question_item.id)
+            return self.get_relevant_context(section, question_item.question, answer)
+
+        rubric = "\n".join(f"- {criterion}" for criterion in question_item.rubric)
+        parts = [
+            f"Reference Answer:\n{question_item.reference_answer}",
+            f"Rubric:\n{rubric}",
+        ]
+        if question_item.supporting_passages:
+            parts.append(
+                "Supporting Passages:\n"
+                + PASSAGE_SEPARATOR.join(question_item.supporting_passages)
+            )
+        return "\n\n".join(parts)
+
 
 def get_section_service():
-    book_service = get_book_service()
-    section_repo = SectionRepository()
-    return SectionService(book_service, section_repo)
+    return container.get(
+        "section_service",
+        lambda: SectionService(get_book_service(), SectionRepository()),
+    )
@@ -0,0 +1,112 @@
+"""
+Single-flight execution of expensive service operations.
+
+Streamlit reruns and double clicks can start the same operation twice while
+the first one is still running. Operations decorated with `single_flight`
+are keyed by their name and the given arguments; a caller whose key is
+already in flight waits for that computation and gets its result (or
+exception) instead of starting another one. The registry is process-wide,
+so it works across reruns and freshly created service instances.
+"""
+
+import functools
+import inspect
+import os
+import threading
+import uuid
+from collections.abc import Callable, Hashable
+from typing import Any, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            logger.info(f"Joining in-flight operation {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> list[Hashable]:
+        with self._lock:
+            return list(self._calls)
+
+
+single_flight_group = SingleFlight()
+
+
+def _reset_after_fork() -> None:
+    # Calls in flight in the parent never finish in the child
+    global single_flight_group
+    single_flight_group = SingleFlight()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = tuple(_freeze(item) for item in value)
+        if isinstance(value, (set, frozenset)):
+            return tuple(sorted(items, key=str))
+        return items
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def single_flight(operation: str, *key_args: str):
+    """
+    Deduplicates concurrent calls of the decorated method that have the same
+    values for `key_args` (argument names).
+    """
+
+    def decorator(method: Callable[..., T]) -> Callable[..., T]:
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs) -> T:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (operation, *(_freeze(bound.arguments[name]) for name in key_args))
+            return single_flight_group.do(key, lambda: method(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
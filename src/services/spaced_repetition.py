@@ -0,0 +1,128 @@
+"""
+SM-2 spaced-repetition scheduling of questions.
+
+Every graded answer updates the per-user stats of its question (ease,
+interval, last score, due date). The next question of a session is the
+weakest due one, then one the user has never answered, then the one due
+soonest, each found with an indexed query on the stats collection.
+"""
+
+import uuid
+from datetime import UTC, datetime, timedelta
+
+from loguru import logger
+
+from models.base import stable_uuid4
+from models.question_stats import QuestionStatsDocument
+from repositories.question_stats_repo import QuestionStatsRepository
+from services.container import container
+
+MIN_EASE = 1.3
+# Optimistic retries when two reviews of the same question race
+MAX_REVIEW_ATTEMPTS = 5
+
+
+def sm2_review(
+    stats: QuestionStatsDocument, score: float, now: datetime
+) -> tuple[dict, bool]:
+    """
+    SM-2 update for a review scored 0-10 (mapped to quality 0-5). Returns
+    the fields to set and whether the review was a lapse.
+    """
+    quality = max(0.0, min(score, 10.0)) / 2
+    lapsed = quality < 3
+    if lapsed:
+        repetitions = 0
+        interval_days = 1.0
+    else:
+        repetitions = stats.repetitions + 1
+        if repetitions == 1:
+            interval_days = 1.0
+        elif repetitions == 2:
+            interval_days = 6.0
+        else:
+            interval_days = round(stats.interval_days * stats.ease, 1)
+    ease = max(
+        MIN_EASE, stats.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    )
+    return {
+        "ease": round(ease, 3),
+        "intervalDays": interval_days,
+        "repetitions": repetitions,
+        "lastScore": score,
+        "lastReviewedAt": now,
+        "due": now + timedelta(days=interval_days),
+    }, lapsed
+
+
+class SpacedRepetitionService:
+    def __init__(self, stats_repo: QuestionStatsRepository):
+        self.stats_repo = stats_repo
+
+    def record_review(
+        self,
+        user_id: uuid.UUID,
+        question_id: uuid.UUID,
+        section_id: uuid.UUID,
+        book_id: uuid.UUID,
+        score: float,
+        now: datetime | None = None,
+    ) -> None:
+        now = now or datetime.now(UTC)
+        stats_id = str(stable_uuid4(user_id, question_id))
+        for _ in range(MAX_REVIEW_ATTEMPTS):
+            stats = self.stats_repo.get(stats_id) or QuestionStatsDocument(
+                id=stats_id,
+                user_id=user_id,
+                question_id=question_id,
+                section_id=section_id,
+                book_id=book_id,
+            )
+            updates, lapsed = sm2_review(stats, score, now)
+            if self.stats_repo.apply_review(stats, updates, score, lapsed):
+                return
+        logger.warning(f"Couldn't record review of question {question_id}: conflicts")
+
+    def next_question_id(
+        self,
+        user_id: uuid.UUID,
+        section_ids: list[uuid.UUID],
+        candidate_ids: list[uuid.UUID],
+        exclude_ids: set[uuid.UUID],
+        now: datetime | None = None,
+    ) -> uuid.UUID | None:
+        """
+        Picks from `candidate_ids` (the session's questions, in their
+        preferred order for new questions) excluding `exclude_ids`.
+        """
+        now = now or datetime.now(UTC)
+        user = str(user_id)
+        sections = [str(section_id) for section_id in section_ids]
+        remaining = [
+            str(question_id)
+            for question_id in candidate_ids
+            if question_id not in exclude_ids
+        ]
+        if not remaining:
+            return None
+
+        # Only the session's own questions are considered, so stats left over
+        # from deleted or other questions of the sections can't shadow them
+        due = self.stats_repo.next_due(user, sections, now, remaining)
+        if due is not None:
+            return due.question_id
+
+        reviewed = self.stats_repo.reviewed_question_ids(user, sections)
+        for question_id in candidate_ids:
+            if question_id not in exclude_ids and str(question_id) not in reviewed:
+                return question_id
+
+        scheduled = self.stats_repo.next_scheduled(user, sections, remaining)
+        return scheduled.question_id if scheduled is not None else None
+
+
+def get_spaced_repetition_service() -> SpacedRepetitionService:
+    return container.get(
+        "spaced_repetition_service",
+        lambda: SpacedRepetitionService(QuestionStatsRepository()),
+    )
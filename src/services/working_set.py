@@ -0,0 +1,93 @@
+"""
+Per-session working set for the chat hot path.
+
+Built once from the selected sections when a chat session starts (or is
+resumed), it maps every question to a compact copy of its section: no
+questions, and no full text when the passages already cover it. Chat turns
+look up questions and section context here instead of reading sections
+from the database. Working sets are cached per process by session ID.
+"""
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from config import settings
+from models.section import QuestionItem, SectionDocument
+from services.section_service import section_tokens
+
+WORKING_SET_CACHE_SIZE = 256
+
+
+class ChatWorkingSet:
+    def __init__(self, sections: list[SectionDocument]):
+        self.questions: dict[uuid.UUID, QuestionItem] = {}
+        self._section_by_question: dict[uuid.UUID, SectionDocument] = {}
+        self._question_contexts: dict[uuid.UUID, str] = {}
+
+        for section in sections:
+            compact = section.model_copy(
+                update={
+                    "questions": [],
+                    "token_count": section_tokens(section),
+                    "text": (
+                        None
+                        if section.passages
+                        and section_tokens(section) > settings.RETRIEVAL_TOKEN_BUDGET
+                        else section.text
+                    ),
+                }
+            )
+            for question in section.questions:
+                self.questions[question.id] = question
+                self._section_by_question[question.id] = compact
+
+    def section_for(self, question_id: uuid.UUID) -> SectionDocument:
+        section = self._section_by_question.get(question_id)
+        if section is None:
+            raise ValueError(f"Question with id {question_id} not found")
+        return section
+
+    def question_context(self, question_id: uuid.UUID, build) -> str:
+        """Section context retrieved for the question alone, built once per question."""
+        context = self._question_contexts.get(question_id)
+        if context is None:
+            context = self._question_contexts[question_id] = build(
+                self.section_for(question_id)
+            )
+        return context
+
+
+_working_sets: OrderedDict[str, ChatWorkingSet] = OrderedDict()
+_working_sets_lock = threading.Lock()
+
+
+def get_cached_working_set(session_id: uuid.UUID | str) -> ChatWorkingSet | None:
+    with _working_sets_lock:
+        working_set = _working_sets.get(str(session_id))
+        if working_set is not None:
+            _working_sets.move_to_end(str(session_id))
+        return working_set
+
+
+def cache_working_set(session_id: uuid.UUID | str, working_set: ChatWorkingSet) -> None:
+    with _working_sets_lock:
+        _working_sets[str(session_id)] = working_set
+        _working_sets.move_to_end(str(session_id))
+        while len(_working_sets) > WORKING_SET_CACHE_SIZE:
+            _working_sets.popitem(last=False)
+
+
+def drop_working_set(session_id: uuid.UUID | str) -> None:
+    with _working_sets_lock:
+        _working_sets.pop(str(session_id), None)
+
+
+def _reset_after_fork() -> None:
+    global _working_sets_lock
+    _working_sets_lock = threading.Lock()
+    _working_sets.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
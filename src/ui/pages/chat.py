@@ -2,6 +2,8 @@ import streamlit as st
 
 from services.book_service import get_book_service
 from services.chat_service import get_chat_service
+from services.progress_service import get_progress_service
+from services.section_service import get_section_service
 
 st.set_page_config(
     page_title="Book Q&A Session", page_icon=":question:", layout="centered"
@@ -9,6 +11,32 @@ st.set_page_config(
 
 st.title("Book Q&A Session")
 
+book_service = get_book_service()
+chat_service = get_chat_service()
+
+# Only the session ID is kept in the browser session (and the URL, to resume
+# after a reconnect to another replica); the session state itself is loaded
+# from the session store on every run.
+session_id = st.session_state.get("chat_session_id") or st.query_params.get("session")
+if session_id and not chat_service.load_session(session_id):
+    session_id = None
+if session_id:
+    st.session_state["chat_session_id"] = session_id
+    st.query_params["session"] = session_id
+    if "selected_doc" not in st.session_state:
+        st.session_state["selected_doc"] = book_service.get_book(
+            chat_service.chat_session.document_id
+        )
+else:
+    st.session_state.pop("chat_session_id", None)
+    st.query_params.pop("session", None)
+
+
+def end_session():
+    st.session_state.pop("chat_session_id", None)
+    st.query_params.pop("session", None)
+
+
 if "selected_doc" not in st.session_state:
     st.warning("No document selected. Please return to the library.")
     if st.button("Go to Library"):
@@ -18,8 +46,7 @@ if "selected_doc" not in st.session_state:
 doc = st.session_state.get("selected_doc")
 DOC_TITLE = doc.title
 
-book_service = get_book_service()
-sections = book_service.get_book_sections(doc.id, with_questions=True)
+sections = get_section_service().get_section_outlines(doc.id, with_questions=True)
 
 st.subheader(f"Document: {DOC_TITLE}")
 
@@ -31,9 +58,10 @@ if st.button("Return to Library"):
 
 section_names = [sec.name for sec in sections]
 chosen = st.multiselect("Sections", options=section_names, default=section_names[:1])
-active_chat_session = st.session_state.get("chat_session_active", False)
+active_chat_session = bool(session_id) and not chat_service.exam
+active_exam = bool(session_id) and chat_service.exam
 
-if not active_chat_session:
+if not active_chat_session and not active_exam:
     if st.session_state.get("session_summary"):
         with st.container():
             session_summary = st.session_state.get("session_summary")
@@ -59,65 +87,167 @@ if not active_chat_session:
             for title in session_summary.section_titles:
                 st.markdown(f"- {title}")
 
-    start_quiz = st.button("Start Q&A Session")
-    if start_quiz:
+            for result in st.session_state.get("exam_results") or []:
+                label = (
+                    f"{result.question} — {result.score:.1f}"
+                    if result.error is None
+                    else f"{result.question} — not graded"
+                )
+                with st.expander(label):
+                    st.markdown(f"**Your answer:** {result.answer}")
+                    st.markdown(result.feedback or f"Grading failed: {result.error}")
+
+    progress_service = get_progress_service()
+    totals = progress_service.get_totals(doc.user_id, doc.id)
+    if totals is not None:
+        with st.expander("Your Progress", expanded=False):
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Sessions", totals.sessions)
+            col2.metric("Mean Score", f"{totals.mean_score or 0.0:.1f}")
+            col3.metric("Completion Rate", f"{totals.completion_rate * 100:.1f}%")
+
+            trend = progress_service.get_daily_trend(doc.user_id, doc.id)
+            if trend:
+                days = [rollup.day for rollup in trend]
+                st.markdown("#### Last 30 Days")
+                st.line_chart(
+                    {"Day": days, "Mean Score": [r.mean_score for r in trend]},
+                    x="Day",
+                )
+                st.bar_chart(
+                    {"Day": days, "Answers": [r.attempts for r in trend]}, x="Day"
+                )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        start_quiz = st.button("Start Q&A Session")
+        deferred_grading = st.toggle(
+            "Grade answers in the background",
+            help="Go straight to the next question; feedback shows up when it's ready.",
+        )
+    with col2:
+        start_exam = st.button("Start Exam")
+    if start_quiz or start_exam:
         section_ids = [sec.id for sec in sections if sec.name in chosen]
-        chat_service = get_chat_service()
         chat_service.init_chat_session(
             user_id=doc.user_id,
             document_id=doc.id,
             section_ids=section_ids,
+            deferred_grading=bool(start_quiz) and deferred_grading,
+            exam=bool(start_exam),
         )
-        st.session_state["chat_service"] = chat_service
-        st.session_state["chat_session_active"] = True
+        st.session_state["chat_session_id"] = str(chat_service.session_id)
         st.session_state["session_summary"] = None
+        st.session_state["exam_results"] = None
+        st.rerun()
+
+
+@st.fragment
+def exam_panel(session_id: str):
+    """Exam form; submitting reruns only this fragment until the exam ends."""
+    chat_service = get_chat_service()
+    if not chat_service.load_session(session_id):
+        end_session()
+        st.rerun()
+
+    st.caption("Answer the questions you can and submit them all at once.")
+
+    with st.form("exam_form"):
+        answers = {
+            question.id: st.text_area(
+                f"{idx}. {question.question}", key=f"exam_answer_{question.id}"
+            )
+            for idx, question in enumerate(chat_service.questions, start=1)
+        }
+        submitted = st.form_submit_button("Submit Exam")
+
+    if st.button("Cancel Exam"):
+        chat_service.discard_chat_session()
+        end_session()
+        st.rerun()
+
+    if submitted:
+        try:
+            with st.spinner("Grading your answers..."):
+                results = chat_service.grade_exam(answers)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        chat_service.finish_chat_session()
+        st.session_state["session_summary"] = chat_service.make_session_summary()
+        st.session_state["exam_results"] = results
+        end_session()
+        st.rerun()
+
+
+@st.fragment
+def chat_panel(session_id: str):
+    """
+    The live Q&A session. Sending a message reruns only this fragment, which
+    reloads the session state (its sections come from the working set) but
+    not the book or its sections. Ending the session reruns the page.
+    """
+    chat_service = get_chat_service()
+    if not chat_service.load_session(session_id):
+        end_session()
         st.rerun()
 
-if active_chat_session:
     finish_quiz = st.button("Finish Q&A Session")
     if finish_quiz:
-        st.session_state["chat_session_active"] = False
-        chat_service = st.session_state["chat_service"]
-        chat_service.finish_chat_session()
+        end_session()
+        with st.spinner("Waiting for outstanding grades..."):
+            chat_service.finish_chat_session()
         st.info("Q&A Session finished")
         session_summary = chat_service.make_session_summary()
         st.session_state["session_summary"] = session_summary
         st.rerun()
 
-    chat_service = st.session_state["chat_service"]
+    if chat_service.current_question is None:
+        chat_service.get_next_question()
+
+    # Polls for background grades while there are any, so feedback shows up
+    # without the user having to send another message.
+    @st.fragment(run_every=2 if chat_service.pending_grades else None)
+    def show_chat_history():
+        chat_service.collect_graded_answers()
 
-    total_questions = len(chat_service.questions)
-    answered_questions = len(chat_service.get_assistant_feedback_scores())
+        total_questions = len(chat_service.question_ids)
+        answered_questions = len(chat_service.get_assistant_feedback_scores())
 
-    if total_questions > 0:
-        answered_fraction = answered_questions / total_questions
-    else:
-        answered_fraction = 0
+        if total_questions > 0:
+            answered_fraction = answered_questions / total_questions
+        else:
+            answered_fraction = 0
 
-    st.progress(answered_fraction)
-    st.caption(f"Answered {answered_questions} out of {total_questions} questions")
+        st.progress(answered_fraction)
+        st.caption(f"Answered {answered_questions} out of {total_questions} questions")
+        if chat_service.pending_grades:
+            st.caption(f"Grading {chat_service.pending_grades} answer(s)...")
 
-    messages = chat_service.get_history_messages()
+        if chat_service.spilled_messages:
+            st.caption(f"{chat_service.spilled_messages} earlier messages not shown")
+        for role, content in chat_service.get_history_messages():
+            with st.chat_message(role):
+                st.markdown(content)
 
-    if len(messages) == 0:
-        next_question = chat_service.get_next_question()
-        with st.chat_message("assistant"):
-            st.markdown(next_question.question)
-    else:
-        for message in messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    show_chat_history()
 
     if prompt := st.chat_input("Input here"):
         with st.chat_message("user"):
             st.markdown(prompt)
 
+        if prompt.lower() != "next" and not chat_service.deferred_grading:
+            with st.chat_message("assistant"):
+                st.write_stream(chat_service.stream_user_message(prompt))
+            return
+
         result = chat_service.process_user_message(prompt)
 
         if result == "__ALL_DONE__":
-            st.session_state["chat_session_active"] = False
+            end_session()
 
-            chat_service.finish_chat_session()
+            with st.spinner("Waiting for outstanding grades..."):
+                chat_service.finish_chat_session()
 
             session_summary = chat_service.make_session_summary()
             st.session_state["session_summary"] = session_summary
@@ -125,6 +255,16 @@ if active_chat_session:
             st.info("All questions answered. Q&A Session finished automatically!")
 
             st.rerun()
+        elif chat_service.deferred_grading:
+            # The reply is in the history; render it inside the polled fragment
+            st.rerun(scope="fragment")
         else:
             with st.chat_message("assistant"):
                 st.markdown(result)
+
+
+if active_exam:
+    exam_panel(session_id)
+
+if active_chat_session:
+    chat_panel(session_id)
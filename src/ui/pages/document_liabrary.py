@@ -1,7 +1,6 @@
 import streamlit as st
 import uuid
 
-from models.book import BookDocument
 from services.book_service import get_book_service
 
 st.set_page_config(page_title="Document Library", page_icon=":books:")
@@ -47,31 +46,51 @@ if upload_button:
 
 st.write("---")
 
-all_books = book_service.get_books_by_user_id(user_id=DEMO_USER_ID)
+SORT_LABELS = {
+    "newest": "Newest first",
+    "oldest": "Oldest first",
+    "title": "Title (A-Z)",
+    "title_desc": "Title (Z-A)",
+}
 
 # --- Documents List / Library ---
-if len(all_books) == 0:
-    st.info("No documents uploaded yet. Upload a PDF to get started!")
-    st.stop()
+col_search, col_sort = st.columns([0.7, 0.3])
+with col_search:
+    search_query = st.text_input("Search by title", "")
+with col_sort:
+    sort = st.selectbox(
+        "Sort by", options=list(SORT_LABELS), format_func=SORT_LABELS.get
+    )
 
-# Search / Filter (simple approach)
-search_query = st.text_input("Search by title", "")
+# One page is loaded per run; the cursors of the pages visited so far are
+# kept to go back, and reset when the search or the sort order changes.
+if st.session_state.get("library_query") != (search_query, sort):
+    st.session_state["library_query"] = (search_query, sort)
+    st.session_state["library_cursors"] = [None]
+cursors = st.session_state["library_cursors"]
 
+page = book_service.search_books(
+    user_id=DEMO_USER_ID, query=search_query, sort=sort, cursor=cursors[-1]
+)
 
-# Filter docs by search query
-def matches_search(doc: BookDocument, query: str) -> bool:
-    return query.lower() in doc.title.lower()
+if not page.items and len(cursors) == 1:
+    if search_query.strip():
+        st.warning("No documents match your search.")
+    else:
+        st.info("No documents uploaded yet. Upload a PDF to get started!")
+    st.stop()
 
+st.write(f"### Documents (page {len(cursors)})")
 
-filtered_docs = [doc for doc in all_books if matches_search(doc, search_query)]
 
-st.write(f"### Documents ({len(filtered_docs)})")
-if not filtered_docs:
-    st.warning("No documents match your search.")
-    st.stop()
+def open_book(book_id: uuid.UUID, target: str):
+    # Listings only carry the list fields; pages get the full document
+    st.session_state["selected_doc"] = book_service.get_book(book_id)
+    st.switch_page(target)
+
 
 # Display each document as a card or row
-for doc in filtered_docs:
+for doc in page.items:
     with st.expander(f"**{doc.title}**", expanded=False):
         st.write(f"**Date Uploaded:** {doc.created_at}")
         st.write(f"**Pages:** {doc.metadata.pages}")
@@ -84,17 +103,22 @@ for doc in filtered_docs:
         colA, colB, colC = st.columns(3)
         with colA:
             if st.button("View / Edit", key=f"view_{doc.id}"):
-                # Store the selected document ID in session_state
-                st.session_state["selected_doc"] = doc
-                st.switch_page("pages/document_detail.py")
+                open_book(doc.id, "pages/document_detail.py")
         with colB:
             if st.button("Start Q&A", key=f"qa_{doc.id}"):
-                # For demonstration, treat Q&A similarly (go to detail page, or start a chat session)
-                # st.session_state["selected_doc_id"] = doc.id
-                st.session_state["selected_doc"] = doc
-                st.switch_page("pages/chat.py")
+                open_book(doc.id, "pages/chat.py")
         with colC:
             if st.button("Delete", key=f"del_{doc.id}"):
                 book_service.delete_book(doc.id)
                 st.warning(f"Document '{doc.title}' has been deleted.")
                 st.rerun()
+
+col_prev, col_next = st.columns(2)
+with col_prev:
+    if st.button("Previous page", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+with col_next:
+    if st.button("Next page", disabled=page.next_cursor is None):
+        cursors.append(page.next_cursor)
+        st.rerun()